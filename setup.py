@@ -17,13 +17,14 @@ setup(name='weatherflow2mqtt',
       url='https://github.com/briis/hass-weatherflow2mqtt',
       package_data={
           '': ['LICENSE.txt'],
-          'weatherflow2mqtt': ['translations/*.json'],
+          'weatherflow2mqtt': ['translations/*.json', 'fixtures/*.json'],
       },
       include_package_data=True,
       packages=['weatherflow2mqtt'],
       entry_points={
           'console_scripts': [
-              'weatherflow2mqtt = weatherflow2mqtt.__main__:main'
+              'weatherflow2mqtt = weatherflow2mqtt.__main__:main',
+              'weatherflow2mqtt-replay = weatherflow2mqtt.replay:main'
           ]
       },
       license='MIT',
@@ -0,0 +1,104 @@
+"""Tests of the processing of a better_forecast response."""
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from weatherflow2mqtt.const import FORECAST_HOURLY_HOURS, UNITS_METRIC
+from weatherflow2mqtt.forecast import Forecast, daily_aggregates
+from weatherflow2mqtt.helpers import ConversionFunctions
+from weatherflow2mqtt.replay import FORECAST_FIXTURE, response_time
+
+FIXTURE = Path(FORECAST_FIXTURE)
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    """Use the time zone of the fixture, which has its local days in UTC."""
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.fixture
+def response() -> dict:
+    """Return the recorded response."""
+    return json.loads(FIXTURE.read_text())
+
+
+def test_fixture_is_installed():
+    """Test the fixture of the replay forecast command is in the package."""
+    package = Path(__file__).parent.parent / "weatherflow2mqtt"
+    assert FIXTURE.resolve().parent.parent == package.resolve()
+    assert FIXTURE.is_file()
+
+
+def test_daily_aggregates(response):
+    """Test the hourly rows are summed up by local day."""
+    hourly = response["forecast"]["hourly"]
+    aggregates = daily_aggregates(hourly)
+
+    assert sorted(aggregates) == [1, 2, 3, 4]
+    for day, aggregate in aggregates.items():
+        rows = [row for row in hourly if row["local_day"] == day]
+        assert aggregate.precip == pytest.approx(sum(row["precip"] for row in rows))
+        assert aggregate.wind_avg == pytest.approx(
+            sum(row["wind_avg"] for row in rows) / len(rows)
+        )
+    # The winds of day 2 alternate between 350° and 10°, so blow from the north
+    bearing = aggregates[2].wind_bearing
+    assert min(bearing, 360 - bearing) == pytest.approx(0, abs=1e-6)
+
+
+def process(response: dict) -> tuple[dict, dict]:
+    """Return the state and attributes of the response, as of its time."""
+    forecast = Forecast(
+        station_id="", token="", conversions=ConversionFunctions(UNITS_METRIC, "en")
+    )
+    return forecast.process_forecast(response, response_time(response))
+
+
+def test_process_forecast(utc, response):
+    """Test the state and attributes made of the response."""
+    condition_data, fcst_data = process(response)
+
+    assert condition_data == {"weather": "partlycloudy"}
+    assert fcst_data["temp_high_today"] == response["forecast"]["daily"][0][
+        "air_temp_high"
+    ]
+
+    daily = fcst_data["daily_forecast"]
+    assert [day["datetime"] for day in daily] == [
+        f"2024-06-0{day}T00:00:00+00:00" for day in range(1, 6)
+    ]
+    assert [day["wind_bearing"] for day in daily] == [208, 0, 168, 185, 0]
+    assert [day["wind_direction_cardinal"] for day in daily] == [
+        "SSW",
+        "N",
+        "SSE",
+        "S",
+        "N",
+    ]
+    # The last day is beyond the hourly forecast
+    assert daily[4]["precipitation"] == 0
+    assert daily[4]["wind_speed"] == 0
+
+    hourly = fcst_data["hourly_forecast"]
+    assert len(hourly) == FORECAST_HOURLY_HOURS
+    assert hourly[0]["datetime"] == "2024-06-01T10:00:00+00:00"
+
+
+@pytest.mark.parametrize("bearing", range(0, 360, 5))
+def test_daily_wind_bearing(utc, response, bearing):
+    """Test a day with a constant wind direction has exactly that bearing."""
+    for row in response["forecast"]["hourly"]:
+        if row["local_day"] == 4:
+            row["wind_direction"] = bearing
+    _, fcst_data = process(response)
+
+    assert fcst_data["daily_forecast"][3]["wind_bearing"] == bearing
@@ -0,0 +1,107 @@
+"""Tests of the Prometheus metrics endpoint."""
+from __future__ import annotations
+
+import asyncio
+import re
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from weatherflow2mqtt.metrics import LATENCY_BUCKETS, PREFIX, Metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*"'
+SAMPLE = re.compile(
+    rf"^(?P<name>{NAME})(?P<labels>\{{{LABEL}(?:,{LABEL})*\}})? "
+    r"(?P<value>-?(?:[0-9.]+(?:e[+-]?[0-9]+)?|Inf)|NaN)$"
+)
+TYPE = re.compile(rf"^# TYPE (?P<name>{NAME}) (counter|gauge|histogram)$")
+HELP = re.compile(rf"^# HELP {NAME} .*$")
+CALLS = 5
+
+
+class Pipeline:
+    """Methods to time."""
+
+    def parse(self, packet: str) -> str:
+        """Return the packet."""
+        return packet
+
+    async def publish(self, topic: str) -> None:
+        """Do nothing."""
+
+
+async def scrape(metrics: Metrics) -> tuple[str, str]:
+    """Return the content type and the text of a scrape."""
+    async with TestClient(TestServer(metrics.application())) as client:
+        response = await client.get("/metrics")
+        assert response.status == 200
+        return response.headers["Content-Type"], await response.text()
+
+
+def test_scrape():
+    """Test a scrape of the wrapped calls is in the text format 0.0.4."""
+    metrics = Metrics()
+    pipeline = Pipeline()
+    metrics.wrap(
+        pipeline,
+        "parse",
+        "parse_seconds",
+        "Time to parse a packet",
+        count=("packets_total", "Packets parsed", lambda packet: (("type", packet),)),
+        stage="parse",
+    )
+    metrics.wrap(
+        pipeline, "publish", "publish_seconds", "Time to publish", stage="mqtt"
+    )
+    metrics.gauge("queue_size", lambda: 3, "Calls waiting")
+    for call in range(CALLS):
+        pipeline.parse("obs_st" if call % 2 else 'quote"d')
+        asyncio.run(pipeline.publish("topic"))
+
+    content_type, text = asyncio.run(scrape(metrics))
+
+    assert content_type == CONTENT_TYPE
+    assert text.endswith("\n")
+    types = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith("# TYPE"):
+            assert (match := TYPE.match(line)), line
+            types[match["name"]] = match[2]
+        elif line.startswith("#"):
+            assert HELP.match(line), line
+        else:
+            assert (match := SAMPLE.match(line)), line
+            samples.append(match)
+    assert types == {
+        f"{PREFIX}packets_total": "counter",
+        f"{PREFIX}parse_seconds": "histogram",
+        f"{PREFIX}publish_seconds": "histogram",
+        f"{PREFIX}queue_size": "gauge",
+    }
+    for sample in samples:
+        name = re.sub(r"_(bucket|sum|count)$", "", sample["name"])
+        assert sample["name"] in types or types.get(name) == "histogram", sample[0]
+
+    counts = {
+        sample["labels"]: float(sample["value"])
+        for sample in samples
+        if sample["name"] == f"{PREFIX}packets_total"
+    }
+    assert counts == {'{type="obs_st"}': 2, '{type="quote\\"d"}': 3}
+
+    for name in ("parse_seconds", "publish_seconds"):
+        buckets = [
+            sample for sample in samples if sample["name"] == f"{PREFIX}{name}_bucket"
+        ]
+        (count,) = (
+            float(sample["value"])
+            for sample in samples
+            if sample["name"] == f"{PREFIX}{name}_count"
+        )
+        bounds = [re.search(r'le="([^"]*)"', bucket["labels"])[1] for bucket in buckets]
+        assert bounds == [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        values = [float(bucket["value"]) for bucket in buckets]
+        assert values == sorted(values)
+        assert values[-1] == count == CALLS
@@ -0,0 +1,60 @@
+"""Tests of the selection of the sensor states to publish."""
+from __future__ import annotations
+
+from dataclasses import replace
+
+import pytest
+from pyweatherflowudp.device import EVENT_OBSERVATION
+
+from weatherflow2mqtt.const import DEADBAND_MAX_AGE
+from weatherflow2mqtt.sensor_description import BaseSensorDescription
+from weatherflow2mqtt.state_filter import StateFilter
+
+TOPIC = "homeassistant/sensor/wf-ST-00000512/illuminance/state"
+ILLUMINANCE = BaseSensorDescription(
+    id="illuminance",
+    name="Illuminance",
+    event=EVENT_OBSERVATION,
+    deadband=0.05,
+    relative_deadband=True,
+)
+
+
+def publish(state_filter: StateFilter, value: float, now: float, sensor) -> bool:
+    """Offer a value to the filter."""
+    return state_filter.publish(TOPIC, {"illuminance": value}, now, value, sensor)
+
+
+def test_change_outside_the_deadband():
+    """Test a change larger than the deadband is published at once."""
+    state_filter = StateFilter()
+    assert publish(state_filter, 1000, 0, ILLUMINANCE)
+    assert publish(state_filter, 1100, 60, ILLUMINANCE)
+
+
+def test_drift_within_the_deadband():
+    """Test a slow drift within the deadband is published after the max age."""
+    state_filter = StateFilter()
+    assert publish(state_filter, 1000, 0, ILLUMINANCE)
+    published = [
+        minute
+        for minute in range(1, 31)
+        if publish(state_filter, 1000 + minute, minute * 60, ILLUMINANCE)
+    ]
+    assert published == [
+        minute for minute in range(1, 31) if minute * 60 % DEADBAND_MAX_AGE == 0
+    ]
+    assert state_filter.last_state(TOPIC) == {"illuminance": 1030}
+
+
+@pytest.mark.parametrize("min_interval", (60, 300))
+def test_deadband_held_until_min_interval(min_interval):
+    """Test a change within the deadband waits for the minimum interval only."""
+    sensor = replace(ILLUMINANCE, min_interval=min_interval)
+    state_filter = StateFilter()
+    assert publish(state_filter, 1000, 0, sensor)
+    assert not publish(state_filter, 1010, min_interval - 1, sensor)
+    assert publish(state_filter, 1010, min_interval, sensor)
+    # A large change waits for the minimum interval too
+    assert not publish(state_filter, 2000, min_interval * 2 - 1, sensor)
+    assert publish(state_filter, 2000, min_interval * 2, sensor)
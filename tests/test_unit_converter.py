@@ -0,0 +1,101 @@
+"""Tests of the cached unit conversion of the sensor graph."""
+from __future__ import annotations
+
+import random
+import time
+
+import pytest
+from pint import Quantity
+from pyweatherflowudp.const import UNIT_METERS
+from pyweatherflowudp.device import determine_device
+
+from weatherflow2mqtt.const import UNITS_IMPERIAL, UNITS_METRIC
+from weatherflow2mqtt.sensor_description import DEVICE_SENSORS, SensorDescription
+from weatherflow2mqtt.sensor_graph import unit_converter
+
+HUB = "HB-00000001"
+OBSERVATIONS = (
+    {
+        "serial_number": "ST-00000512",
+        "type": "obs_st",
+        "hub_sn": HUB,
+        "obs": [
+            [0, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37, 50.26, 328, 0.03, 3, 0.0]
+            + [0, 0, 0, 2.410, 1]
+        ],
+        "firmware_revision": 129,
+    },
+    {
+        "serial_number": "AR-00004049",
+        "type": "obs_air",
+        "hub_sn": HUB,
+        "obs": [[0, 1017.0, 10.0, 45, 0, 0, 3.46, 1]],
+        "firmware_revision": 17,
+    },
+    {
+        "serial_number": "SK-00008453",
+        "type": "obs_sky",
+        "hub_sn": HUB,
+        "obs": [[0, 9000, 10, 0.0, 2.6, 4.6, 7.4, 187, 3.12, 1, 130, None, 0, 3]],
+        "firmware_revision": 29,
+    },
+)
+ALTITUDE = 30 * UNIT_METERS
+VALUES_PER_SENSOR = 500
+
+
+def device_quantities() -> list[tuple[str, str, Quantity]]:
+    """Return the (device, sensor id, quantity) of every converted sensor."""
+    quantities = []
+    for message in OBSERVATIONS:
+        serial_number = message["serial_number"]
+        message = {**message, "obs": [[int(time.time()), *message["obs"][0][1:]]]}
+        device = determine_device(serial_number)(serial_number, message)
+        device.parse_message(message)
+        for sensor in DEVICE_SENSORS:
+            if not isinstance(sensor, SensorDescription) or sensor.custom_fn:
+                continue
+            if (attr := getattr(device, sensor.device_attr, None)) is None:
+                continue
+            if callable(attr):
+                attr = attr(altitude=ALTITUDE)
+            if isinstance(attr, Quantity):
+                quantities.append((serial_number, sensor.id, attr))
+    return quantities
+
+
+QUANTITIES = device_quantities()
+
+
+def test_all_devices_have_converted_sensors():
+    """Test every device type takes part in the comparison."""
+    assert {serial_number[:2] for serial_number, _, _ in QUANTITIES} == {
+        "ST",
+        "AR",
+        "SK",
+    }
+
+
+@pytest.mark.parametrize("unit_system", (UNITS_METRIC, UNITS_IMPERIAL))
+@pytest.mark.parametrize(
+    "sensor_id,quantity",
+    [(sensor_id, quantity) for _, sensor_id, quantity in QUANTITIES],
+    ids=[f"{serial[:2]}-{sensor_id}" for serial, sensor_id, _ in QUANTITIES],
+)
+def test_converter_matches_pint(sensor_id: str, quantity: Quantity, unit_system: str):
+    """Test the converter gives the same floats as `Quantity.to`."""
+    sensor = next(sensor for sensor in DEVICE_SENSORS if sensor.id == sensor_id)
+    unit = sensor.imperial_unit if unit_system == UNITS_IMPERIAL else sensor.metric_unit
+    if unit is None:
+        pytest.skip("The sensor is not converted")
+
+    convert = unit_converter(quantity, unit)
+    values = random.Random(f"{sensor_id}-{unit_system}")
+    magnitudes = [quantity.m, 0.0, -40.0, 40.25]
+    magnitudes += [
+        round(values.uniform(-50, 1100), values.choice((0, 1, 2, 3)))
+        for _ in range(VALUES_PER_SENSOR)
+    ]
+    for magnitude in magnitudes:
+        expected = type(quantity)(magnitude, quantity.units).to(unit).m
+        assert convert(magnitude) == expected, magnitude
@@ -0,0 +1,70 @@
+"""Tests of the Wet Bulb Temperature solver."""
+from __future__ import annotations
+
+import itertools
+import math
+
+import pytest
+
+from weatherflow2mqtt.const import UNITS_METRIC
+from weatherflow2mqtt.helpers import (
+    ConversionFunctions,
+    wetbulb_stull,
+    wetbulb_temperature,
+)
+
+# (temperature °C, humidity %, pressure hPa, wet bulb °C)
+REFERENCE_VALUES = (
+    (45, 43, 700, 32.0),
+    (20, 50, 1013.25, 13.8758),
+    (35, 10, 1050, 16.4665),
+    (-20, 5, 800, -21.9417),
+    (0, 100, 1000, 0.0),
+)
+
+
+def wetbulb_bisection(temp: float, humidity: float, pressure: float) -> float:
+    """Return the root of the psychrometric equation found by bisection."""
+    e2 = 6.112 * math.exp(17.67 * temp / (temp + 243.5)) * humidity / 100
+    low, high = -100.0, float(temp)
+    for _ in range(200):
+        middle = (low + high) / 2
+        difference = (
+            6.112 * math.exp(17.67 * middle / (middle + 243.5))
+            - pressure * (temp - middle) * 0.00066 * (1 + 0.00115 * middle)
+            - e2
+        )
+        if difference < 0:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+@pytest.mark.parametrize("temp,humidity,pressure,expected", REFERENCE_VALUES)
+def test_reference_values(temp, humidity, pressure, expected):
+    """Test the solver against reference values."""
+    assert wetbulb_temperature(temp, humidity, pressure) == pytest.approx(
+        expected, abs=5e-5
+    )
+
+
+def test_matches_bisection():
+    """Test the Newton iteration finds the root bisection finds."""
+    for temp, humidity, pressure in itertools.product(
+        range(-20, 46, 5), range(5, 101, 5), range(700, 1051, 50)
+    ):
+        assert wetbulb_temperature(temp, humidity, pressure) == pytest.approx(
+            wetbulb_bisection(temp, humidity, pressure), abs=1e-9
+        ), (temp, humidity, pressure)
+
+
+def test_conversion():
+    """Test the conversion uses the solver, or the Stull approximation."""
+    cnv = ConversionFunctions(UNITS_METRIC, "en")
+    assert cnv.wetbulb(20, 50, 1013.25, True) == wetbulb_temperature(20, 50, 1013.25)
+    assert cnv.wetbulb(20, 50, 1013.25, True, approximate=True) == wetbulb_stull(
+        20, 50
+    )
+    assert wetbulb_stull(20, 50) == pytest.approx(13.7, abs=0.1)
+    assert cnv.wetbulb(None, 50, 1013.25) is None
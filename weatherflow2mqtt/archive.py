@@ -0,0 +1,130 @@
+"""Buffer of the raw observations to archive in the database."""
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Any, Iterable
+
+from pyweatherflowudp.device import WeatherFlowSensorDevice
+
+from .const import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_WRITE_INTERVAL,
+    OBSERVATION_FIELDS,
+    ROLLUP_FIELDS,
+    ROLLUP_RESOLUTIONS,
+)
+
+# Device attributes holding the values as received
+_ATTRIBUTES = tuple(f"_{field}" for field in OBSERVATION_FIELDS)
+# Position of the rolled up fields in an archive row, after device and epoch
+_ROLLUP_COLUMNS = tuple(
+    (OBSERVATION_FIELDS.index(field) + 2, field) for field in ROLLUP_FIELDS
+)
+DAY = 24 * 60 * 60
+
+
+def day_start(epoch: float) -> int:
+    """Return the epoch of the local midnight starting the day of `epoch`."""
+    return int(
+        datetime.fromtimestamp(epoch)
+        .replace(hour=0, minute=0, second=0, microsecond=0)
+        .timestamp()
+    )
+
+
+def bucket_start(epoch: int, resolution: int) -> int:
+    """Return the start of the rollup bucket of `epoch`."""
+    if resolution == DAY:
+        return day_start(epoch)
+    return epoch - epoch % resolution
+
+
+def rollup_rows(rows: Iterable[tuple[Any, ...]]) -> list[tuple[Any, ...]]:
+    """Return the rollups of archive rows, as rows of the rollups table.
+
+    Each bucket touched by the rows is summarized once, so the rows can be
+    merged into the stored rollups with one upsert per bucket and field.
+    """
+    rollups: dict[tuple[str, str, int, int], list[float]] = {}
+    # Start of the day by quarter hour, the unit of all UTC offsets
+    days: dict[int, int] = {}
+    for row in rows:
+        device, epoch = row[0], row[1]
+        quarter = epoch - epoch % 900
+        if (day := days.get(quarter)) is None:
+            day = days[quarter] = day_start(epoch)
+        buckets = [
+            (resolution, day if resolution == DAY else epoch - epoch % resolution)
+            for resolution in ROLLUP_RESOLUTIONS
+        ]
+        for column, field in _ROLLUP_COLUMNS:
+            if (value := row[column]) is None:
+                continue
+            for resolution, bucket in buckets:
+                key = (device, field, resolution, bucket)
+                if (rollup := rollups.get(key)) is None:
+                    rollups[key] = [value, value, value, 1]
+                    continue
+                if value < rollup[0]:
+                    rollup[0] = value
+                elif value > rollup[1]:
+                    rollup[1] = value
+                rollup[2] += value
+                rollup[3] += 1
+    return [(*key, *rollup) for key, rollup in rollups.items()]
+
+
+class ObservationArchive:
+    """Collect the raw observations of the devices, to be written in batches.
+
+    Adding an observation only appends a tuple, so the observation handler
+    does not wait for the database. The rows are handed to the database once
+    `batch_size` rows were collected or `interval` seconds have passed since
+    the first one.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        interval: float = ARCHIVE_WRITE_INTERVAL,
+    ) -> None:
+        """Initialize the buffer."""
+        self._batch_size = batch_size
+        self._interval = interval
+        self._rows: list[tuple[Any, ...]] = []
+        self._first = 0.0
+
+    def __len__(self) -> int:
+        """Return the number of rows waiting to be written."""
+        return len(self._rows)
+
+    def add(self, device: WeatherFlowSensorDevice) -> None:
+        """Add the last observation of a device."""
+        if (epoch := device._last_report) is None:
+            return
+        if not self._rows:
+            self._first = time.monotonic()
+        self._rows.append(
+            (
+                device.serial_number,
+                int(epoch),
+                *(getattr(device, attr, None) for attr in _ATTRIBUTES),
+            )
+        )
+
+    def due(self, now: float | None = None) -> bool:
+        """Return `True` if the rows should be written."""
+        if not self._rows:
+            return False
+        return len(self._rows) >= self._batch_size or (
+            (now or time.monotonic()) - self._first >= self._interval
+        )
+
+    def rows(self) -> list[tuple[Any, ...]]:
+        """Return the rows to write."""
+        return self._rows
+
+    def clear(self) -> None:
+        """Forget the rows returned by `rows`, as they are written."""
+        self._rows = []
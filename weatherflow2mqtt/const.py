@@ -22,8 +22,18 @@ EXTERNAL_DIRECTORY = os.environ.get("EXTERNAL_DIRECTORY", "/data")
 INTERNAL_DIRECTORY = "/app"
 STORAGE_FILE = f"{EXTERNAL_DIRECTORY}/.storage.json"
 DATABASE = f"{EXTERNAL_DIRECTORY}/weatherflow2mqtt.db"
-DATABASE_VERSION = 2
+FORECAST_CACHE_FILE = f"{EXTERNAL_DIRECTORY}/forecast.json"
+DATABASE_VERSION = 7
+DATABASE_FLUSH_INTERVAL = 60
+DATABASE_FLUSH_SIZE = 500
+DATABASE_SYNCHRONOUS = "NORMAL"
+# Rows deleted per transaction when removing old history
+DATABASE_PRUNE_BATCH_SIZE = 500
+# Calls waiting for the database writer before a warning is logged
+DATABASE_QUEUE_SIZE = 1000
 STORAGE_ID = 1
+# Station of the rows written before the database had one row per station
+LEGACY_STATION = ""
 
 TABLE_STORAGE = """ CREATE TABLE IF NOT EXISTS storage (
                     id integer PRIMARY KEY,
@@ -36,21 +46,135 @@ TABLE_STORAGE = """ CREATE TABLE IF NOT EXISTS storage (
                     lightning_count_today integer,
                     last_lightning_time real,
                     last_lightning_distance integer,
-                    last_lightning_energy
+                    last_lightning_energy,
+                    station TEXT NOT NULL DEFAULT ''
                 );"""
 
+INDEX_STORAGE_STATION = """ CREATE UNIQUE INDEX IF NOT EXISTS storage_station
+                    ON storage(station);"""
+
 TABLE_PRESSURE = """ CREATE TABLE IF NOT EXISTS pressure (
-                    timestamp real PRIMARY KEY,
-                    pressure real
+                    station TEXT NOT NULL DEFAULT '',
+                    timestamp real,
+                    pressure real,
+                    PRIMARY KEY (station, timestamp)
                 );"""
 
 TABLE_LIGHTNING = """ CREATE TABLE IF NOT EXISTS lightning (
-                    timestamp real PRIMARY KEY
+                    station TEXT NOT NULL DEFAULT '',
+                    timestamp real,
+                    PRIMARY KEY (station, timestamp)
+                );"""
+
+# Raw observation values archived by the devices, in the units of the UDP API
+OBSERVATION_FIELDS = (
+    "station_pressure",
+    "air_temperature",
+    "relative_humidity",
+    "lightning_strike_count",
+    "lightning_strike_average_distance",
+    "illuminance",
+    "uv",
+    "solar_radiation",
+    "rain_accumulation_previous_minute",
+    "precipitation_type",
+    "wind_lull",
+    "wind_average",
+    "wind_gust",
+    "wind_direction",
+    "battery",
+)
+
+TABLE_OBSERVATIONS = """ CREATE TABLE IF NOT EXISTS observations (
+                    device TEXT NOT NULL,
+                    epoch INTEGER NOT NULL,
+                    station_pressure REAL,
+                    air_temperature REAL,
+                    relative_humidity REAL,
+                    lightning_strike_count INTEGER,
+                    lightning_strike_average_distance REAL,
+                    illuminance REAL,
+                    uv REAL,
+                    solar_radiation REAL,
+                    rain_accumulation_previous_minute REAL,
+                    precipitation_type INTEGER,
+                    wind_lull REAL,
+                    wind_average REAL,
+                    wind_gust REAL,
+                    wind_direction INTEGER,
+                    battery REAL,
+                    PRIMARY KEY (device, epoch)
+                ) WITHOUT ROWID;"""
+
+INSERT_OBSERVATION = """ INSERT OR IGNORE INTO observations(
+                    device,
+                    epoch,
+                    station_pressure,
+                    air_temperature,
+                    relative_humidity,
+                    lightning_strike_count,
+                    lightning_strike_average_distance,
+                    illuminance,
+                    uv,
+                    solar_radiation,
+                    rain_accumulation_previous_minute,
+                    precipitation_type,
+                    wind_lull,
+                    wind_average,
+                    wind_gust,
+                    wind_direction,
+                    battery
+                ) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
+
+# Archived values with rollups; a mean of the directions or types is meaningless
+ROLLUP_FIELDS = tuple(
+    field
+    for field in OBSERVATION_FIELDS
+    if field not in ("precipitation_type", "wind_direction")
+)
+
+TABLE_ROLLUPS = """ CREATE TABLE IF NOT EXISTS rollups (
+                    device TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    min REAL,
+                    max REAL,
+                    sum REAL,
+                    count INTEGER,
+                    PRIMARY KEY (device, field, resolution, bucket)
+                ) WITHOUT ROWID;"""
+
+UPSERT_ROLLUP = """ INSERT INTO rollups(
+                    device, field, resolution, bucket, min, max, sum, count
+                ) VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(device, field, resolution, bucket) DO UPDATE SET
+                    min = min(min, excluded.min),
+                    max = max(max, excluded.max),
+                    sum = sum + excluded.sum,
+                    count = count + excluded.count;"""
+
+# Epoch before which the observations of a device were pruned, so are only
+# in the rollups
+TABLE_PRUNED = """ CREATE TABLE IF NOT EXISTS pruned (
+                    device TEXT PRIMARY KEY,
+                    pruned_before INTEGER NOT NULL
+                ) WITHOUT ROWID;"""
+
+UPSERT_PRUNED = """ INSERT INTO pruned(device, pruned_before)
+                    SELECT DISTINCT device, ? FROM observations WHERE epoch < ?
+                ON CONFLICT(device) DO UPDATE SET
+                    pruned_before = max(pruned_before, excluded.pruned_before);"""
+
+TABLE_DISCOVERY = """ CREATE TABLE IF NOT EXISTS discovery (
+                    topic TEXT PRIMARY KEY,
+                    hash TEXT
                 );"""
 
 TABLE_HIGH_LOW = """
                     CREATE TABLE IF NOT EXISTS high_low (
-                        sensorid TEXT PRIMARY KEY,
+                        station TEXT NOT NULL DEFAULT '',
+                        sensorid TEXT,
                         latest REAL,
                         max_day REAL,
                         max_day_time REAL,
@@ -75,7 +199,8 @@ TABLE_HIGH_LOW = """
                         max_all REAL,
                         max_all_time REAL,
                         min_all REAL,
-                        min_all_time REAL
+                        min_all_time REAL,
+                        PRIMARY KEY (station, sensorid)
                     );
                   """
 
@@ -112,6 +237,25 @@ COL_PRESSURE = "sealevel_pressure"
 COL_UV = "uv"
 COL_SOLARRAD = "solar_radiation"
 
+# Initial max and min day value of the sensors in the high_low table. Sensors
+# starting at 0 only track a maximum, which is reset to 0 every period.
+HIGH_LOW_INITIAL = {
+    COL_DEWPOINT: (-9999, 9999),
+    COL_HUMIDITY: (-9999, 9999),
+    COL_ILLUMINANCE: (0, 0),
+    COL_PRESSURE: (-9999, 9999),
+    COL_RAINDURATION: (0, 0),
+    COL_RAINRATE: (0, 0),
+    COL_SOLARRAD: (0, 0),
+    COL_STRIKECOUNT: (0, 0),
+    COL_STRIKEENERGY: (0, 0),
+    COL_TEMPERATURE: (-9999, 9999),
+    COL_UV: (0, 0),
+    COL_WINDGUST: (0, 0),
+    COL_WINDLULL: (0, 0),
+    COL_WINDSPEED: (0, 0),
+}
+
 BASE_URL = "https://swd.weatherflow.com/swd/rest"
 
 BATTERY_MODE_DESCRIPTION = [
@@ -147,11 +291,65 @@ FORECAST_TYPE_DAILY = "daily"
 FORECAST_TYPE_HOURLY = "hourly"
 FORECAST_ENTITY = "weather"
 FORECAST_HOURLY_HOURS = 36
+# Attempts of a forecast request, and the base delay in seconds between them
+FORECAST_RETRIES = 3
+FORECAST_RETRY_DELAY = 5
 
 STRIKE_COUNT_TIMER = 3 * 60 * 60
 PRESSURE_TREND_TIMER = 3 * 60 * 60
+PRESSURE_HISTORY_MARGIN = 15 * 60
+HISTORY_WRITE_INTERVAL = 10 * 60
+# The archived observations are written every this many rows or seconds
+ARCHIVE_BATCH_SIZE = 60
+ARCHIVE_WRITE_INTERVAL = 5 * 60
+# Days the archived observations are kept, once they are in the rollups
+ARCHIVE_RAW_DAYS = 30
+# Bucket sizes of the rollups, in seconds. The daily buckets start at midnight.
+ROLLUP_RESOLUTIONS = (10 * 60, 60 * 60, 24 * 60 * 60)
+
+# History API, disabled when the port is 0
+HISTORY_API_PORT = 0
+# Points returned when no resolution is asked for
+HISTORY_API_MAX_POINTS = 1000
+# Rows read from the database per streamed chunk
+HISTORY_API_CHUNK_ROWS = 1000
+# Answers kept for repeated queries, and the largest answer kept
+HISTORY_API_CACHE_SIZE = 32
+HISTORY_API_CACHE_BYTES = 256 * 1024
+# Seconds an answer including recent, still changing, data is kept
+HISTORY_API_CACHE_TTL = 60
+# Seconds a settled answer of raw rows is kept, as old rows are pruned
+HISTORY_API_RAW_CACHE_TTL = 60 * 60
+
+# Prometheus metrics endpoint, disabled when the port is 0
+METRICS_PORT = 0
+
+# Sampling profiler, writing collapsed stacks to the profile directory
+PROFILE_DIRECTORY = f"{EXTERNAL_DIRECTORY}/profiles"
+PROFILE_SAMPLE_INTERVAL = 0.02
+# Minutes between the profile files, and the number of files kept
+PROFILE_DUMP_INTERVAL = 10
+PROFILE_FILES = 12
+# Seconds of a profiling window started by MQTT, and the longest window
+PROFILE_WINDOW = 5 * 60
+PROFILE_MAX_WINDOW = 60 * 60
+PROFILE_COMMAND_TOPIC = f"{DOMAIN}/profile/set"
 HIGH_LOW_TIMER = 10 * 60
 
+WETBULB_MAX_ITERATIONS = 20
+WETBULB_TOLERANCE = 1e-6
+
+MQTT_ACK_TIMEOUT = 30
+MQTT_BATCH_SIZE = 50
+MQTT_LATENCY_SAMPLES = 100
+MQTT_MAX_INFLIGHT = 20
+# Topic of the Home Assistant birth and last will messages
+HA_STATUS_TOPIC = "homeassistant/status"
+# Minutes between the publishes of all states, when only publishing changes
+FULL_STATE_INTERVAL = 10
+# Seconds a change within the deadband is held, for sensors without min_interval
+DEADBAND_MAX_AGE = 10 * 60
+
 LANGUAGE_ENGLISH = "en"
 LANGUAGE_DANISH = "da"
 LANGUAGE_GERMAN = "de"
@@ -2,13 +2,20 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
+import math
+import os
+import random
+import re
+import time
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, OrderedDict
+from itertools import islice
+from typing import Any, Iterable, Iterator, OrderedDict
 
 from aiohttp import ClientSession, ClientTimeout
-from aiohttp.client_exceptions import ClientError
+from aiohttp.client_exceptions import ClientResponseError
 
 from .const import (
     ATTR_ATTRIBUTION,
@@ -27,6 +34,8 @@ from .const import (
     CONDITION_CLASSES,
     DEFAULT_TIMEOUT,
     FORECAST_HOURLY_HOURS,
+    FORECAST_RETRIES,
+    FORECAST_RETRY_DELAY,
     FORECAST_TYPE_DAILY,
     FORECAST_TYPE_HOURLY,
     LANGUAGE_ENGLISH,
@@ -36,6 +45,54 @@ from .helpers import ConversionFunctions
 
 _LOGGER = logging.getLogger(__name__)
 
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+@dataclass
+class DayAggregate:
+    """Values of a day calculated from the hourly forecast."""
+
+    precip: float = 0
+    wind_avg: float = 0
+    wind_bearing: float = 0
+
+
+def daily_aggregates(hourly: Iterable[dict[str, Any]]) -> dict[int, DayAggregate]:
+    """Return the precipitation, mean wind speed and bearing by local day.
+
+    The bearing is the direction of the mean wind vector of the hours, as an
+    arithmetic mean of for instance 350° and 10° would point south.
+    """
+    sums: dict[int, list[float]] = {}
+    for row in hourly:
+        if (day_sums := sums.get(row["local_day"])) is None:
+            day_sums = sums[row["local_day"]] = [0, 0, 0, 0, 0]
+        bearing = math.radians(row["wind_direction"])
+        day_sums[0] += row["precip"]
+        day_sums[1] += row["wind_avg"]
+        day_sums[2] += math.sin(bearing)
+        day_sums[3] += math.cos(bearing)
+        day_sums[4] += 1
+
+    return {
+        day: DayAggregate(
+            precip=precip,
+            wind_avg=wind_avg / count,
+            wind_bearing=(math.degrees(math.atan2(sin_sum, cos_sum)) + 360) % 360,
+        )
+        for day, (precip, wind_avg, sin_sum, cos_sum, count) in sums.items()
+    }
+
+
+@dataclass
+class _CachedResponse:
+    """A response, with what is needed to revalidate it."""
+
+    data: Any
+    etag: str | None = None
+    last_modified: str | None = None
+    expires: float = 0
+
 
 @dataclass
 class ForecastConfig:
@@ -44,6 +101,7 @@ class ForecastConfig:
     station_id: str
     token: str
     interval: int = 30
+    cache_file: str | None = None
 
 
 class Forecast:
@@ -58,13 +116,26 @@ class Forecast:
             unit_system=UNITS_METRIC, language=LANGUAGE_ENGLISH
         ),
         session: ClientSession | None = None,
+        base_url: str = BASE_URL,
+        cache_file: str | None = None,
     ):
         """Initialize a Forecast object."""
         self.station_id = station_id
         self.token = token
         self.interval = interval
         self.conversions = conversions
+        self.base_url = base_url
         self._session: ClientSession = session
+        self._own_session = False
+        # Validators and expiry of the cached responses, by endpoint
+        self._cache: dict[str, _CachedResponse] = {}
+
+        # Last forecast received, kept in the cache file for the next start
+        self.cache_file = cache_file
+        self._data: dict[str, Any] | None = None
+        self._fetched: float = 0
+        self._refreshed = False
+        self._load_cache()
 
     @classmethod
     def from_config(
@@ -82,165 +153,285 @@ class Forecast:
             interval=config.interval,
             conversions=conversions,
             session=session,
+            cache_file=config.cache_file,
         )
 
+    async def open(self) -> None:
+        """Create the session kept open for all requests."""
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                timeout=ClientTimeout(total=DEFAULT_TIMEOUT)
+            )
+            self._own_session = True
+
+    async def close(self) -> None:
+        """Close the session, if it was created by `open`."""
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._own_session = False
+
     async def update_forecast(self):
         """Return the formatted forecast data."""
         json_data = await self.async_request(
             method="get",
             endpoint=f"better_forecast?station_id={self.station_id}&token={self.token}",
         )
-        items = []
 
         if json_data is not None:
-            # We need a few Items from the Current Conditions section
-            current_cond = json_data.get("current_conditions")
-            current_icon = current_cond["icon"]
-            today = datetime.date(datetime.now())
+            self._data = json_data
+            self._fetched = time.time()
+            self._refreshed = True
+            self._save_cache()
+            return self.current_forecast()
+
+        # Return None if we could not retrieve data
+        _LOGGER.warning("Forecast Server was unresponsive. Skipping forecast update")
+        return None, None
+
+    def current_forecast(
+        self, now: datetime | None = None
+    ) -> tuple[OrderedDict | None, OrderedDict | None]:
+        """Return the last forecast received, without the hours that passed.
+
+        The forecast is marked stale when it was read from the cache file, or
+        when it was not refreshed during the last two intervals.
+        """
+        if self._data is None:
+            return None, None
+        try:
+            condition_data, fcst_data = self.process_forecast(self._data, now)
+        except Exception as exc:
+            _LOGGER.error("Could not process the forecast data: %s", exc)
+            return None, None
+        fcst_data["fetched"] = self.conversions.utc_from_timestamp(self._fetched)
+        fcst_data["stale"] = (
+            not self._refreshed or time.time() - self._fetched > 2 * self.interval * 60
+        )
+        return condition_data, fcst_data
+
+    def _load_cache(self) -> None:
+        """Read the forecast stored by an earlier run."""
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as file:
+                cache = json.load(file)
+            self._data = cache["data"]
+            self._fetched = cache["time"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            _LOGGER.warning("Could not read the forecast cache. Error: %s", e)
+
+    def _save_cache(self) -> None:
+        """Store the forecast, replacing the cache file at once."""
+        if not self.cache_file:
+            return
+        try:
+            with open(temp_file := f"{self.cache_file}.tmp", "w") as file:
+                json.dump({"time": self._fetched, "data": self._data}, file)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            _LOGGER.warning("Could not write the forecast cache. Error: %s", e)
+
+    def process_forecast(
+        self, json_data: dict[str, Any], now: datetime | None = None
+    ) -> tuple[OrderedDict, OrderedDict]:
+        """Return the condition and forecast data of a `better_forecast` response."""
+        now = now or datetime.now()
+
+        # We need a few Items from the Current Conditions section
+        current_cond = json_data.get("current_conditions")
+        current_icon = current_cond["icon"]
 
-            # Prepare for MQTT
-            condition_data = OrderedDict()
-            condition_state = self.ha_condition_value(current_icon)
-            condition_data["weather"] = condition_state
+        # Prepare for MQTT
+        condition_data = OrderedDict()
+        condition_state = self.ha_condition_value(current_icon)
+        condition_data["weather"] = condition_state
 
-            forecast_data = json_data.get("forecast")
+        forecast_data = json_data.get("forecast")
 
-            # We also need Day hign and low Temp from Today
-            temp_high_today = self.conversions.temperature(
-                forecast_data[FORECAST_TYPE_DAILY][0]["air_temp_high"]
+        # We also need Day hign and low Temp from Today
+        temp_high_today = self.conversions.temperature(
+            forecast_data[FORECAST_TYPE_DAILY][0]["air_temp_high"]
+        )
+        temp_low_today = self.conversions.temperature(
+            forecast_data[FORECAST_TYPE_DAILY][0]["air_temp_low"]
+        )
+
+        fcst_data = OrderedDict()
+        fcst_data[ATTR_ATTRIBUTION] = ATTRIBUTION
+        fcst_data["temp_high_today"] = temp_high_today
+        fcst_data["temp_low_today"] = temp_low_today
+        fcst_data["daily_forecast"] = list(
+            self._daily_items(
+                forecast_data[FORECAST_TYPE_DAILY],
+                daily_aggregates(forecast_data[FORECAST_TYPE_HOURLY]),
+                now,
             )
-            temp_low_today = self.conversions.temperature(
-                forecast_data[FORECAST_TYPE_DAILY][0]["air_temp_low"]
+        )
+        fcst_data["hourly_forecast"] = list(
+            islice(
+                self._hourly_items(forecast_data[FORECAST_TYPE_HOURLY], now),
+                FORECAST_HOURLY_HOURS,
             )
+        )
 
-            # Process Daily Forecast
-            fcst_data = OrderedDict()
-            fcst_data[ATTR_ATTRIBUTION] = ATTRIBUTION
-            fcst_data["temp_high_today"] = temp_high_today
-            fcst_data["temp_low_today"] = temp_low_today
+        return condition_data, fcst_data
 
-            for row in forecast_data[FORECAST_TYPE_DAILY]:
-                # Skip over past forecasts - seems the API sometimes returns old forecasts
-                forecast_time = datetime.date(
-                    datetime.fromtimestamp(row["day_start_local"])
-                )
-                if today > forecast_time:
-                    continue
-
-                # Calculate data from hourly that's not summed up in the daily.
-                precip = 0
-                wind_avg = []
-                wind_bearing = []
-                for hourly in forecast_data["hourly"]:
-                    if hourly["local_day"] == row["day_num"]:
-                        precip += hourly["precip"]
-                        wind_avg.append(hourly["wind_avg"])
-                        wind_bearing.append(hourly["wind_direction"])
-                sum_wind_avg = sum(wind_avg) / len(wind_avg)
-                sum_wind_bearing = sum(wind_bearing) / len(wind_bearing) % 360
-
-                item = {
-                    ATTR_FORECAST_TIME: self.conversions.utc_from_timestamp(
-                        row["day_start_local"]
-                    ),
-                    "conditions": row["conditions"],
-                    ATTR_FORECAST_CONDITION: "cloudy" if row.get("icon") is None else self.ha_condition_value(row["icon"]),
-                    ATTR_FORECAST_TEMP: self.conversions.temperature(
-                        row["air_temp_high"]
-                    ),
-                    ATTR_FORECAST_TEMP_LOW: self.conversions.temperature(
-                        row["air_temp_low"]
-                    ),
-                    ATTR_FORECAST_PRECIPITATION: self.conversions.rain(precip),
-                    ATTR_FORECAST_PRECIPITATION_PROBABILITY: row["precip_probability"],
-                    "precip_icon": row.get("precip_icon", ""),
-                    "precip_type": row.get("precip_type", ""),
-                    ATTR_FORECAST_WIND_SPEED: self.conversions.speed(
-                        sum_wind_avg, True
-                    ),
-                    ATTR_FORECAST_WIND_BEARING: int(sum_wind_bearing),
-                    "wind_direction_cardinal": self.conversions.direction(
-                        int(sum_wind_bearing)
-                    ),
-                }
-                items.append(item)
-            fcst_data["daily_forecast"] = items
-
-            cnt = 0
-            items = []
-            for row in forecast_data[FORECAST_TYPE_HOURLY]:
-                # Skip over past forecasts - seems the API sometimes returns old forecasts
-                forecast_time = datetime.fromtimestamp(row["time"])
-                if datetime.now() > forecast_time:
-                    continue
-
-                item = {
-                    ATTR_FORECAST_TIME: self.conversions.utc_from_timestamp(
-                        row["time"]
-                    ),
-                    "conditions": row["conditions"],
-                    ATTR_FORECAST_CONDITION: self.ha_condition_value(row.get("icon")),
-                    ATTR_FORECAST_TEMP: self.conversions.temperature(
-                        row["air_temperature"]
-                    ),
-                    ATTR_FORECAST_PRESSURE: self.conversions.pressure(
-                        row.get("sea_level_pressure", 0)
-                    ),
-                    ATTR_FORECAST_HUMIDITY: row["relative_humidity"],
-                    ATTR_FORECAST_PRECIPITATION: self.conversions.rain(row["precip"]),
-                    ATTR_FORECAST_PRECIPITATION_PROBABILITY: row["precip_probability"],
-                    "precip_icon": row.get("precip_icon", ""),
-                    "precip_type": row.get("precip_type", ""),
-                    ATTR_FORECAST_WIND_SPEED: self.conversions.speed(
-                        row["wind_avg"], True
-                    ),
-                    "wind_gust": self.conversions.speed(row["wind_gust"], True),
-                    ATTR_FORECAST_WIND_BEARING: row["wind_direction"],
-                    "wind_direction_cardinal": self.conversions.translations[
-                        "wind_dir"
-                    ][row["wind_direction_cardinal"]],
-                    "uv": row.get("uv", 0),
-                    "feels_like": self.conversions.temperature(row["feels_like"]),
-                }
-                items.append(item)
-                # Limit number of Hours
-                cnt += 1
-                if cnt >= FORECAST_HOURLY_HOURS:
-                    break
-            fcst_data["hourly_forecast"] = items
-
-            return condition_data, fcst_data
+    def _daily_items(
+        self,
+        rows: Iterable[dict[str, Any]],
+        aggregates: dict[int, DayAggregate],
+        now: datetime,
+    ) -> Iterator[dict[str, Any]]:
+        """Yield the formatted daily forecasts."""
+        today = now.date()
+        for row in rows:
+            # Skip over past forecasts - seems the API sometimes returns old forecasts
+            if today > datetime.fromtimestamp(row["day_start_local"]).date():
+                continue
 
-        # Return None if we could not retrieve data
-        _LOGGER.warning("Forecast Server was unresponsive. Skipping forecast update")
-        return None, None
+            # Data from hourly that's not summed up in the daily
+            day = aggregates.get(row["day_num"], DayAggregate())
+            # The mean of a constant 185° is 184.99999999999997
+            bearing = round(day.wind_bearing) % 360
+
+            yield {
+                ATTR_FORECAST_TIME: self.conversions.utc_from_timestamp(
+                    row["day_start_local"]
+                ),
+                "conditions": row["conditions"],
+                ATTR_FORECAST_CONDITION: "cloudy"
+                if row.get("icon") is None
+                else self.ha_condition_value(row["icon"]),
+                ATTR_FORECAST_TEMP: self.conversions.temperature(row["air_temp_high"]),
+                ATTR_FORECAST_TEMP_LOW: self.conversions.temperature(
+                    row["air_temp_low"]
+                ),
+                ATTR_FORECAST_PRECIPITATION: self.conversions.rain(day.precip),
+                ATTR_FORECAST_PRECIPITATION_PROBABILITY: row["precip_probability"],
+                "precip_icon": row.get("precip_icon", ""),
+                "precip_type": row.get("precip_type", ""),
+                ATTR_FORECAST_WIND_SPEED: self.conversions.speed(day.wind_avg, True),
+                ATTR_FORECAST_WIND_BEARING: bearing,
+                "wind_direction_cardinal": self.conversions.direction(bearing),
+            }
+
+    def _hourly_items(
+        self, rows: Iterable[dict[str, Any]], now: datetime
+    ) -> Iterator[dict[str, Any]]:
+        """Yield the formatted hourly forecasts, from the current hour on."""
+        for row in rows:
+            # Skip over past forecasts - seems the API sometimes returns old forecasts
+            if now > datetime.fromtimestamp(row["time"]):
+                continue
+
+            yield {
+                ATTR_FORECAST_TIME: self.conversions.utc_from_timestamp(row["time"]),
+                "conditions": row["conditions"],
+                ATTR_FORECAST_CONDITION: self.ha_condition_value(row.get("icon")),
+                ATTR_FORECAST_TEMP: self.conversions.temperature(
+                    row["air_temperature"]
+                ),
+                ATTR_FORECAST_PRESSURE: self.conversions.pressure(
+                    row.get("sea_level_pressure", 0)
+                ),
+                ATTR_FORECAST_HUMIDITY: row["relative_humidity"],
+                ATTR_FORECAST_PRECIPITATION: self.conversions.rain(row["precip"]),
+                ATTR_FORECAST_PRECIPITATION_PROBABILITY: row["precip_probability"],
+                "precip_icon": row.get("precip_icon", ""),
+                "precip_type": row.get("precip_type", ""),
+                ATTR_FORECAST_WIND_SPEED: self.conversions.speed(
+                    row["wind_avg"], True
+                ),
+                "wind_gust": self.conversions.speed(row["wind_gust"], True),
+                ATTR_FORECAST_WIND_BEARING: row["wind_direction"],
+                "wind_direction_cardinal": self.conversions.translations["wind_dir"][
+                    row["wind_direction_cardinal"]
+                ],
+                "uv": row.get("uv", 0),
+                "feels_like": self.conversions.temperature(row["feels_like"]),
+            }
 
     async def async_request(self, method: str, endpoint: str) -> dict[str, Any]:
-        """Request data from the WeatherFlow API."""
-        use_running_session = self._session and not self._session.closed
+        """Request data from the WeatherFlow API.
+
+        A cached response is returned while its `Cache-Control` max-age lasts,
+        and revalidated with its `ETag` or `Last-Modified` afterwards. Failed
+        requests are retried with a jittered exponential backoff.
+        """
+        cached = self._cache.get(endpoint)
+        if cached is not None and time.time() < cached.expires:
+            _LOGGER.debug("Using the cached response of %s", endpoint)
+            return cached.data
+
+        for attempt in range(FORECAST_RETRIES):
+            if attempt:
+                delay = random.uniform(0, FORECAST_RETRY_DELAY * 2**attempt)
+                _LOGGER.debug("Retrying %s in %.1f seconds", endpoint, delay)
+                await asyncio.sleep(delay)
+            try:
+                return await self._request(method, endpoint, cached)
+            except asyncio.TimeoutError:
+                _LOGGER.debug("Request to endpoint timed out: %s", endpoint)
+            except ClientResponseError as err:
+                if err.status == 401:
+                    _LOGGER.error(
+                        "Your API Key is invalid or does not support this operation"
+                    )
+                elif err.status == 404:
+                    _LOGGER.error("The Station ID does not exist")
+                else:
+                    _LOGGER.debug("Error requesting data from %s: %s", endpoint, err)
+                # Only server errors and rate limiting are worth a retry
+                if err.status < 500 and err.status != 429:
+                    return None
+            except Exception as exc:
+                _LOGGER.debug("Error requesting data from %s Error: %s", endpoint, exc)
+        return None
 
+    async def _request(
+        self, method: str, endpoint: str, cached: _CachedResponse | None
+    ) -> dict[str, Any]:
+        """Send a request, conditional if the cached response has validators."""
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        # Without a running session, use one for this request only
+        use_running_session = self._session and not self._session.closed
         if use_running_session:
             session = self._session
         else:
             session = ClientSession(timeout=ClientTimeout(total=DEFAULT_TIMEOUT))
 
         try:
-            async with session.request(method, f"{BASE_URL}/{endpoint}") as resp:
-                resp.raise_for_status()
-                data = await resp.json()
-                return data
-        except asyncio.TimeoutError:
-            _LOGGER.debug("Request to endpoint timed out: %s", endpoint)
-        except ClientError as err:
-            if "Unauthorized" in str(err):
-                _LOGGER.error(
-                    "Your API Key is invalid or does not support this operation"
-                )
-            if "Not Found" in str(err):
-                _LOGGER.error("The Station ID does not exist")
-        except Exception as exc:
-            _LOGGER.debug("Error requesting data from %s Error: %s", endpoint, exc)
+            async with session.request(
+                method, f"{self.base_url}/{endpoint}", headers=headers
+            ) as resp:
+                if resp.status == 304 and cached is not None:
+                    _LOGGER.debug("The response of %s did not change", endpoint)
+                    data = cached.data
+                else:
+                    resp.raise_for_status()
+                    data = await resp.json()
 
+                cache_control = resp.headers.get("Cache-Control", "")
+                if "no-store" in cache_control:
+                    self._cache.pop(endpoint, None)
+                    return data
+                max_age = MAX_AGE.search(cache_control)
+                self._cache[endpoint] = _CachedResponse(
+                    data=data,
+                    etag=resp.headers.get("ETag", cached and cached.etag),
+                    last_modified=resp.headers.get(
+                        "Last-Modified", cached and cached.last_modified
+                    ),
+                    expires=time.time() + int(max_age.group(1)) if max_age else 0,
+                )
+                return data
         finally:
             if not use_running_session:
                 await session.close()
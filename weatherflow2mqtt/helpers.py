@@ -7,6 +7,7 @@ import time
 import json
 import logging
 import math
+from functools import lru_cache
 from typing import Any
 
 import yaml
@@ -16,6 +17,8 @@ from .const import (
     EXTERNAL_DIRECTORY,
     SUPPORTED_LANGUAGES,
     UNITS_IMPERIAL,
+    WETBULB_MAX_ITERATIONS,
+    WETBULB_TOLERANCE,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -38,13 +41,20 @@ def truebool(val: Any | None) -> bool:
 
 def read_config() -> list[str] | None:
     """ Read the config file to look for sensors."""
+    if (data := read_config_file()) is None:
+        return None
+    return data.get("sensors")
+
+
+def read_config_file() -> dict[str, Any] | None:
+    """ Read the config.yaml file."""
     try:
         filepath = f"{EXTERNAL_DIRECTORY}/config.yaml"
         with open(filepath, "r") as file:
             data = yaml.load(file, Loader=yaml.FullLoader)
-            sensors = data.get("sensors")
-
-            return sensors
+            if not isinstance(data, dict):
+                raise ValueError("The file does not contain settings")
+            return data
 
     except FileNotFoundError:
         return None
@@ -53,6 +63,73 @@ def read_config() -> list[str] | None:
         return None
 
 
+def read_publish_limits() -> dict[str, dict[str, Any]]:
+    """ Read the deadband and min_interval of the sensors from the config file.
+
+    A deadband ending with `%` is relative to the last published value.
+    """
+    limits: dict[str, dict[str, Any]] = {}
+    if (data := read_config_file()) is None:
+        return limits
+
+    for sensor_id, settings in (data.get("publish") or {}).items():
+        try:
+            sensor_limits = {}
+            if (deadband := settings.get("deadband")) is not None:
+                if relative := str(deadband).strip().endswith("%"):
+                    deadband = float(str(deadband).strip()[:-1]) / 100
+                sensor_limits["deadband"] = float(deadband)
+                sensor_limits["relative_deadband"] = relative
+            if (min_interval := settings.get("min_interval")) is not None:
+                sensor_limits["min_interval"] = int(min_interval)
+        except (AttributeError, TypeError, ValueError) as e:
+            _LOGGER.error("Invalid publish settings for %s: %s", sensor_id, e)
+            continue
+        limits[sensor_id] = sensor_limits
+
+    return limits
+
+
+@lru_cache(maxsize=16)
+def wetbulb_temperature(temp: float, humidity: float, pressure: float) -> float:
+    """Return the Wet Bulb Temperature in Celsius.
+
+    Solves the psychrometric equation
+        e = es(Tw) - p * (T - Tw) * 0.00066 * (1 + 0.00115 * Tw)
+    with Newton iteration, starting at the air temperature. The result is
+    cached, so the sensors of an observation share the calculation.
+    """
+    e2 = 6.112 * math.exp(17.67 * temp / (temp + 243.5)) * humidity / 100
+    tw = temp
+    for _ in range(WETBULB_MAX_ITERATIONS):
+        ew = 6.112 * math.exp(17.67 * tw / (tw + 243.5))
+        difference = ew - pressure * (temp - tw) * 0.00066 * (1 + 0.00115 * tw) - e2
+        derivative = ew * 17.67 * 243.5 / (tw + 243.5) ** 2 + pressure * 0.00066 * (
+            1 + 0.00115 * tw - 0.00115 * (temp - tw)
+        )
+        step = difference / derivative
+        tw -= step
+        if abs(step) < WETBULB_TOLERANCE:
+            break
+    return tw
+
+
+def wetbulb_stull(temp: float, humidity: float) -> float:
+    """Return the Stull approximation of the Wet Bulb Temperature in Celsius.
+
+    Meant for sea level pressure, humidity from 5% to 99% and temperatures
+    from -20°C to 50°C. The error is mostly below 1°C, but grows to several
+    degrees for cold and dry air.
+    """
+    return (
+        temp * math.atan(0.151977 * math.sqrt(humidity + 8.313659))
+        + math.atan(temp + humidity)
+        - math.atan(humidity - 1.676331)
+        + 0.00391838 * humidity**1.5 * math.atan(0.023101 * humidity)
+        - 4.686035
+    )
+
+
 class ConversionFunctions:
     """ Class to help with converting from different units."""
 
@@ -314,65 +391,26 @@ class ConversionFunctions:
             return round(vis / 1.609344, 1)
         return round(vis, 1)
 
-    def wetbulb(self, temp, humidity, pressure, no_conversion=False):
+    def wetbulb(
+        self, temp, humidity, pressure, no_conversion=False, approximate=False
+    ):
         """ Return Wet Bulb Temperature.
-        Converted from a JS formula made by Gary W Funk
+        Based on a JS formula made by Gary W Funk
         Input:
             Temperature in Celcius
             Humdity in Percent
             Station Pressure in MB
-        Where:
-            t is air temperature
-            rh is relative humidity
-            p is staion pressure
-            edifference is 
-            twguess is
-            eguess is
-            eguess is
-            previoussign is 
-            cursign is 
-            incr is 
-            es is
-            e2 is
+        The psychrometric equation is solved by `wetbulb_temperature`. With
+        approximate=True the faster Stull formula is used, which ignores the
+        pressure.
         """
         if temp is None or humidity is None or pressure is None:
             return None
 
-        t = float(temp)
-        rh = float(humidity)
-        p = float(pressure)
-
-        # Variables
-        edifference = 1
-        twguess = 0
-        previoussign = 1
-        incr = 10
-        es = 6.112 * math.exp(17.67 * t / (t + 243.5))
-        e2 = es * (rh / 100)
-
-        while abs(edifference) > 0.005:
-            ewguess = 6.112 * math.exp((17.67 * twguess) / (twguess + 243.5))
-            eguess = ewguess - p * (t - twguess) * 0.00066 * (1 + (0.00115 * twguess))
-            edifference = e2 - eguess
-            if edifference == 0:
-                break
-
-            if edifference < 0:
-                cursign = -1
-                if cursign != previoussign:
-                    previoussign = cursign
-                    incr = incr / 10
-                else:
-                    incr = incr
-            else:
-                cursign = 1
-                if cursign != previoussign:
-                    previoussign = cursign
-                    incr = incr / 10
-                else:
-                    incr = incr
-
-            twguess = twguess + incr * previoussign
+        if approximate:
+            twguess = wetbulb_stull(float(temp), float(humidity))
+        else:
+            twguess = wetbulb_temperature(float(temp), float(humidity), float(pressure))
 
         if no_conversion:
             return twguess
@@ -721,12 +759,13 @@ class ConversionFunctions:
 
         return se
 
-    def solar_insolation(self, elevation, latitude, longitude):
+    def solar_insolation(self, elevation, latitude, longitude, solar_elevation=None):
         """ Return Estimation of Solar Radiation at current sun elevation angle.
         Input:
             Elevation in Meters
             Latitude
             Longitude
+            Solar Elevation in Degrees (calculated if not given)
         Where:
             solar_elevation is the Sun Elevation in Degrees with respect to the Horizon
             sz is Solar Zenith in Degrees
@@ -739,7 +778,8 @@ class ConversionFunctions:
             return None
 
         # Calculate Solar Elevation
-        solar_elevation = self.solar_elevation(latitude, longitude)
+        if solar_elevation is None:
+            solar_elevation = self.solar_elevation(latitude, longitude)
 
         cos = math.cos
         sin = math.sin
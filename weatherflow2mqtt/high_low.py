@@ -0,0 +1,169 @@
+"""In-memory tracking of the high and low sensor values."""
+from __future__ import annotations
+
+import datetime
+import time
+from typing import Any
+
+from .const import HIGH_LOW_INITIAL, UTC
+
+# Periods updated by every observation, yesterday is copied from the day
+TRACKED_PERIODS = ("day", "week", "month", "year", "all")
+# Periods starting over when the calendar key of the period changes
+CALENDAR_PERIODS = ("week", "month", "year")
+# Periods sent as the attributes of the high_low sensors
+PUBLISHED_PERIODS = ("day", "month", "all")
+
+_MAX_KEYS = tuple((f"max_{period}", f"max_{period}_time") for period in TRACKED_PERIODS)
+_MIN_KEYS = tuple((f"min_{period}", f"min_{period}_time") for period in TRACKED_PERIODS)
+
+
+def _period_keys(day: datetime.date) -> dict[str, Any]:
+    """Return the calendar keys of the periods containing the day."""
+    return {
+        "week": (day.year, day.strftime("%W")),
+        "month": (day.year, day.month),
+        "year": day.year,
+    }
+
+
+def _isoformat(timestamp: float | None) -> str | None:
+    """Return the UTC ISO format of a timestamp."""
+    if not timestamp:
+        return None
+    return (
+        datetime.datetime.utcfromtimestamp(round(timestamp))
+        .replace(tzinfo=UTC)
+        .isoformat()
+    )
+
+
+class HighLowTracker:
+    """Keep the high and low values of the sensors in memory.
+
+    The records have the columns of the `high_low` table. Every observation
+    updates the day, week, month, year and all time values directly, and the
+    periods are started over when the local day changes, so the table only has
+    to be written now and then.
+    """
+
+    def __init__(self, records: dict[str, dict[str, Any]], now: float | None = None):
+        """Initialize the tracker from the rows of the `high_low` table."""
+        self.records = records
+        self.changed = False
+        self._counters = {
+            sensor_id
+            for sensor_id in records
+            if HIGH_LOW_INITIAL.get(sensor_id) == (0, 0)
+        }
+        self._attributes: dict[str, dict[str, Any]] = {}
+
+        # Records written before the values were tracked per observation only
+        # include the current day in the longer periods at midnight
+        for sensor_id, record in records.items():
+            self._update_extremes(
+                sensor_id, record, record["max_day"], record["max_day_time"], _MAX_KEYS
+            )
+            if record["min_day_time"] is not None:
+                self._update_extremes(
+                    sensor_id,
+                    record,
+                    record["min_day"],
+                    record["min_day_time"],
+                    _MIN_KEYS,
+                )
+
+        day_times = [
+            timestamp
+            for record in records.values()
+            for timestamp in (record["max_day_time"], record["min_day_time"])
+            if timestamp
+        ]
+        self._day = datetime.date.fromtimestamp(
+            max(day_times) if day_times else now or time.time()
+        )
+
+    def update(self, data: dict[str, Any], now: float | None = None) -> None:
+        """Update the values with the sensor data of an observation."""
+        now = now or time.time()
+        self.roll_over(now)
+
+        for sensor_id, record in self.records.items():
+            if (value := data.get(sensor_id)) is None:
+                continue
+            record["latest"] = value
+            self.changed = True
+            self._update_extremes(sensor_id, record, value, now, _MAX_KEYS)
+            if sensor_id not in self._counters:
+                self._update_extremes(sensor_id, record, value, now, _MIN_KEYS)
+
+    def roll_over(self, now: float | None = None) -> bool:
+        """Start the periods over if the day changed, return `True` if it did."""
+        now = now or time.time()
+        if (day := datetime.date.fromtimestamp(now)) == self._day:
+            return False
+
+        previous_keys = _period_keys(self._day)
+        keys = _period_keys(day)
+        periods = ["day"] + [
+            period for period in CALENDAR_PERIODS if previous_keys[period] != keys[period]
+        ]
+        for sensor_id, record in self.records.items():
+            for extreme in ("max", "min"):
+                record[f"{extreme}_yday"] = record[f"{extreme}_day"]
+                record[f"{extreme}_yday_time"] = record[f"{extreme}_day_time"]
+            for period in periods:
+                self._reset(sensor_id, record, period, now)
+
+        self._day = day
+        self._attributes.clear()
+        self.changed = True
+        return True
+
+    def attributes(self) -> dict[str, dict[str, Any]]:
+        """Return the high and low values, formatted for the high_low sensors."""
+        for sensor_id, record in self.records.items():
+            if sensor_id in self._attributes:
+                continue
+            attributes = {}
+            for extreme in ("max", "min"):
+                for period in PUBLISHED_PERIODS:
+                    key = f"{extreme}_{period}"
+                    attributes[key] = record[key]
+                    attributes[f"{key}_time"] = _isoformat(record[f"{key}_time"])
+            self._attributes[sensor_id] = attributes
+        return dict(self._attributes)
+
+    def _reset(
+        self, sensor_id: str, record: dict[str, Any], period: str, now: float
+    ) -> None:
+        """Start a period over from the latest value."""
+        if sensor_id in self._counters:
+            record[f"max_{period}"] = 0
+            record[f"max_{period}_time"] = now
+            return
+        for extreme in ("max", "min"):
+            record[f"{extreme}_{period}"] = record["latest"]
+            record[f"{extreme}_{period}_time"] = now
+
+    def _update_extremes(
+        self,
+        sensor_id: str,
+        record: dict[str, Any],
+        value: float | None,
+        timestamp: float | None,
+        keys: tuple[tuple[str, str], ...],
+    ) -> None:
+        """Set the value as the new max (or min) of the periods it exceeds."""
+        if value is None:
+            return
+        is_max = keys is _MAX_KEYS
+        for key, time_key in keys:
+            if (
+                (current := record[key]) is None
+                or (is_max and value > current)
+                or (not is_max and value < current)
+            ):
+                record[key] = value
+                record[time_key] = timestamp
+                self._attributes.pop(sensor_id, None)
@@ -0,0 +1,165 @@
+"""In-memory history of sensor values, used for trends and counts."""
+from __future__ import annotations
+
+import time
+from array import array
+from bisect import insort
+from math import ceil
+from typing import Any, Iterable
+
+from .const import (
+    PRESSURE_HISTORY_MARGIN,
+    PRESSURE_TREND_TIMER,
+    STRIKE_COUNT_TIMER,
+    UNITS_IMPERIAL,
+)
+
+
+class PressureHistory:
+    """Ring buffer with one sea level pressure sample per minute.
+
+    The buffer covers `duration` seconds plus a margin, so the sample from a
+    given time ago is found by looking at the slot of that minute, or of one of
+    the minutes just before it.
+    """
+
+    def __init__(
+        self,
+        unit_system: str,
+        duration: int = PRESSURE_TREND_TIMER,
+        margin: int = PRESSURE_HISTORY_MARGIN,
+        archive: bool = True,
+    ) -> None:
+        """Initialize the history."""
+        self._unit_system = unit_system
+        self._margin = ceil(margin / 60)
+        self._size = ceil(duration / 60) + self._margin + 1
+        self._times = array("d", [0.0]) * self._size
+        self._values = array("d", [0.0]) * self._size
+        self._archive = archive
+        self._unsaved: list[tuple[float, float]] = []
+
+    def seed(self, samples: Iterable[tuple[float, float]]) -> None:
+        """Fill the buffer with stored (timestamp, pressure) samples."""
+        for timestamp, pressure in samples:
+            self._store(timestamp, pressure)
+
+    def add(self, pressure: float, timestamp: float | None = None) -> None:
+        """Add a pressure sample."""
+        timestamp = timestamp or time.time()
+        self._store(timestamp, pressure)
+        if self._archive:
+            self._unsaved.append((timestamp, pressure))
+
+    def unsaved(self) -> list[tuple[float, float]]:
+        """Return the samples to archive."""
+        return self._unsaved
+
+    def saved(self) -> None:
+        """Forget the samples returned by `unsaved`, as they are archived."""
+        self._unsaved = []
+
+    def value_before(self, timestamp: float) -> float | None:
+        """Return the last sample taken before the timestamp, if recent enough."""
+        minute = int(timestamp // 60)
+        for slot_minute in range(minute, minute - self._margin - 1, -1):
+            slot = slot_minute % self._size
+            if (
+                sample_time := self._times[slot]
+            ) and sample_time // 60 == slot_minute and sample_time < timestamp:
+                return self._values[slot]
+        return None
+
+    def change(
+        self, pressure: float, seconds: int, now: float | None = None
+    ) -> float | None:
+        """Return the pressure change over the last `seconds`."""
+        if (old_pressure := self.value_before((now or time.time()) - seconds)) is None:
+            return None
+        return pressure - old_pressure
+
+    def trend(
+        self,
+        pressure: float,
+        translations: dict[str, Any],
+        seconds: int = PRESSURE_TREND_TIMER,
+        now: float | None = None,
+    ) -> tuple[str, float]:
+        """Return the pressure trend and change over the last `seconds`."""
+        pressure_delta = self.change(pressure, seconds, now) or 0
+
+        min_value = -1
+        max_value = 1
+        if self._unit_system == UNITS_IMPERIAL:
+            min_value = -0.0295
+            max_value = 0.0295
+
+        if min_value < pressure_delta < max_value:
+            return translations["trend"]["steady"], 0
+        if pressure_delta <= min_value:
+            return translations["trend"]["falling"], round(pressure_delta, 2)
+        return translations["trend"]["rising"], round(pressure_delta, 2)
+
+    def _store(self, timestamp: float, pressure: float) -> None:
+        """Store a sample in the slot of its minute."""
+        slot = int(timestamp // 60) % self._size
+        self._times[slot] = timestamp
+        self._values[slot] = pressure
+
+
+class LightningCounter:
+    """Sliding window count of the lightning strikes.
+
+    The strike times are kept in order. Every window has a cursor to the first
+    strike inside it, which only moves forward, so counting is O(1) amortized.
+    Strikes older than `duration` seconds are dropped.
+    """
+
+    def __init__(self, duration: int = STRIKE_COUNT_TIMER) -> None:
+        """Initialize the counter."""
+        self._duration = duration
+        self._times: list[float] = []
+        self._start = 0
+        self._cursors: dict[int, int] = {}
+
+    def seed(self, timestamps: Iterable[float]) -> None:
+        """Add stored strike times."""
+        for timestamp in timestamps:
+            self.add(timestamp)
+
+    def add(self, timestamp: float | None = None) -> None:
+        """Add a strike."""
+        timestamp = timestamp or time.time()
+        if not self._times or timestamp >= self._times[-1]:
+            self._times.append(timestamp)
+        else:
+            insort(self._times, timestamp, lo=self._start)
+            self._cursors.clear()
+
+    def count(self, seconds: int, now: float | None = None) -> int:
+        """Return the number of strikes during the last `seconds`."""
+        now = now or time.time()
+        self._drop_before(now - self._duration)
+
+        since = now - seconds
+        times = self._times
+        index = max(self._cursors.get(seconds, 0), self._start)
+        while index < len(times) and times[index] <= since:
+            index += 1
+        self._cursors[seconds] = index
+        return len(times) - index
+
+    def _drop_before(self, timestamp: float) -> None:
+        """Drop the strikes older than the counted windows."""
+        times = self._times
+        while self._start < len(times) and times[self._start] <= timestamp:
+            self._start += 1
+
+        # Release the memory once the dropped part is large enough
+        if self._start > 1000 and self._start * 2 > len(times):
+            del times[: self._start]
+            self._cursors = {
+                seconds: max(cursor - self._start, 0)
+                for seconds, cursor in self._cursors.items()
+            }
+            self._start = 0
@@ -0,0 +1,325 @@
+"""HTTP API serving the archived observations and their rollups."""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from math import ceil
+from pathlib import Path
+from typing import Any, Mapping
+
+from aiohttp import web
+
+from .const import (
+    HISTORY_API_CACHE_BYTES,
+    HISTORY_API_CACHE_SIZE,
+    HISTORY_API_CACHE_TTL,
+    HISTORY_API_RAW_CACHE_TTL,
+    HISTORY_API_CHUNK_ROWS,
+    HISTORY_API_MAX_POINTS,
+    HISTORY_API_PORT,
+    OBSERVATION_FIELDS,
+    ROLLUP_FIELDS,
+    ROLLUP_RESOLUTIONS,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+RESOLUTION = re.compile(r"^(\d+)([smhd]?)$")
+RESOLUTION_UNITS = {"": 1, "s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+# Seconds between the archived observations
+RAW_RESOLUTION = 60
+
+COLUMNS_RAW = ("device", "time", "value")
+COLUMNS_AGGREGATE = ("device", "time", "min", "max", "mean", "sum", "count")
+
+# First device of the table after the given one, using the primary key
+NEXT_DEVICE = "SELECT min(device) FROM {table} WHERE device > ?;"
+
+
+@dataclass
+class HistoryApiConfig:
+    """Dataclass to define the History API settings."""
+
+    host: str = "0.0.0.0"
+    port: int = HISTORY_API_PORT
+
+
+@dataclass(frozen=True)
+class HistoryQuery:
+    """A validated history query."""
+
+    sensor: str
+    device: str | None
+    start: int
+    end: int
+    resolution: int
+
+    @property
+    def rollup_resolution(self) -> int | None:
+        """Return the coarsest rollup within the resolution, if there is one."""
+        if self.sensor not in ROLLUP_FIELDS:
+            return None
+        return max(
+            (r for r in ROLLUP_RESOLUTIONS if r <= self.resolution), default=None
+        )
+
+    @property
+    def source(self) -> str:
+        """Return the table the rows are read from."""
+        return "observations" if self.rollup_resolution is None else "rollups"
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        """Return the columns of the rows of the answer."""
+        if self.sensor in ROLLUP_FIELDS and self.resolution > RAW_RESOLUTION:
+            return COLUMNS_AGGREGATE
+        return COLUMNS_RAW
+
+    def sql(self, devices: list[str]) -> tuple[str, tuple[Any, ...]]:
+        """Return the statement and parameters reading the rows.
+
+        The aggregation is done by SQLite, and the rows come in the order of
+        the primary key, so nothing has to be sorted.
+        """
+        where_devices = f"device IN ({', '.join('?' * len(devices))})"
+        if (rollup := self.rollup_resolution) is not None:
+            where = f"{where_devices} AND field = ? AND resolution = ?"
+            where += " AND bucket >= ? AND bucket < ?"
+            params = (*devices, self.sensor, rollup, self.start, self.end)
+            if rollup == self.resolution:
+                return (
+                    f"""SELECT device, bucket, min, max, sum / count, sum, count
+                        FROM rollups WHERE {where} ORDER BY device, bucket;""",
+                    params,
+                )
+            return (
+                f"""SELECT device, bucket - bucket % ? AS time, min(min), max(max),
+                        sum(sum) / sum(count), sum(sum), sum(count)
+                    FROM rollups WHERE {where}
+                    GROUP BY device, time ORDER BY device, time;""",
+                (self.resolution, *params),
+            )
+
+        # The sensor is one of OBSERVATION_FIELDS, checked when parsing
+        where = f"{where_devices} AND epoch >= ? AND epoch < ?"
+        params = (*devices, self.start, self.end)
+        if self.columns == COLUMNS_RAW:
+            return (
+                f"""SELECT device, epoch, {self.sensor} FROM observations
+                    WHERE {where} ORDER BY device, epoch;""",
+                params,
+            )
+        value = self.sensor
+        return (
+            f"""SELECT device, epoch - epoch % ? AS time, min({value}),
+                    max({value}), avg({value}), sum({value}), count({value})
+                FROM observations WHERE {where} AND {value} IS NOT NULL
+                GROUP BY device, time ORDER BY device, time;""",
+            (self.resolution, *params),
+        )
+
+
+def parse_time(value: str | None, default: float) -> int:
+    """Return the epoch of a time given as epoch or ISO 8601 string."""
+    if not value:
+        return int(default)
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError as e:
+        raise ValueError(f"Invalid time: {value}") from e
+
+
+def parse_query(args: Mapping[str, str], now: float | None = None) -> HistoryQuery:
+    """Return the query of the request arguments, or raise ValueError."""
+    if (sensor := args.get("sensor")) not in OBSERVATION_FIELDS:
+        raise ValueError(
+            f"Unknown sensor {sensor}, use one of {', '.join(OBSERVATION_FIELDS)}"
+        )
+    end = parse_time(args.get("to"), now or time.time())
+    start = parse_time(args.get("from"), end - 24 * 60 * 60)
+    if start >= end:
+        raise ValueError("from must be before to")
+
+    if resolution := args.get("resolution"):
+        if (match := RESOLUTION.match(resolution.lower())) is None:
+            raise ValueError(f"Invalid resolution: {resolution}")
+        resolution_seconds = int(match[1]) * RESOLUTION_UNITS[match[2]]
+    else:
+        # A whole number of the coarsest buckets, so they are not split
+        needed = (end - start) / HISTORY_API_MAX_POINTS
+        step = max(
+            (r for r in (RAW_RESOLUTION, *ROLLUP_RESOLUTIONS) if r <= needed),
+            default=RAW_RESOLUTION,
+        )
+        resolution_seconds = ceil(needed / step) * step
+    return HistoryQuery(
+        sensor=sensor,
+        device=args.get("device") or None,
+        start=start,
+        end=end,
+        resolution=max(resolution_seconds, RAW_RESOLUTION),
+    )
+
+
+class HistoryApi:
+    """Serve `/history` queries from a read-only connection to the database.
+
+    The queries run in a thread of their own, so neither the event loop nor
+    the database writer waits for them. Large answers are streamed in chunks
+    of rows. Small answers are kept in an LRU cache, until the data they
+    include may have changed. Settled rollups do not change, but the raw rows
+    are pruned, so answers made of them expire.
+    """
+
+    def __init__(
+        self,
+        database_file: str,
+        config: HistoryApiConfig = HistoryApiConfig(),
+        settle_time: float = 0,
+    ) -> None:
+        """Initialize the API.
+
+        Rows older than `settle_time` seconds are no longer written to.
+        """
+        self._database_file = database_file
+        self._config = config
+        self._settle_time = settle_time
+        self._connection: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="history-api")
+        self._runner: web.AppRunner | None = None
+        self._cache: OrderedDict[HistoryQuery, tuple[float, bytes]] = OrderedDict()
+        self.cache_hits = 0
+        self.queries = 0
+
+    async def start(self) -> None:
+        """Open the database and start the HTTP server."""
+        await self._run(self._connect)
+        app = web.Application()
+        app.router.add_get("/history", self._handle_history)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._config.host, self._config.port).start()
+        _LOGGER.info("History API listening on port %s", self._config.port)
+
+    async def stop(self) -> None:
+        """Stop the HTTP server and close the database."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown()
+
+    def _connect(self) -> None:
+        """Open the read-only connection, in the thread of the queries."""
+        uri = f"{Path(self._database_file).resolve().as_uri()}?mode=ro"
+        self._connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    async def _run(self, function, *args) -> Any:
+        """Run a function in the thread of the queries."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    def _execute(self, query: HistoryQuery) -> sqlite3.Cursor:
+        """Run the query, and return the cursor to read the rows from."""
+        assert self._connection
+        table = query.source
+        if query.device is not None:
+            devices = [query.device]
+        else:
+            # Walk the primary key, instead of scanning the table
+            devices = []
+            device = ""
+            while (
+                device := self._connection.execute(
+                    NEXT_DEVICE.format(table=table), (device,)
+                ).fetchone()[0]
+            ) is not None:
+                devices.append(device)
+        return self._connection.execute(*query.sql(devices))
+
+    @staticmethod
+    def _read_chunk(cursor: sqlite3.Cursor) -> bytes:
+        """Return the next rows of the cursor as JSON arrays."""
+        rows = cursor.fetchmany(HISTORY_API_CHUNK_ROWS)
+        return ", ".join(json.dumps(row) for row in rows).encode()
+
+    async def _handle_history(self, request: web.Request) -> web.StreamResponse:
+        """Answer a history query."""
+        try:
+            query = parse_query(request.query)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        self.queries += 1
+        now = time.time()
+        if (cached := self._cache.get(query)) is not None:
+            expires, body = cached
+            if expires > now:
+                self._cache.move_to_end(query)
+                self.cache_hits += 1
+                return web.Response(body=body, content_type="application/json")
+            del self._cache[query]
+
+        try:
+            cursor = await self._run(self._execute, query)
+        except sqlite3.Error as e:
+            _LOGGER.error("Could not read the history. Error: %s", e)
+            return web.json_response({"error": "Database error"}, status=500)
+
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        header = {
+            "sensor": query.sensor,
+            "from": query.start,
+            "to": query.end,
+            "resolution": query.resolution,
+            "source": query.source,
+            "columns": query.columns,
+        }
+        data = (json.dumps(header)[:-1] + ', "data": [').encode()
+        body: list[bytes] | None = []
+        size = 0
+        separator = b""
+        try:
+            while True:
+                await response.write(data)
+                if body is not None:
+                    body.append(data)
+                    if (size := size + len(data)) > HISTORY_API_CACHE_BYTES:
+                        body = None
+                if not (data := await self._run(self._read_chunk, cursor)):
+                    break
+                data = separator + data
+                separator = b", "
+        finally:
+            await self._run(cursor.close)
+        await response.write(b"]}")
+        await response.write_eof()
+
+        if body is not None:
+            body.append(b"]}")
+            if query.end > now - self._settle_time:
+                expires = now + HISTORY_API_CACHE_TTL
+            elif query.rollup_resolution is None:
+                expires = now + HISTORY_API_RAW_CACHE_TTL
+            else:
+                expires = float("inf")
+            self._cache[query] = (expires, b"".join(body))
+            if len(self._cache) > HISTORY_API_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return response
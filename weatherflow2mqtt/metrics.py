@@ -0,0 +1,238 @@
+"""Prometheus metrics of the processing pipeline."""
+from __future__ import annotations
+
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable
+
+from aiohttp import web
+
+from .const import METRICS_PORT
+
+_LOGGER = logging.getLogger(__name__)
+
+PREFIX = "weatherflow2mqtt_"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+@dataclass
+class MetricsConfig:
+    """Dataclass to define the metrics endpoint settings."""
+
+    host: str = "0.0.0.0"
+    port: int = METRICS_PORT
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        """Initialize the histogram."""
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add a value."""
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    """Return the labels in the text exposition format."""
+    parts = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """Counters, latency histograms and gauges, served on `/metrics`.
+
+    Nothing is timed unless a method is wrapped with `wrap`, so without a
+    `Metrics` instance the instrumented code runs unchanged. The wrapped
+    methods may run in other threads, like the database writer.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the metrics."""
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        self._gauges: dict[str, Callable[[], dict[Labels, float] | float | None]] = {}
+        self._runner: web.AppRunner | None = None
+
+    def counter(self, name: str, help_text: str) -> dict[Labels, float]:
+        """Return the values by labels of a counter."""
+        self._help.setdefault(name, ("counter", help_text))
+        return self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, labels: Labels, help_text: str) -> Histogram:
+        """Return the histogram of a metric with the labels."""
+        self._help.setdefault(name, ("histogram", help_text))
+        histograms = self._histograms.setdefault(name, {})
+        if (histogram := histograms.get(labels)) is None:
+            histogram = histograms[labels] = Histogram()
+        return histogram
+
+    def gauge(
+        self,
+        name: str,
+        function: Callable[[], dict[Labels, float] | float | None],
+        help_text: str,
+        kind: str = "gauge",
+    ) -> None:
+        """Add a value read when scraped, by labels or without labels."""
+        self._help[name] = (kind, help_text)
+        self._gauges[name] = function
+
+    def wrap(
+        self,
+        instance: Any,
+        method_name: str,
+        name: str,
+        help_text: str,
+        count: tuple[str, str, Callable[..., Labels]] | None = None,
+        **labels: str,
+    ) -> None:
+        """Time the calls of a method of the instance.
+
+        With `count`, a (name, help text, function) tuple, the calls are also
+        counted in that counter, by the labels the function returns for the
+        arguments of the call.
+        """
+        method = getattr(instance, method_name)
+        histogram = self.histogram(name, tuple(labels.items()), help_text)
+        if count is not None:
+            count_name, count_help, count_by = count
+            counts = self.counter(count_name, count_help)
+
+        if inspect.iscoroutinefunction(method):
+
+            @wraps(method)
+            async def timed_async(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+            setattr(instance, method_name, timed_async)
+            return
+
+        @wraps(method)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+                if count is not None:
+                    key = count_by(*args, **kwargs)
+                    counts[key] = counts.get(key, 0) + 1
+
+        setattr(instance, method_name, timed)
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+        for name, (kind, help_text) in sorted(self._help.items()):
+            full_name = PREFIX + name
+            samples: list[str] = []
+            if name in self._counters:
+                for labels, value in list(self._counters[name].items()):
+                    samples.append(f"{full_name}{format_labels(labels)} {value}")
+            elif name in self._histograms:
+                for labels, histogram in list(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                        cumulative += count
+                        bucket_labels = format_labels(labels, f'le="{bound}"')
+                        samples.append(
+                            f"{full_name}_bucket{bucket_labels} {cumulative}"
+                        )
+                    bucket_labels = format_labels(labels, 'le="+Inf"')
+                    samples.append(
+                        f"{full_name}_bucket{bucket_labels} {histogram.count}"
+                    )
+                    samples.append(
+                        f"{full_name}_sum{format_labels(labels)} {histogram.sum}"
+                    )
+                    samples.append(
+                        f"{full_name}_count{format_labels(labels)} {histogram.count}"
+                    )
+            elif name in self._gauges:
+                try:
+                    values = self._gauges[name]()
+                except Exception as e:
+                    _LOGGER.debug("Could not read metric %s: %s", name, e)
+                    continue
+                if values is None:
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for labels, value in values.items():
+                    samples.append(f"{full_name}{format_labels(labels)} {value}")
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def application(self) -> web.Application:
+        """Return the web application answering on `/metrics`."""
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        return app
+
+    async def start(self, config: MetricsConfig) -> None:
+        """Serve the metrics on `/metrics`."""
+        self._runner = web.AppRunner(self.application(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, config.host, config.port).start()
+        _LOGGER.info("Metrics served on port %s", config.port)
+
+    async def stop(self) -> None:
+        """Stop serving the metrics."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        """Answer a scrape."""
+        return web.Response(
+            body=self.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
@@ -0,0 +1,164 @@
+"""Batched MQTT publisher with acknowledgement based backpressure."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from paho.mqtt.client import Client as MqttClient
+from paho.mqtt.client import MQTTMessageInfo
+
+from .const import (
+    MQTT_ACK_TIMEOUT,
+    MQTT_BATCH_SIZE,
+    MQTT_LATENCY_SAMPLES,
+    MQTT_MAX_INFLIGHT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MqttPublisher:
+    """Publish queued MQTT messages in batches.
+
+    Instead of sleeping after every message, at most `max_inflight` messages
+    are waiting for the broker (or, for QoS 0, the socket) at any time, using
+    the `on_publish` acknowledgements of paho. `max_rate` optionally limits
+    the number of messages per second, 0 means no limit.
+
+    A queued message may carry a function, called once the message is
+    acknowledged, so the caller knows the broker has it.
+    """
+
+    def __init__(
+        self,
+        client: MqttClient,
+        queue: asyncio.Queue,
+        max_rate: float = 0,
+        max_inflight: int = MQTT_MAX_INFLIGHT,
+        batch_size: int = MQTT_BATCH_SIZE,
+    ) -> None:
+        """Initialize the publisher."""
+        self.client = client
+        self.queue = queue
+        self.max_rate = max_rate
+        self.max_inflight = max(1, max_inflight)
+        self.batch_size = max(1, batch_size)
+
+        self.published = 0
+        self.failed = 0
+        self._latencies: deque[float] = deque(maxlen=MQTT_LATENCY_SAMPLES)
+        self._inflight: dict[
+            int, tuple[MQTTMessageInfo, float, Callable[[], None] | None]
+        ] = {}
+        self._acked = asyncio.Event()
+        self._next_slot = 0.0
+        self._loop = asyncio.get_running_loop()
+
+        client.max_inflight_messages_set(self.max_inflight)
+        client.on_publish = self._on_publish
+
+    @property
+    def inflight(self) -> int:
+        """Return the number of messages waiting for an acknowledgement."""
+        return len(self._inflight)
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of messages waiting to be published."""
+        return self.queue.qsize()
+
+    def stats(self) -> dict[str, Any]:
+        """Return the publisher metrics."""
+        latencies = self._latencies
+        return {
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight,
+            "published": self.published,
+            "failed": self.failed,
+            "latency_avg": round(sum(latencies) / len(latencies), 4)
+            if latencies
+            else None,
+            "latency_max": round(max(latencies), 4) if latencies else None,
+        }
+
+    async def run(self) -> None:
+        """Publish messages from the queue until cancelled."""
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            for topic, payload, qos, retain, queued, on_ack in batch:
+                await self._wait_for_window()
+                await self._wait_for_rate()
+                self._publish(topic, payload, qos, retain, queued, on_ack)
+                self.queue.task_done()
+
+    def _publish(
+        self,
+        topic: str,
+        payload: str | None,
+        qos: int,
+        retain: bool,
+        queued: float,
+        on_ack: Callable[[], None] | None = None,
+    ) -> None:
+        """Publish a single message."""
+        try:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            self.failed += 1
+            _LOGGER.error("Could not connect to MQTT Server. Error is: %s", e)
+            return
+
+        if info.rc != MQTT_ERR_SUCCESS and qos == 0:
+            # QoS 0 messages are dropped by paho when not connected
+            self.failed += 1
+            _LOGGER.debug("Could not publish to %s. Error code: %s", topic, info.rc)
+            return
+
+        self._inflight[info.mid] = (info, queued, on_ack)
+
+    def _on_publish(self, client: MqttClient, userdata: Any, mid: int) -> None:
+        """Handle an acknowledgement from the paho network thread."""
+        self._loop.call_soon_threadsafe(self._acknowledge, mid, time.monotonic())
+
+    def _acknowledge(self, mid: int, acked: float) -> None:
+        """Release the window slot of an acknowledged message."""
+        if (item := self._inflight.pop(mid, None)) is None:
+            return
+        self.published += 1
+        self._latencies.append(acked - item[1])
+        self._acked.set()
+        if (on_ack := item[2]) is not None:
+            on_ack()
+
+    async def _wait_for_window(self) -> None:
+        """Wait until the in-flight window has room for another message."""
+        while len(self._inflight) >= self.max_inflight:
+            self._acked.clear()
+            try:
+                await asyncio.wait_for(self._acked.wait(), MQTT_ACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Give up on the oldest message, paho keeps retrying QoS > 0
+                mid = next(iter(self._inflight))
+                self._inflight.pop(mid)
+                self.failed += 1
+                _LOGGER.warning(
+                    "No acknowledgement from the MQTT Server within %s seconds",
+                    MQTT_ACK_TIMEOUT,
+                )
+
+    async def _wait_for_rate(self) -> None:
+        """Wait for the next publish slot when the rate is limited."""
+        if self.max_rate <= 0:
+            return
+        now = time.monotonic()
+        if (delay := self._next_slot - now) > 0:
+            await asyncio.sleep(delay)
+            now = self._next_slot
+        self._next_slot = now + 1 / self.max_rate
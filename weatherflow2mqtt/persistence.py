@@ -0,0 +1,203 @@
+"""Database writer thread, keeping the disk I/O off the event loop."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable
+
+from .const import DATABASE_QUEUE_SIZE, MQTT_LATENCY_SAMPLES
+from .sqlite import SQLFunctions
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds the writer waits for a command before checking if a commit is due
+IDLE_TIMEOUT = 1
+
+_STOP = object()
+
+
+class Persistence:
+    """Run the calls to the database in a writer thread.
+
+    Once started, the thread owns the connection of `sql` and runs the queued
+    calls in order. Writes return at once, reads are queued behind them and
+    awaited, so they see all earlier writes. The writes are committed by the
+    thread, when the flush interval or size of `sql` is reached.
+
+    The arguments of a write are used later, in the thread, so they must not
+    be changed afterwards; pass a copy of mutable state.
+
+    Nothing here ever waits for the writer, and no write is dropped. A write
+    with a `key` replaces the write with the same key that is still waiting,
+    as only the last one counts. A warning is logged when more than
+    `max_queue` calls are waiting, because the disk is too slow.
+    """
+
+    def __init__(self, sql: SQLFunctions, max_queue: int = DATABASE_QUEUE_SIZE):
+        """Initialize the facade."""
+        self.sql = sql
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._max_queue = max(1, max_queue)
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        # Arguments of the keyed writes waiting in the queue
+        self._pending: dict[Any, tuple[Any, ...]] = {}
+        self._pending_lock = threading.Lock()
+
+        self.done = 0
+        self.failed = 0
+        self.coalesced = 0
+        self._behind = False
+        self.max_queue_depth = 0
+        self._latencies: deque[float] = deque(maxlen=MQTT_LATENCY_SAMPLES)
+        self._durations: deque[float] = deque(maxlen=MQTT_LATENCY_SAMPLES)
+
+    @property
+    def closed(self) -> bool:
+        """Return `True` once the database is closed for writes."""
+        return self._closed
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of calls waiting for the writer."""
+        return self._queue.qsize()
+
+    def stats(self) -> dict[str, Any]:
+        """Return the writer metrics.
+
+        The latency is the time from queueing a call until it is done, the
+        duration the time spent running it.
+        """
+        latencies = self._latencies
+        durations = self._durations
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "done": self.done,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "latency_avg": round(sum(latencies) / len(latencies), 4)
+            if latencies
+            else None,
+            "latency_max": round(max(latencies), 4) if latencies else None,
+            "duration_avg": round(sum(durations) / len(durations), 4)
+            if durations
+            else None,
+        }
+
+    def start(self) -> None:
+        """Start the writer thread, which owns the connection from now on."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="database-writer", daemon=True
+            )
+            self._thread.start()
+
+    def write(self, method: Callable[..., Any], *args: Any, key: Any = None) -> bool:
+        """Queue a write, without waiting for it, and return `True` if queued.
+
+        A write is refused once the database is closed.
+        """
+        if self._closed:
+            _LOGGER.error("Database write %s after closing", method.__name__)
+            return False
+        if self._thread is None:
+            return method(*args) is not False
+        if key is not None:
+            with self._pending_lock:
+                if key in self._pending:
+                    self._pending[key] = args
+                    self.coalesced += 1
+                    return True
+                self._pending[key] = args
+            args = ()
+        self._put((method, args, None, time.monotonic(), key))
+        return True
+
+    async def read(self, method: Callable[..., Any], *args: Any) -> Any:
+        """Queue a call, and return its result once it ran."""
+        if self._thread is None:
+            return method(*args)
+        future: Future = Future()
+        self._put((method, args, future, time.monotonic(), None))
+        return await asyncio.wrap_future(future)
+
+    async def close(self) -> None:
+        """Run the queued calls, then commit and close the connection."""
+        self._closed = True
+        if self._thread is None:
+            self.sql.close()
+            return
+        self._put(_STOP)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+
+    def _put(self, command: Any) -> None:
+        """Add a command to the queue, and warn if the writer falls behind."""
+        depth = self._queue.qsize()
+        if depth >= self._max_queue and not self._behind:
+            self._behind = True
+            _LOGGER.warning(
+                "The database can not keep up, %s calls are waiting", depth
+            )
+        elif self._behind and depth < self._max_queue // 2:
+            self._behind = False
+            _LOGGER.warning("The database caught up, %s calls are waiting", depth)
+        self._queue.put_nowait(command)
+        if depth + 1 > self.max_queue_depth:
+            self.max_queue_depth = depth + 1
+
+    def _run(self) -> None:
+        """Run the queued calls until stopped."""
+        sql = self.sql
+        while True:
+            try:
+                command = self._queue.get(timeout=IDLE_TIMEOUT)
+            except queue.Empty:
+                sql.flush_if_due()
+                continue
+
+            # Group the calls waiting in the queue in one transaction
+            with sql.batch():
+                while command is not _STOP:
+                    self._execute(*command)
+                    try:
+                        command = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+            if command is _STOP:
+                sql.close()
+                return
+
+    def _execute(
+        self,
+        method: Callable[..., Any],
+        args: tuple[Any, ...],
+        future: Future | None,
+        queued: float,
+        key: Any,
+    ) -> None:
+        """Run a call, and hand its result to the waiting caller."""
+        if key is not None:
+            with self._pending_lock:
+                args = self._pending.pop(key)
+        start = time.monotonic()
+        try:
+            result = method(*args)
+        except Exception as e:
+            self.failed += 1
+            _LOGGER.error("Database call %s failed. Error: %s", method.__name__, e)
+            if future is not None:
+                future.set_exception(e)
+        else:
+            if future is not None:
+                future.set_result(result)
+        end = time.monotonic()
+        self.done += 1
+        self._durations.append(end - start)
+        self._latencies.append(end - queued)
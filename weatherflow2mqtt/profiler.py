@@ -0,0 +1,198 @@
+"""Sampling profiler writing collapsed stacks for flame graphs."""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+
+from .const import (
+    PROFILE_DIRECTORY,
+    PROFILE_DUMP_INTERVAL,
+    PROFILE_FILES,
+    PROFILE_MAX_WINDOW,
+    PROFILE_SAMPLE_INTERVAL,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+FILE_PREFIX = "profile-"
+FILE_SUFFIX = ".collapsed"
+
+Stack = tuple[str, tuple[CodeType, ...]]
+
+
+@dataclass
+class ProfilerConfig:
+    """Dataclass to define the profiler settings."""
+
+    enabled: bool = False
+    directory: str = PROFILE_DIRECTORY
+    dump_interval: int = PROFILE_DUMP_INTERVAL
+    files: int = PROFILE_FILES
+    sample_interval: float = PROFILE_SAMPLE_INTERVAL
+
+
+def frame_name(code: CodeType) -> str:
+    """Return the name of a function in a collapsed stack."""
+    file_name = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({file_name}:{code.co_firstlineno})"
+
+
+def format_stacks(stacks: dict[Stack, int]) -> str:
+    """Return the sampled stacks in the collapsed format of flamegraph.pl."""
+    lines = [
+        ";".join((thread, *(frame_name(code) for code in codes))) + f" {count}"
+        for (thread, codes), count in stacks.items()
+    ]
+    lines.sort()
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads from a thread of its own.
+
+    Every `sample_interval` seconds the current frame of each thread is read
+    with `sys._current_frames`, and the stack is counted. Nothing is traced,
+    so the profiled code runs at full speed between the samples. The counts
+    are written every `dump_interval` minutes, and when the profiler stops,
+    to a file in the collapsed format, keeping the last `files` files.
+    """
+
+    def __init__(self, config: ProfilerConfig = ProfilerConfig()) -> None:
+        """Initialize the profiler."""
+        self._config = config
+        self._thread: threading.Thread | None = None
+        # Threads stopped, but maybe still writing their last samples
+        self._stopped: list[threading.Thread] = []
+        self._stop = threading.Event()
+        # Monotonic time the profiling window ends, None to run until stopped
+        self._until: float | None = None
+        self.samples = 0
+
+    @property
+    def is_running(self) -> bool:
+        """Return `True` if the profiler is sampling."""
+        return (
+            self._thread is not None
+            and self._thread.is_alive()
+            and not self._stop.is_set()
+        )
+
+    def start(self, duration: float | None = None) -> None:
+        """Start sampling, for `duration` seconds or until stopped.
+
+        A window is limited to PROFILE_MAX_WINDOW seconds. Starting a window
+        while the profiler runs until stopped does not end it earlier. A
+        thread still ending after `stop` is left to finish, and a new one
+        samples the new window.
+        """
+        if duration is not None and not math.isfinite(duration):
+            _LOGGER.warning("Invalid profiling window: %s", duration)
+            return
+        running = self.is_running
+        if duration is not None:
+            duration = min(max(duration, 0), PROFILE_MAX_WINDOW)
+            if not running or self._until is not None:
+                self._until = time.monotonic() + duration
+        elif not running or self._until is not None:
+            self._until = None
+        if running:
+            return
+
+        if self._thread is not None:
+            self._stopped = [t for t in self._stopped if t.is_alive()]
+            self._stopped.append(self._thread)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(self._stop,), name="profiler", daemon=True
+        )
+        self._thread.start()
+        _LOGGER.info(
+            "Profiling %s, writing to %s",
+            "until stopped" if duration is None else f"for {duration:.0f} seconds",
+            self._config.directory,
+        )
+
+    def stop(self) -> None:
+        """Stop sampling, and write the samples of the last interval."""
+        self._stop.set()
+
+    def join(self) -> None:
+        """Wait until the last samples are written."""
+        for thread in self._stopped:
+            thread.join()
+        self._stopped = []
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, stop: threading.Event) -> None:
+        """Sample until stopped or the window ends."""
+        own_thread = threading.get_ident()
+        interval = self._config.sample_interval
+        dump_interval = self._config.dump_interval * 60
+        next_dump = time.monotonic() + dump_interval
+        stacks: dict[Stack, int] = {}
+        names: dict[int, str] = {}
+        frame = None
+        while not stop.wait(interval):
+            frames = sys._current_frames()
+            for thread_id, frame in frames.items():
+                if thread_id == own_thread:
+                    continue
+                if (name := names.get(thread_id)) is None:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    name = names.setdefault(thread_id, str(thread_id))
+                key = (name, self._codes(frame))
+                stacks[key] = stacks.get(key, 0) + 1
+            self.samples += 1
+            # Do not keep the frames, and their locals, alive until the next one
+            del frames, frame
+
+            now = time.monotonic()
+            if self._until is not None and now >= self._until:
+                break
+            if now >= next_dump:
+                self._dump(stacks)
+                stacks = {}
+                next_dump = now + dump_interval
+        self._dump(stacks)
+        _LOGGER.info("Profiling stopped")
+
+    @staticmethod
+    def _codes(frame: FrameType | None) -> tuple[CodeType, ...]:
+        """Return the code objects of a stack, outermost first."""
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def _dump(self, stacks: dict[Stack, int]) -> None:
+        """Write the counted stacks to a new file, and remove the oldest."""
+        if not stacks:
+            return
+        directory = Path(self._config.directory)
+        now = datetime.now()
+        stamp = f"{now:%Y%m%d-%H%M%S}.{now.microsecond // 1000:03d}"
+        name = f"{FILE_PREFIX}{stamp}{FILE_SUFFIX}"
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            temporary = directory / f".{name}"
+            temporary.write_text(format_stacks(stacks))
+            os.replace(temporary, directory / name)
+            files = sorted(directory.glob(f"{FILE_PREFIX}*{FILE_SUFFIX}"))
+            for old in files[: max(len(files) - self._config.files, 0)]:
+                old.unlink()
+        except OSError as e:
+            _LOGGER.error("Could not write the profile %s. Error: %s", name, e)
+            return
+        _LOGGER.debug("Wrote %s stacks to %s", len(stacks), name)
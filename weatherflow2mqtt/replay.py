@@ -0,0 +1,520 @@
+"""Record the UDP traffic of a station, and replay it through the handlers.
+
+A recording is a text file with one JSON object per line, holding the receive
+time and the datagram, like `{"time": 1639059600.5, "data": {...}}`. Lines with
+just a datagram are replayed at the time found in the datagram.
+
+The replay feeds the datagrams to a `WeatherFlowListener` wired to a regular
+`WeatherFlowMqtt`, so the observation, database and MQTT code run unchanged.
+The MQTT messages go to a capture sink (or to a real MQTT server), and the
+timings of the pipeline stages are reported, which allows measuring changes
+offline and diffing the produced messages.
+
+    python -m weatherflow2mqtt.replay record station.jsonl --duration 3600
+    python -m weatherflow2mqtt.replay replay station.jsonl --speed 0 \\
+        --output messages.jsonl --report report.json
+
+With `--stations`, copies of the recording are replayed as extra stations, each
+on its own listener, which measures the cost of every additional station.
+
+The `forecast` command times the processing of a saved `better_forecast`
+response of the WeatherFlow API, by default the one in `fixtures`. It is
+processed as of the time of the response, so the result does not depend on
+when the command runs.
+
+    python -m weatherflow2mqtt.replay forecast [better_forecast.json]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Iterator, TextIO
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
+from pyweatherflowudp.aioudp import open_local_endpoint
+
+from .const import FULL_STATE_INTERVAL, LANGUAGE_ENGLISH, UNITS_METRIC
+from .forecast import Forecast
+from .helpers import ConversionFunctions
+from .weatherflow_mqtt import MqttConfig, WeatherFlowMqtt
+
+# Anonymised better_forecast response, used when no response is given
+FORECAST_FIXTURE = os.path.join(
+    os.path.dirname(__file__), "fixtures", "better_forecast.json"
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds of recorded time between the runs of the time based updates
+TIME_BASED_UPDATES_INTERVAL = 60
+# Handler methods timed as a stage of the pipeline
+HANDLER_STAGES = {
+    "_setup_sensors": "setup_sensors",
+    "_handle_observation_event": "observation",
+    "_handle_status_update_event": "status",
+    "_handle_strike_event": "strike",
+    "_handle_wind_event": "rapid_wind",
+    "_handle_rain_start_event": "rain_start",
+}
+# Database methods timed as a stage of the pipeline
+SQL_STAGES = {
+    "flush": "sql_commit",
+    "writeStorage": "sql_write",
+    "writeLightning": "sql_write",
+    "writeHighLow": "sql_write",
+    "writePressureSamples": "sql_write",
+    "writeObservations": "sql_write",
+}
+
+
+def station_copy(message: dict[str, Any], number: int) -> dict[str, Any]:
+    """Return the message as sent by copy `number` of the station."""
+    if number == 0:
+        return message
+    message = dict(message)
+    for key in ("serial_number", "hub_sn"):
+        if key in message:
+            message[key] = f"{message[key]}-{number}"
+    return message
+
+
+def max_rss_mb() -> float | None:
+    """Return the peak memory use of the process in MB."""
+    if resource is None:
+        return None
+    # Linux reports kB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def message_time(message: dict[str, Any]) -> float | None:
+    """Return the time a datagram was sent at, if it has one."""
+    if (timestamp := message.get("timestamp")) is not None:
+        return timestamp
+    for key in ("obs", "ob", "evt"):
+        if values := message.get(key):
+            return values[0][0] if isinstance(values[0], list) else values[0]
+    return None
+
+
+def read_recording(file: TextIO) -> Iterator[tuple[float | None, bytes]]:
+    """Yield the receive time and the datagram of the lines of a recording."""
+    for line_number, line in enumerate(file, 1):
+        if not (line := line.strip()):
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            _LOGGER.warning("Skipping line %s of the recording: %s", line_number, e)
+            continue
+        if "data" in record:
+            message, timestamp = record["data"], record.get("time")
+        else:
+            message, timestamp = record, message_time(record)
+        yield timestamp, json.dumps(message).encode()
+
+
+class CaptureClient:
+    """Stand-in for the paho MQTT client, keeping the published messages."""
+
+    def __init__(self) -> None:
+        """Initialize the client."""
+        self.messages: list[tuple[str, str | None, int, bool]] = []
+        self.on_publish: Callable[[Any, Any, int], None] | None = None
+
+    def max_inflight_messages_set(self, inflight: int) -> None:
+        """Accept the in-flight limit of the publisher."""
+
+    def publish(
+        self, topic: str, payload: str | None = None, qos: int = 0, retain: bool = False
+    ) -> MQTTMessageInfo:
+        """Capture a message, and acknowledge it right away."""
+        self.messages.append((topic, payload, qos, retain))
+        info = MQTTMessageInfo(len(self.messages))
+        info.rc = MQTT_ERR_SUCCESS
+        if self.on_publish is not None:
+            self.on_publish(self, None, info.mid)
+        return info
+
+    def loop_stop(self) -> None:
+        """Nothing to stop."""
+
+    def disconnect(self) -> None:
+        """Nothing to disconnect."""
+
+
+class StageTimer:
+    """Collect the durations of the pipeline stages.
+
+    Stages are timed by wrapping methods of an instance, so stages calling each
+    other (like an observation committing to the database) overlap.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the timer."""
+        self.durations: dict[str, list[float]] = {}
+
+    def add(self, stage: str, duration: float) -> None:
+        """Add the duration of a stage."""
+        self.durations.setdefault(stage, []).append(duration)
+
+    def wrap(self, instance: Any, method_name: str, stage: str) -> None:
+        """Time the calls of a method of the instance."""
+        method = getattr(instance, method_name)
+
+        @wraps(method)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        setattr(instance, method_name, timed)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Return the count and the duration statistics (in ms) of the stages."""
+        summary = {}
+        for stage, durations in self.durations.items():
+            ordered = sorted(durations)
+            count = len(ordered)
+            summary[stage] = {
+                "count": count,
+                "total": round(sum(ordered) * 1000, 3),
+                "avg": round(sum(ordered) / count * 1000, 4),
+                "p50": round(ordered[count // 2] * 1000, 4),
+                "p99": round(ordered[min(count - 1, count * 99 // 100)] * 1000, 4),
+                "max": round(ordered[-1] * 1000, 4),
+            }
+        return summary
+
+
+async def replay(
+    weatherflowmqtt: WeatherFlowMqtt,
+    recording: Iterator[tuple[float | None, bytes]],
+    speed: float = 1,
+    timer: StageTimer | None = None,
+    stations: int = 1,
+) -> dict[str, Any]:
+    """Feed the recorded datagrams through the handlers of the instance.
+
+    A `speed` of 1 keeps the recorded pace, 10 replays ten times faster and 0
+    replays as fast as possible. The publisher of the instance must be started.
+    With several `stations`, every datagram is also fed to a listener per extra
+    station, with the serial numbers of the copy.
+    """
+    timer = timer or StageTimer()
+    for method_name, stage in HANDLER_STAGES.items():
+        timer.wrap(weatherflowmqtt, method_name, stage)
+    for method_name, stage in SQL_STAGES.items():
+        timer.wrap(weatherflowmqtt.sql, method_name, stage)
+
+    publisher = weatherflowmqtt.publisher
+    publish = publisher._publish
+
+    def timed_publish(topic, payload, qos, retain, queued, on_ack=None):
+        timer.add("mqtt_queue", time.monotonic() - queued)
+        publish(topic, payload, qos, retain, queued, on_ack)
+
+    publisher._publish = timed_publish
+
+    listeners = [weatherflowmqtt.create_listener() for _ in range(stations)]
+    weatherflowmqtt.listeners.extend(listeners)
+    packets = Counter()
+    first_time = next_updates = None
+    start = time.perf_counter()
+
+    for timestamp, data in recording:
+        if timestamp is not None:
+            if first_time is None:
+                first_time = next_updates = timestamp
+            if speed > 0:
+                delay = (timestamp - first_time) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if timestamp >= next_updates:
+                update_start = time.perf_counter()
+                await weatherflowmqtt.run_time_based_updates()
+                timer.add("time_based_updates", time.perf_counter() - update_start)
+                next_updates = timestamp + TIME_BASED_UPDATES_INTERVAL
+
+        message = json.loads(data)
+        for number, listener in enumerate(listeners):
+            if number:
+                data = json.dumps(station_copy(message, number)).encode()
+            packet_start = time.perf_counter()
+            listener._process_message(data)
+            timer.add("udp_packet", time.perf_counter() - packet_start)
+            packets[message.get("type", "unknown")] += 1
+
+        # Let the publisher run, like between received datagrams
+        await asyncio.sleep(0)
+
+    processed = time.perf_counter() - start
+    await publisher.queue.join()
+    while publisher.inflight:
+        await asyncio.sleep(0.01)
+    # Wait for the database writer to commit the queued writes
+    await weatherflowmqtt.db.read(weatherflowmqtt.sql.flush)
+    elapsed = time.perf_counter() - start
+
+    total = sum(packets.values())
+    return {
+        "stations": stations,
+        "packets": total,
+        "packet_types": dict(packets),
+        "processing_seconds": round(processed, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "packets_per_second": round(total / elapsed, 1) if elapsed else None,
+        "mqtt": publisher.stats(),
+        "database": weatherflowmqtt.db.stats(),
+        "max_rss_mb": max_rss_mb(),
+        "stages": timer.summary(),
+    }
+
+
+async def record(file: TextIO, host: str, port: int, duration: float | None) -> int:
+    """Write the datagrams received on the UDP port, return their number."""
+    endpoint = await open_local_endpoint(host=host, port=port)
+    _LOGGER.info("Recording the UDP traffic on port %s", port)
+    count = 0
+
+    async def receive() -> None:
+        nonlocal count
+        while not endpoint.closed:
+            data, _ = await endpoint.receive()
+            try:
+                message = json.loads(data)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                _LOGGER.warning("Received unknown message: %s", data)
+                continue
+            file.write(json.dumps({"time": time.time(), "data": message}) + "\n")
+            count += 1
+
+    try:
+        await asyncio.wait_for(receive(), duration)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    finally:
+        endpoint.close()
+    return count
+
+
+async def run_replay(args: argparse.Namespace) -> dict[str, Any]:
+    """Replay a recording with the command line settings."""
+    with tempfile.TemporaryDirectory() as directory:
+        weatherflowmqtt = WeatherFlowMqtt(
+            elevation=args.elevation,
+            latitude=args.latitude,
+            longitude=args.longitude,
+            unit_system=args.unit_system,
+            rapid_wind_interval=args.rapid_wind_interval,
+            language=args.language,
+            mqtt_config=MqttConfig(
+                host=args.mqtt_host or "127.0.0.1",
+                port=args.mqtt_port,
+                changes_only=args.publish_changes_only,
+                full_state_interval=args.full_state_interval,
+            ),
+            database_file=args.database or os.path.join(directory, "replay.db"),
+            filter_sensors=[sensor.strip() for sensor in args.filter_sensors.split(",")]
+            if args.filter_sensors
+            else None,
+        )
+        if args.mqtt_host:
+            weatherflowmqtt.connect_mqtt()
+            capture = None
+        else:
+            weatherflowmqtt.mqtt_client = capture = CaptureClient()
+        weatherflowmqtt.start_publisher()
+
+        try:
+            with open(args.recording) as file:
+                report = await replay(
+                    weatherflowmqtt,
+                    read_recording(file),
+                    speed=args.speed,
+                    stations=args.stations,
+                )
+        finally:
+            await weatherflowmqtt.close()
+
+    if capture is not None and args.output:
+        with open(args.output, "w") as file:
+            for topic, payload, qos, retain in capture.messages:
+                file.write(
+                    json.dumps(
+                        {"topic": topic, "payload": payload, "qos": qos, "retain": retain}
+                    )
+                    + "\n"
+                )
+    return report
+
+
+def response_time(json_data: dict[str, Any]) -> datetime:
+    """Return the time a `better_forecast` response was made."""
+    if (epoch := json_data.get("current_conditions", {}).get("time")) is None:
+        epoch = json_data["forecast"]["hourly"][0]["time"]
+    return datetime.fromtimestamp(epoch)
+
+
+def run_forecast(args: argparse.Namespace) -> dict[str, Any]:
+    """Time the processing of a saved forecast response."""
+    with open(args.response) as file:
+        json_data = json.load(file)
+    now = response_time(json_data)
+    forecast = Forecast(
+        station_id="",
+        token="",
+        conversions=ConversionFunctions(args.unit_system, args.language),
+    )
+
+    timer = StageTimer()
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        condition_data, fcst_data = forecast.process_forecast(json_data, now)
+        timer.add("process_forecast", time.perf_counter() - start)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {"state": condition_data, "attributes": fcst_data}, file, indent=2
+            )
+    return {
+        "daily": len(fcst_data["daily_forecast"]),
+        "hourly": len(fcst_data["hourly_forecast"]),
+        "stages": timer.summary(),
+    }
+
+
+def print_report(report: dict[str, Any]) -> None:
+    """Print a replay report."""
+    print(
+        f"{report['packets']} packets of {report['stations']} station(s) in "
+        f"{report['elapsed_seconds']} s, {report['packets_per_second']} packets/s"
+    )
+    print(f"Peak memory: {report['max_rss_mb']} MB")
+    print(f"Packet types: {report['packet_types']}")
+    print(f"MQTT: {report['mqtt']}")
+    print(f"Database: {report['database']}")
+    print(f"{'stage':<20}{'count':>8}{'avg ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in sorted(report["stages"].items()):
+        print(
+            f"{stage:<20}{stats['count']:>8}{stats['avg']:>10.3f}"
+            f"{stats['p50']:>10.3f}{stats['p99']:>10.3f}{stats['max']:>10.3f}"
+        )
+
+
+def main() -> None:
+    """Entry point of the replay tool."""
+    parser = argparse.ArgumentParser(
+        prog="weatherflow2mqtt-replay",
+        description="Record the UDP traffic of a station, or replay a recording.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record the UDP traffic")
+    record_parser.add_argument("recording", help="file to write the datagrams to")
+    record_parser.add_argument("--host", default="0.0.0.0")
+    record_parser.add_argument("--port", type=int, default=50222)
+    record_parser.add_argument(
+        "--duration", type=float, help="seconds to record, default until stopped"
+    )
+
+    replay_parser = commands.add_parser("replay", help="replay a recording")
+    replay_parser.add_argument("recording", help="file with the recorded datagrams")
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="replay speed, 1 for the recorded pace and 0 for as fast as possible",
+    )
+    replay_parser.add_argument(
+        "--stations",
+        type=int,
+        default=1,
+        help="number of copies of the recorded station to replay at once",
+    )
+    replay_parser.add_argument("--unit-system", default=UNITS_METRIC)
+    replay_parser.add_argument("--language", default=LANGUAGE_ENGLISH)
+    replay_parser.add_argument("--elevation", type=float, default=0)
+    replay_parser.add_argument("--latitude", type=float, default=0)
+    replay_parser.add_argument("--longitude", type=float, default=0)
+    replay_parser.add_argument("--rapid-wind-interval", type=int, default=0)
+    replay_parser.add_argument("--filter-sensors", help="comma separated sensor ids")
+    replay_parser.add_argument("--publish-changes-only", action="store_true")
+    replay_parser.add_argument(
+        "--full-state-interval", type=int, default=FULL_STATE_INTERVAL
+    )
+    replay_parser.add_argument(
+        "--database", help="database to use, default a new temporary database"
+    )
+    replay_parser.add_argument(
+        "--mqtt-host", help="publish to this MQTT server instead of capturing"
+    )
+    replay_parser.add_argument("--mqtt-port", type=int, default=1883)
+    replay_parser.add_argument(
+        "--output", help="file to write the captured MQTT messages to"
+    )
+    replay_parser.add_argument("--report", help="file to write the report to as JSON")
+
+    forecast_parser = commands.add_parser(
+        "forecast", help="time the processing of a saved forecast response"
+    )
+    forecast_parser.add_argument(
+        "response",
+        nargs="?",
+        default=FORECAST_FIXTURE,
+        help="file with a better_forecast response of the API",
+    )
+    forecast_parser.add_argument("--repeat", type=int, default=100)
+    forecast_parser.add_argument("--unit-system", default=UNITS_METRIC)
+    forecast_parser.add_argument("--language", default=LANGUAGE_ENGLISH)
+    forecast_parser.add_argument(
+        "--output", help="file to write the forecast state and attributes to"
+    )
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    if args.command == "record":
+        with open(args.recording, "a") as file:
+            try:
+                count = asyncio.run(record(file, args.host, args.port, args.duration))
+                print(f"Recorded {count} datagrams")
+            except KeyboardInterrupt:
+                print("\nRecording stopped")
+        return
+
+    if args.command == "forecast":
+        report = run_forecast(args)
+        print(f"{report['daily']} days and {report['hourly']} hours")
+        for stage, stats in report["stages"].items():
+            print(
+                f"{stage}: {stats['count']} runs, avg {stats['avg']:.3f} ms, "
+                f"p99 {stats['p99']:.3f} ms"
+            )
+        return
+
+    report = asyncio.run(run_replay(args))
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
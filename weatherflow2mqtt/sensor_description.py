@@ -8,12 +8,9 @@ from pyweatherflowudp.device import (
     EVENT_OBSERVATION,
     EVENT_RAPID_WIND,
     EVENT_STATUS_UPDATE,
-    TempestDevice,
-    WeatherFlowDevice,
 )
 
 from weatherflow2mqtt.helpers import ConversionFunctions
-from weatherflow2mqtt.sqlite import SQLFunctions
 
 from .const import (
     DEVICE_CLASS_BATTERY,
@@ -43,18 +40,33 @@ UV_INDEX = "UV index"
 
 @dataclass
 class BaseSensorDescription:
-    """Base sensor description."""
+    """Base sensor description.
+
+    `inputs` names the values the sensor is derived from. A name is either the
+    id (or description key) of another sensor of the device, or a station value
+    such as `elevation`, `latitude` or `wind_speed`.
+
+    A new value is not published when the last value was published less than
+    `min_interval` seconds ago. A value differing less than `deadband` from the
+    last published value (a fraction of that value if `relative_deadband`) is
+    only published once `min_interval`, or DEADBAND_MAX_AGE without one, passed.
+    """
 
     id: str
     name: str
     event: str
 
     attr: str | None = None
+    deadband: float = 0
+    description_id: str | None = None
     device_class: str | None = None
     extra_att: bool = False
     has_description: bool = False
     icon: str | None = None
+    inputs: tuple[str, ...] = field(default_factory=tuple[str, ...])
     last_reset: bool = False
+    min_interval: int = 0
+    relative_deadband: bool = False
     show_min_att: bool = False
     state_class: str | None = None
     unit_i: str | None = None
@@ -67,6 +79,13 @@ class BaseSensorDescription:
         """Return the device attr."""
         return self.id if self.attr is None else self.attr
 
+    @property
+    def description_key(self) -> str | None:
+        """Return the payload key of the description value, if any."""
+        if not self.has_description:
+            return None
+        return self.description_id or f"{self.id}_description"
+
     @property
     def imperial_unit(self) -> str | None:
         """Return the imperial unit."""
@@ -88,20 +107,17 @@ class BaseSensorDescription:
 
 @dataclass
 class SensorDescription(BaseSensorDescription):
-    """Sensor description."""
-
-    custom_fn: Callable[[ConversionFunctions, WeatherFlowDevice], Any] | Callable[
-        [ConversionFunctions, WeatherFlowDevice, Any | None], Any
-    ] | None = None
-    decimals: tuple[int | None, int | None] = (None, None)
-    inputs: tuple[str, ...] = field(default_factory=tuple[str, ...])
+    """Sensor description.
 
+    `custom_fn` is called with the conversion functions, followed by the
+    magnitudes of the `device_inputs` attributes and the `inputs` values. The
+    value is only recalculated when one of those changed, unless `volatile`.
+    """
 
-@dataclass
-class SqlSensorDescription(BaseSensorDescription):
-    """Sql-based sensor description."""
-
-    sql_fn: Callable[[SQLFunctions], Any] | None = None
+    custom_fn: Callable[..., Any] | None = None
+    decimals: tuple[int | None, int | None] = (None, None)
+    device_inputs: tuple[str, ...] = field(default_factory=tuple[str, ...])
+    volatile: bool = False
 
 
 @dataclass
@@ -137,11 +153,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         state_class=STATE_CLASS_MEASUREMENT,
         icon="water-opacity",
         attr="relative_humidity",
-        custom_fn=lambda cnv, device: None
-        if None in (device.air_temperature, device.relative_humidity)
-        else cnv.absolute_humidity(
-            device.air_temperature.m, device.relative_humidity.m
-        ),
+        device_inputs=("air_temperature", "relative_humidity"),
+        custom_fn=lambda cnv, temperature, humidity: None
+        if None in (temperature, humidity)
+        else cnv.absolute_humidity(temperature, humidity),
     ),
     SensorDescription(
         id="air_density",
@@ -184,9 +199,11 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         state_class=STATE_CLASS_MEASUREMENT,
         event=EVENT_OBSERVATION,
         attr="battery",
-        custom_fn=lambda cnv, device: None
-        if device.battery is None
-        else cnv.battery_level(device.battery.m, isinstance(device, TempestDevice)),
+        device_inputs=("battery",),
+        inputs=("is_tempest",),
+        custom_fn=lambda cnv, battery, is_tempest: None
+        if battery is None
+        else cnv.battery_level(battery, is_tempest),
     ),
     SensorDescription(
         id="battery_mode",
@@ -195,9 +212,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         event=EVENT_OBSERVATION,
         attr="battery",
         has_description=True,
-        custom_fn=lambda cnv, device: (None, None)
-        if None in (device.battery, device.solar_radiation)
-        else cnv.battery_mode(device.battery.m, device.solar_radiation.m),
+        device_inputs=("battery", "solar_radiation"),
+        custom_fn=lambda cnv, battery, solar_radiation: (None, None)
+        if None in (battery, solar_radiation)
+        else cnv.battery_mode(battery, solar_radiation),
     ),
     SensorDescription(
         id="beaufort",
@@ -206,9 +224,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="tailwind",
         event=EVENT_OBSERVATION,
         attr="wind_speed",
-        custom_fn=lambda cnv, device: (None, None)
-        if device.wind_speed is None
-        else cnv.beaufort(device.wind_speed.m),
+        device_inputs=("wind_speed",),
+        custom_fn=lambda cnv, wind_speed: (None, None)
+        if wind_speed is None
+        else cnv.beaufort(wind_speed),
         has_description=True,
     ),
     SensorDescription(
@@ -255,9 +274,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="text-box-outline",
         event=EVENT_OBSERVATION,
         attr="dew_point_temperature",
-        custom_fn=lambda cnv, device: None
-        if device.dew_point_temperature is None
-        else cnv.dewpoint_level(device.dew_point_temperature.m, True),
+        device_inputs=("dew_point_temperature",),
+        custom_fn=lambda cnv, dew_point: None
+        if dew_point is None
+        else cnv.dewpoint_level(dew_point, True),
     ),
     SensorDescription(
         id="feelslike",
@@ -269,12 +289,11 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         event=EVENT_OBSERVATION,
         attr="air_temperature",
         decimals=(1, 1),
-        custom_fn=lambda cnv, device, wind_speed: None
-        if wind_speed is None
-        or None in (device.air_temperature, device.relative_humidity)
-        else cnv.feels_like(
-            device.air_temperature.m, device.relative_humidity.m, wind_speed
-        ),
+        device_inputs=("air_temperature", "relative_humidity"),
+        inputs=("wind_speed",),
+        custom_fn=lambda cnv, temperature, humidity, wind_speed: None
+        if None in (temperature, humidity, wind_speed)
+        else cnv.feels_like(temperature, humidity, wind_speed),
     ),
     SensorDescription(
         id="freezing_level",
@@ -297,6 +316,8 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         state_class=STATE_CLASS_MEASUREMENT,
         event=EVENT_OBSERVATION,
         extra_att=True,
+        deadband=0.05,
+        relative_deadband=True,
     ),
     SensorDescription(
         id="lightning_strike_count",
@@ -304,21 +325,25 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="weather-lightning",
         event=EVENT_OBSERVATION,
     ),
-    SqlSensorDescription(
+    SensorDescription(
         id="lightning_strike_count_1hr",
         name="Lightning Count (Last hour)",
         icon="weather-lightning",
         event=EVENT_OBSERVATION,
         attr="lightning_strike_count",
-        sql_fn=lambda sql: sql.readLightningCount(1),
+        volatile=True,
+        inputs=("lightning_counter",),
+        custom_fn=lambda cnv, counter: counter.count(1 * 60 * 60),
     ),
-    SqlSensorDescription(
+    SensorDescription(
         id="lightning_strike_count_3hr",
         name="Lightning Count (3 hours)",
         icon="weather-lightning",
         event=EVENT_OBSERVATION,
         attr="lightning_strike_count",
-        sql_fn=lambda sql: sql.readLightningCount(3),
+        volatile=True,
+        inputs=("lightning_counter",),
+        custom_fn=lambda cnv, counter: counter.count(3 * 60 * 60),
     ),
     StorageSensorDescription(
         id="lightning_strike_count_today",
@@ -367,9 +392,42 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         name="Precipitation Type",
         icon="weather-rainy",
         event=EVENT_OBSERVATION,
-        custom_fn=lambda cnv, device: None
-        if device.precipitation_type is None
-        else cnv.rain_type(device.precipitation_type.value),
+        device_inputs=("precipitation_type",),
+        custom_fn=lambda cnv, precipitation_type: None
+        if precipitation_type is None
+        else cnv.rain_type(precipitation_type.value),
+    ),
+    SensorDescription(
+        id="pressure_change_1hr",
+        name="Pressure Change (Last hour)",
+        icon="gauge",
+        unit_m="hPa",
+        unit_i="inHg",
+        state_class=STATE_CLASS_MEASUREMENT,
+        event=EVENT_OBSERVATION,
+        attr="station_pressure",
+        decimals=(2, 3),
+        volatile=True,
+        inputs=("sealevel_pressure", "pressure_history"),
+        custom_fn=lambda cnv, pressure, history: None
+        if pressure is None
+        else history.change(pressure, 60 * 60),
+    ),
+    SensorDescription(
+        id="pressure_change_3hr",
+        name="Pressure Change (3 hours)",
+        icon="gauge",
+        unit_m="hPa",
+        unit_i="inHg",
+        state_class=STATE_CLASS_MEASUREMENT,
+        event=EVENT_OBSERVATION,
+        attr="station_pressure",
+        decimals=(2, 3),
+        volatile=True,
+        inputs=("sealevel_pressure", "pressure_history"),
+        custom_fn=lambda cnv, pressure, history: None
+        if pressure is None
+        else history.change(pressure, 3 * 60 * 60),
     ),
     SensorDescription(
         id="pressure_trend",
@@ -377,6 +435,13 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="trending-up",
         event=EVENT_OBSERVATION,
         attr="station_pressure",
+        has_description=True,
+        description_id="pressure_trend_value",
+        volatile=True,
+        inputs=("sealevel_pressure", "translations", "pressure_history"),
+        custom_fn=lambda cnv, pressure, translations, history: None
+        if pressure is None
+        else history.trend(pressure, translations),
     ),
     StorageSensorDescription(
         id="rain_duration_today",
@@ -407,9 +472,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="text-box-outline",
         event=EVENT_OBSERVATION,
         attr="rain_accumulation_previous_minute",
-        custom_fn=lambda cnv, device: None
-        if device.rain_rate is None
-        else cnv.rain_intensity(device.rain_rate.m),
+        device_inputs=("rain_rate",),
+        custom_fn=lambda cnv, rain_rate: None
+        if rain_rate is None
+        else cnv.rain_intensity(rain_rate),
     ),
     SensorDescription(
         id="rain_rate",
@@ -498,6 +564,8 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="solar-power",
         event=EVENT_OBSERVATION,
         extra_att=True,
+        deadband=0.05,
+        relative_deadband=True,
     ),
     SensorDescription(
         id="station_pressure",
@@ -515,9 +583,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="text-box-outline",
         event=EVENT_OBSERVATION,
         attr="air_temperature",
-        custom_fn=lambda cnv, device: None
-        if device.air_temperature is None
-        else cnv.temperature_level(device.air_temperature.m),
+        device_inputs=("air_temperature",),
+        custom_fn=lambda cnv, temperature: None
+        if temperature is None
+        else cnv.temperature_level(temperature),
     ),
     SensorDescription(
         id="uv",
@@ -535,7 +604,8 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="text-box-outline",
         event=EVENT_OBSERVATION,
         attr="uv",
-        custom_fn=lambda cnv, device: cnv.uv_level(device.uv),
+        device_inputs=("uv",),
+        custom_fn=lambda cnv, uv: cnv.uv_level(uv),
     ),
     SensorDescription(
         id="visibility",
@@ -547,11 +617,11 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="eye",
         event=EVENT_OBSERVATION,
         attr="air_temperature",
-        custom_fn=lambda cnv, device, elevation: None
-        if None in (device.air_temperature, device.relative_humidity)
-        else cnv.visibility(
-            elevation, device.air_temperature.m, device.relative_humidity.m
-        ),
+        device_inputs=("air_temperature", "relative_humidity"),
+        inputs=("elevation",),
+        custom_fn=lambda cnv, temperature, humidity, elevation: None
+        if None in (temperature, humidity)
+        else cnv.visibility(elevation, temperature, humidity),
     ),
     SensorDescription(
         id="wbgt",
@@ -563,15 +633,11 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         event=EVENT_OBSERVATION,
         attr="wet_bulb_temperature",
         decimals=(1, 1),
-        custom_fn=lambda cnv, device, solar_radiation: None
-        if None
-        in (device.air_temperature, device.relative_humidity, device.station_pressure)
-        else cnv.wbgt(
-            device.air_temperature.m,
-            device.relative_humidity.m,
-            device.station_pressure.m,
-            solar_radiation,
-        ),
+        device_inputs=("air_temperature", "relative_humidity", "station_pressure"),
+        inputs=("solar_radiation",),
+        custom_fn=lambda cnv, temperature, humidity, pressure, solar_radiation: None
+        if None in (temperature, humidity, pressure)
+        else cnv.wbgt(temperature, humidity, pressure, solar_radiation),
     ),
     SensorDescription(
         id="wetbulb",
@@ -616,9 +682,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="compass-outline",
         event=EVENT_OBSERVATION,
         attr="wind_direction",
-        custom_fn=lambda cnv, device: None
-        if device.wind_direction is None
-        else cnv.direction(device.wind_direction.m),
+        device_inputs=("wind_direction",),
+        custom_fn=lambda cnv, wind_direction: None
+        if wind_direction is None
+        else cnv.direction(wind_direction),
     ),
     SensorDescription(
         id="wind_gust",
@@ -677,9 +744,11 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="angle-acute",
         event=EVENT_OBSERVATION,
         attr="solar_radiation",
+        inputs=("latitude", "longitude"),
+        volatile=True,
         custom_fn=lambda cnv, latitude, longitude: None
         if None in (latitude, longitude)
-        else cnv.solar_elevation(latitude, longitude)
+        else cnv.solar_elevation(latitude, longitude),
     ),
     SensorDescription(
         id="solar_insolation",
@@ -690,9 +759,10 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="solar-power",
         event=EVENT_OBSERVATION,
         attr="solar_radiation",
-        custom_fn=lambda cnv, elevation, latitude, longitude: None
+        inputs=("elevation", "latitude", "longitude", "solar_elevation"),
+        custom_fn=lambda cnv, elevation, latitude, longitude, solar_elevation: None
         if None in (elevation, latitude, longitude)
-        else cnv.solar_insolation(elevation, latitude, longitude)
+        else cnv.solar_insolation(elevation, latitude, longitude, solar_elevation),
     ),
     SensorDescription(
         id="zambretti_number",
@@ -701,9 +771,19 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="vector-bezier",
         event=EVENT_OBSERVATION,
         attr="station_pressure",
+        inputs=(
+            "latitude",
+            "wind_bearing_avg",
+            "sealevel_pressure_all_high",
+            "sealevel_pressure_all_low",
+            "pressure_trend_value",
+            "sealevel_pressure",
+        ),
+        # The forecast depends on the season
+        volatile=True,
         custom_fn=lambda cnv, latitude, wind_direction_avg, p_hi, p_lo, pressure_trend, sealevel_pressure: None
         if None in (latitude, wind_direction_avg, p_hi, p_lo, pressure_trend, sealevel_pressure)
-        else cnv.zambretti_value(latitude, wind_direction_avg, p_hi, p_lo, pressure_trend, sealevel_pressure)
+        else cnv.zambretti_value(latitude, wind_direction_avg, p_hi, p_lo, pressure_trend, sealevel_pressure),
     ),
     SensorDescription(
         id="zambretti_text",
@@ -711,6 +791,7 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="vector-bezier",
         event=EVENT_OBSERVATION,
         attr="station_pressure",
+        inputs=("zambretti_number",),
         custom_fn=lambda cnv, zambretti_value: None
         if zambretti_value is None
         else cnv.zambretti_forecast(zambretti_value),
@@ -724,6 +805,13 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="weather-fog",
         event=EVENT_OBSERVATION,
         attr="relative_humidity",
+        inputs=(
+            "solar_elevation",
+            "wind_speed",
+            "relative_humidity",
+            "dewpoint",
+            "air_temperature",
+        ),
         custom_fn=lambda cnv, solar_elevation, wind_speed, humidity, dew_point, air_temperature: 0
         if None in (solar_elevation, wind_speed, humidity, dew_point, air_temperature)
         else cnv.fog_probability(solar_elevation, wind_speed, humidity, dew_point, air_temperature),
@@ -737,20 +825,36 @@ DEVICE_SENSORS: tuple[BaseSensorDescription, ...] = (
         icon="snowflake",
         event=EVENT_OBSERVATION,
         attr="relative_humidity",
-        custom_fn=lambda cnv, device, freezing_level, cloud_base, elevation: None
-        if None in (device.air_temperature, device.dew_point_temperature, device.wet_bulb_temperature, freezing_level, cloud_base)
-        else cnv.snow_probability(device.air_temperature.m, freezing_level, cloud_base, device.dew_point_temperature.m, device.wet_bulb_temperature.m, elevation)
+        device_inputs=(
+            "air_temperature",
+            "dew_point_temperature",
+            "wet_bulb_temperature",
+        ),
+        inputs=("freezing_level", "cloud_base", "elevation"),
+        custom_fn=lambda cnv, air_temperature, dew_point, wet_bulb, freezing_level, cloud_base, elevation: None
+        if None in (air_temperature, dew_point, wet_bulb, freezing_level, cloud_base)
+        else cnv.snow_probability(air_temperature, freezing_level, cloud_base, dew_point, wet_bulb, elevation),
     ),
-
     SensorDescription(
         id="current_conditions",
         name="Current Conditions",
         icon="weather-partly-snowy-rainy",
         event=EVENT_OBSERVATION,
         attr="rain_rate",
+        inputs=(
+            "lightning_strike_count_1hr",
+            "precipitation_type",
+            "rain_rate",
+            "wind_speed",
+            "solar_elevation",
+            "solar_radiation",
+            "solar_insolation",
+            "snow_probability",
+            "fog_probability",
+        ),
         custom_fn=lambda cnv, lightning_strike_count_1hr, precipitation_type, rain_rate, wind_speed, solar_elevation, solar_radiation, solar_insolation, snow_probability, fog_probability: "clear-night"
         if None in (lightning_strike_count_1hr, precipitation_type, rain_rate, wind_speed, solar_elevation, solar_radiation, solar_insolation, snow_probability, fog_probability)
-        else cnv.current_conditions(lightning_strike_count_1hr, precipitation_type, rain_rate, wind_speed, solar_elevation, solar_radiation, solar_insolation, snow_probability, fog_probability)
+        else cnv.current_conditions(lightning_strike_count_1hr, precipitation_type, rain_rate, wind_speed, solar_elevation, solar_radiation, solar_insolation, snow_probability, fog_probability),
     ),
 )
 
@@ -766,3 +870,4 @@ FORECAST_SENSORS: tuple[BaseSensorDescription, ...] = (
 )
 
 OBSOLETE_SENSORS = ["uptime"]
+
@@ -0,0 +1,340 @@
+"""Dependency graph evaluation of the sensors of a device."""
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Iterable, Mapping, OrderedDict
+
+from pint import Quantity
+from pyweatherflowudp.device import EVENT_OBSERVATION, WeatherFlowSensorDevice
+
+from .const import DEVICE_CLASS_TIMESTAMP
+from .helpers import ConversionFunctions
+from .sensor_description import (
+    BaseSensorDescription,
+    SensorDescription,
+    StorageSensorDescription,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+_UNSET = object()
+
+# Converters by (source units, target unit), shared by all graphs
+_CONVERTERS: dict[tuple[Any, str], Callable[[float], float]] = {}
+# Magnitudes used to check a converter against pint
+_CONVERTER_CHECKS = (-40.0, -0.01, 0.0, 0.1, 1.0, 22.37, 40.25, 100.0, 1013.25)
+
+
+def _pint_steps(
+    quantity: Quantity, unit: str
+) -> tuple[tuple[float, float] | None, float, tuple[float, float] | None]:
+    """Return the float operations pint uses for the conversion.
+
+    This is the scale and offset to the reference unit of an offset unit (like
+    °C), the factor between the multiplicative units, and the scale and offset
+    from the reference unit to the target offset unit.
+    """
+    registry = quantity._REGISTRY
+    src = quantity._units
+    dst = registry.parse_units(unit)._units
+    if src == dst:
+        return None, 1.0, None
+
+    to_reference = from_reference = None
+    if src_offset_unit := registry._validate_and_extract(src):
+        converter = registry._units[src_offset_unit].converter
+        to_reference = (converter.scale, converter.offset)
+        src = registry._add_ref_of_log_or_offset_unit(
+            src_offset_unit, src.remove([src_offset_unit])
+        )
+    if dst_offset_unit := registry._validate_and_extract(dst):
+        converter = registry._units[dst_offset_unit].converter
+        from_reference = (converter.scale, converter.offset)
+        dst = registry._add_ref_of_log_or_offset_unit(
+            dst_offset_unit, dst.remove([dst_offset_unit])
+        )
+    factor, _ = registry._get_root_units(src / dst)
+    return to_reference, factor, from_reference
+
+
+def unit_converter(quantity: Quantity, unit: str) -> Callable[[float], float]:
+    """Return a function converting magnitudes in the units of the quantity.
+
+    The conversion repeats the float operations of pint, without creating
+    Quantity objects, so the result is identical to `quantity.to(unit).m`.
+    Pint is used instead when the result can not be reproduced.
+    """
+    key = (quantity._units, unit)
+    if (converter := _CONVERTERS.get(key)) is not None:
+        return converter
+
+    def pint_converter(magnitude: float) -> float:
+        return type(quantity)(magnitude, quantity.units).to(unit).m
+
+    try:
+        to_reference, factor, from_reference = _pint_steps(quantity, unit)
+    except Exception as ex:
+        _LOGGER.debug("Using pint to convert %s to %s: %s", quantity.units, unit, ex)
+        converter = pint_converter
+    else:
+        if to_reference is None and from_reference is None:
+            converter = lambda magnitude: magnitude * factor
+        else:
+            to_scale, to_offset = to_reference or (1, 0)
+            from_scale, from_offset = from_reference or (1, 0)
+
+            def converter(magnitude: float) -> float:
+                if to_reference is not None:
+                    magnitude = magnitude * to_scale + to_offset
+                magnitude = magnitude * factor
+                if from_reference is not None:
+                    magnitude = (magnitude - from_offset) / from_scale
+                return magnitude
+
+        if any(
+            converter(value) != pint_converter(value) for value in _CONVERTER_CHECKS
+        ):
+            converter = pint_converter
+
+    _CONVERTERS[key] = converter
+    return converter
+
+
+def output_keys(sensor: BaseSensorDescription) -> tuple[str, ...]:
+    """Return the payload keys produced by a sensor."""
+    if (description_key := sensor.description_key) is not None:
+        return (sensor.id, description_key)
+    return (sensor.id,)
+
+
+def sort_sensors(
+    sensors: Iterable[BaseSensorDescription],
+) -> list[BaseSensorDescription]:
+    """Return the sensors ordered so that every sensor follows its inputs.
+
+    Inputs not produced by one of the sensors are resolved from the station, so
+    they do not take part in the ordering. Otherwise the given order is kept.
+    """
+    sensors = list(sensors)
+    producers = {key: sensor.id for sensor in sensors for key in output_keys(sensor)}
+    dependencies = {
+        sensor.id: {producers[name] for name in sensor.inputs if name in producers}
+        for sensor in sensors
+    }
+
+    ordered: list[BaseSensorDescription] = []
+    done: set[str] = set()
+    while len(ordered) < len(sensors):
+        if (
+            sensor := next(
+                (
+                    sensor
+                    for sensor in sensors
+                    if sensor.id not in done and dependencies[sensor.id] <= done
+                ),
+                None,
+            )
+        ) is None:
+            raise ValueError(
+                "Circular sensor inputs: "
+                + ", ".join(sensor.id for sensor in sensors if sensor.id not in done)
+            )
+        ordered.append(sensor)
+        done.add(sensor.id)
+    return ordered
+
+
+def required_sensors(
+    sensors: Iterable[BaseSensorDescription], enabled: Iterable[str]
+) -> set[str]:
+    """Return the ids of the enabled sensors and of all sensors they depend on."""
+    sensors = {sensor.id: sensor for sensor in sensors}
+    producers = {
+        key: sensor.id for sensor in sensors.values() for key in output_keys(sensor)
+    }
+    required = {sensor_id for sensor_id in enabled if sensor_id in sensors}
+    pending = list(required)
+    while pending:
+        for name in sensors[pending.pop()].inputs:
+            if (sensor_id := producers.get(name)) is not None and sensor_id not in required:
+                required.add(sensor_id)
+                pending.append(sensor_id)
+    return required
+
+
+class SensorGraph:
+    """Evaluate the sensors of a device in dependency order.
+
+    Every sensor is calculated once per observation. Derived sensors are only
+    recalculated when one of their inputs changed, and unit conversions only
+    run when the device value changed.
+    """
+
+    def __init__(
+        self,
+        sensors: Iterable[BaseSensorDescription],
+        device: WeatherFlowSensorDevice,
+        cnv: ConversionFunctions,
+        storage: dict[str, Any],
+        is_imperial: bool,
+        context: Mapping[str, Callable[[], Any]],
+        station_values: Mapping[str, Any],
+    ) -> None:
+        """Initialize the graph.
+
+        Inputs are resolved from the sensors of the graph first, then from the
+        `context` and finally from the last `station_values`, which allows a
+        device to use values reported by another device of the station.
+        """
+        self.device = device
+        self.cnv = cnv
+        self.storage = storage
+        self.is_imperial = is_imperial
+        self._context = context
+        self._station_values = station_values
+
+        self.sensors = sort_sensors(sensors)
+        self._produced = {key for sensor in self.sensors for key in output_keys(sensor)}
+        self._nodes = [(sensor, self._compile(sensor)) for sensor in self.sensors]
+
+    def evaluate(self) -> dict[str, OrderedDict]:
+        """Return the sensor values of the device, grouped by event."""
+        event_data: dict[str, OrderedDict] = {EVENT_OBSERVATION: OrderedDict()}
+        values: dict[str, Any] = {}
+
+        for sensor, compute in self._nodes:
+            if sensor.event not in event_data:
+                event_data[sensor.event] = OrderedDict()
+
+            try:
+                attr = compute(values)
+
+                # Check if a description is included
+                if (description_key := sensor.description_key) is not None:
+                    if isinstance(attr, tuple):
+                        attr, values[description_key] = attr
+                        event_data[sensor.event][description_key] = values[
+                            description_key
+                        ]
+                values[sensor.id] = attr
+
+                # Handle timestamp None value
+                if sensor.device_class == DEVICE_CLASS_TIMESTAMP and attr is None:
+                    continue
+
+                # Set the attribute in the payload
+                event_data[sensor.event][sensor.id] = attr
+                _LOGGER.debug("Setting payload: %s = %s", sensor.id, attr)
+            except Exception as ex:
+                _LOGGER.error("Error setting sensor data for %s: %s", sensor.id, ex)
+
+        return event_data
+
+    def _compile(self, sensor: BaseSensorDescription) -> Callable[[dict], Any]:
+        """Return a callable calculating the sensor value."""
+        inputs = [self._resolver(name) for name in sensor.inputs]
+
+        if isinstance(sensor, StorageSensorDescription):
+            if (cnv_fn := sensor.cnv_fn) is not None:
+                return lambda _: cnv_fn(self.cnv, sensor.value(self.storage))
+            return lambda _: sensor.value(self.storage)
+
+        assert isinstance(sensor, SensorDescription)
+        if (fn := sensor.custom_fn) is not None:
+            compute = self._compile_custom_fn(sensor, fn, inputs)
+        else:
+            compute = self._compile_attribute(sensor, inputs)
+
+        # Check if rounding is needed
+        if (decimals := sensor.decimals[1 if self.is_imperial else 0]) is None:
+            return compute
+
+        def compute_rounded(values: dict) -> Any:
+            attr = compute(values)
+            if attr is None or isinstance(attr, tuple):
+                return attr
+            return round(attr, decimals)
+
+        return compute_rounded
+
+    def _compile_attribute(
+        self, sensor: SensorDescription, inputs: list[Callable[[dict], Any]]
+    ) -> Callable[[dict], Any]:
+        """Return a callable reading and converting a device attribute."""
+        device = self.device
+        attr_name = sensor.device_attr
+        unit = sensor.imperial_unit if self.is_imperial else sensor.metric_unit
+
+        if callable(method := getattr(device, attr_name)):
+            names = sensor.inputs
+            get_attr = lambda values: method(
+                **{name: get(values) for name, get in zip(names, inputs)}
+            )
+        else:
+            get_attr = lambda _: getattr(device, attr_name)
+
+        last_magnitude = _UNSET
+        last_units = None
+        last_value = None
+        convert = None
+
+        def compute(values: dict) -> Any:
+            nonlocal last_magnitude, last_units, last_value, convert
+            attr = get_attr(values)
+            # Check if the attr is a Quantity object
+            if not isinstance(attr, Quantity):
+                return attr
+            if unit is None:
+                return attr.m
+            if (units := attr._units) != last_units:
+                convert = unit_converter(attr, unit)
+                last_units = units
+                last_magnitude = _UNSET
+            # Only convert when the value changed
+            if (magnitude := attr.m) != last_magnitude:
+                last_value = convert(magnitude)
+                last_magnitude = magnitude
+            return last_value
+
+        return compute
+
+    def _compile_custom_fn(
+        self,
+        sensor: SensorDescription,
+        fn: Callable[..., Any],
+        inputs: list[Callable[[dict], Any]],
+    ) -> Callable[[dict], Any]:
+        """Return a callable running the custom function when its inputs changed."""
+        getters = [self._device_getter(name) for name in sensor.device_inputs] + inputs
+        volatile = sensor.volatile
+
+        last_args: Any = _UNSET
+        last_value = None
+
+        def compute(values: dict) -> Any:
+            nonlocal last_args, last_value
+            args = tuple(get(values) for get in getters)
+            if volatile or args != last_args:
+                last_value = fn(self.cnv, *args)
+                last_args = args
+            return last_value
+
+        return compute
+
+    def _device_getter(self, attr_name: str) -> Callable[[dict], Any]:
+        """Return a callable returning the magnitude of a device attribute."""
+        device = self.device
+
+        def get(_: dict) -> Any:
+            attr = getattr(device, attr_name)
+            return attr.m if isinstance(attr, Quantity) else attr
+
+        return get
+
+    def _resolver(self, name: str) -> Callable[[dict], Any]:
+        """Return a callable resolving a named input."""
+        if name in self._produced:
+            return lambda values: values.get(name)
+        if (get := self._context.get(name)) is not None:
+            return lambda _: get()
+        return lambda _: self._station_values.get(name)
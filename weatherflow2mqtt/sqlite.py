@@ -4,58 +4,153 @@ import logging
 import os.path
 import sqlite3
 import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import timezone
 from sqlite3 import Error as SQLError
-from typing import OrderedDict
+from typing import Iterator, OrderedDict
 
+from .archive import day_start, rollup_rows
 from .const import (
-    COL_DEWPOINT,
-    COL_HUMIDITY,
-    COL_ILLUMINANCE,
-    COL_PRESSURE,
-    COL_RAINDURATION,
-    COL_RAINRATE,
-    COL_SOLARRAD,
-    COL_STRIKECOUNT,
-    COL_STRIKEENERGY,
-    COL_TEMPERATURE,
-    COL_UV,
-    COL_WINDGUST,
-    COL_WINDLULL,
-    COL_WINDSPEED,
+    ARCHIVE_RAW_DAYS,
+    DATABASE_FLUSH_INTERVAL,
+    DATABASE_FLUSH_SIZE,
+    DATABASE_PRUNE_BATCH_SIZE,
+    DATABASE_QUEUE_SIZE,
+    DATABASE_SYNCHRONOUS,
     DATABASE_VERSION,
+    HIGH_LOW_INITIAL,
+    INDEX_STORAGE_STATION,
+    INSERT_OBSERVATION,
+    LEGACY_STATION,
+    PRESSURE_HISTORY_MARGIN,
     PRESSURE_TREND_TIMER,
+    ROLLUP_RESOLUTIONS,
     STORAGE_FILE,
     STORAGE_ID,
     STRIKE_COUNT_TIMER,
+    TABLE_DISCOVERY,
     TABLE_HIGH_LOW,
     TABLE_LIGHTNING,
+    TABLE_OBSERVATIONS,
     TABLE_PRESSURE,
+    TABLE_PRUNED,
+    TABLE_ROLLUPS,
     TABLE_STORAGE,
-    UNITS_IMPERIAL,
-    UTC,
+    UPSERT_PRUNED,
+    UPSERT_ROLLUP,
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
 
-class SQLFunctions:
-    """Class to handle SQLLite functions."""
 
-    def __init__(self, unit_system, debug=False):
+@dataclass
+class DatabaseConfig:
+    """Dataclass to define the database write settings."""
+
+    flush_interval: int = DATABASE_FLUSH_INTERVAL
+    synchronous: str = DATABASE_SYNCHRONOUS
+    queue_size: int = DATABASE_QUEUE_SIZE
+    archive_days: int = ARCHIVE_RAW_DAYS
+
+
+class SQLFunctions:
+    """Class to handle SQLLite functions.
+
+    Writes are not committed right away. They are collected in one open
+    transaction, which is committed when `flush_interval` seconds have passed
+    or `flush_size` rows have been written, when the daily housekeeping runs
+    and on `close`.
+    """
+
+    def __init__(
+        self,
+        unit_system,
+        debug=False,
+        flush_interval=DATABASE_FLUSH_INTERVAL,
+        flush_size=DATABASE_FLUSH_SIZE,
+        synchronous=DATABASE_SYNCHRONOUS,
+        archive_days=ARCHIVE_RAW_DAYS,
+    ):
         """Initialize SQLFunctions."""
         self.connection = None
         self._unit_system = unit_system
         self._debug = debug
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._archive_days = archive_days
+        self._synchronous = synchronous.upper()
+        if self._synchronous not in SYNCHRONOUS_MODES:
+            _LOGGER.warning(
+                "Unknown database synchronous mode %s, using %s",
+                synchronous,
+                DATABASE_SYNCHRONOUS,
+            )
+            self._synchronous = DATABASE_SYNCHRONOUS
+        self._pending = 0
+        self._batch_depth = 0
+        self._last_flush = time.monotonic()
 
     def create_connection(self, db_file):
         """Create a database connection to a SQLite database."""
         try:
-            self.connection = sqlite3.connect(db_file)
+            # Used by the writer thread once it is started
+            self.connection = sqlite3.connect(db_file, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode = WAL;")
+            self.connection.execute(f"PRAGMA synchronous = {self._synchronous};")
 
         except SQLError as e:
             _LOGGER.error("Could not create SQL Database. Error: %s", e)
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group the writes done inside the block in the same transaction."""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush_if_due()
+
+    def flush(self):
+        """Commit all pending writes."""
+        self._last_flush = time.monotonic()
+        if not self.connection.in_transaction:
+            self._pending = 0
+            return
+        try:
+            self.connection.commit()
+            if self._debug:
+                _LOGGER.debug("Committed %s database writes", self._pending)
+            self._pending = 0
+        except SQLError as e:
+            _LOGGER.error("Could not commit data to the database. Error: %s", e)
+
+    def flush_if_due(self):
+        """Commit the pending writes if the interval or size limit is reached."""
+        if self._pending and (
+            self._pending >= self._flush_size
+            or time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            self.flush()
+
+    def close(self):
+        """Commit the pending writes and close the connection."""
+        if self.connection is None:
+            return
+        self.flush()
+        self.connection.close()
+        self.connection = None
+
+    def _write_done(self, rows=1):
+        """Register written rows, and commit if due outside of a batch."""
+        self._pending += rows
+        if not self._batch_depth:
+            self.flush_if_due()
+
     def create_table(self, create_table_sql):
         """Create table from the create_table_sql statement.
 
@@ -78,8 +173,8 @@ class SQLFunctions:
         """
         sql = """   INSERT INTO storage(id, rain_today, rain_yesterday, rain_start, rain_duration_today,
                     rain_duration_yesterday, lightning_count, lightning_count_today, last_lightning_time,
-                    last_lightning_distance, last_lightning_energy)
-                    VALUES(?, ?,?,?,?,?,?,?,?,?,?) """
+                    last_lightning_distance, last_lightning_energy, station)
+                    VALUES(?, ?,?,?,?,?,?,?,?,?,?,?) """
         try:
             cur = self.connection.cursor()
             cur.execute(sql, rowdata)
@@ -88,11 +183,41 @@ class SQLFunctions:
         except SQLError as e:
             _LOGGER.error("Could not Insert data in table storage. Error: %s", e)
 
-    def readStorage(self):
+    def createStation(self, station):
+        """Add the rows of a station, if it has none.
+
+        The first station added to a database written before it had one row per
+        station takes over the existing rows.
+        """
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT station FROM storage;")
+            stations = {row[0] for row in cursor.fetchall()}
+            if station in stations:
+                return
+
+            if stations == {LEGACY_STATION}:
+                _LOGGER.info("Assigning the stored data to station %s", station)
+                for table in ("storage", "pressure", "lightning", "high_low"):
+                    cursor.execute(
+                        f"UPDATE {table} SET station = ? WHERE station = ?;",
+                        (station, LEGACY_STATION),
+                    )
+                self.flush()
+                return
+
+            _LOGGER.info("Adding station %s to the database", station)
+            self.create_storage_row((None, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, station))
+            self.initializeHighLow(station)
+
+        except SQLError as e:
+            _LOGGER.error("Could not add station %s. Error: %s", station, e)
+
+    def readStorage(self, station=LEGACY_STATION):
         """Return data from the storage table as JSON."""
         try:
             cursor = self.connection.cursor()
-            cursor.execute(f"SELECT * FROM storage WHERE id = {STORAGE_ID};")
+            cursor.execute("SELECT * FROM storage WHERE station = ?;", (station,))
             data = cursor.fetchall()
 
             for row in data:
@@ -114,7 +239,7 @@ class SQLFunctions:
         except SQLError as e:
             _LOGGER.error("Could not access storage data. Error: %s", e)
 
-    def writeStorage(self, json_data: OrderedDict):
+    def writeStorage(self, json_data: OrderedDict, station=LEGACY_STATION):
         """Store data in the storage table from JSON."""
         try:
             cursor = self.connection.cursor()
@@ -129,7 +254,7 @@ class SQLFunctions:
                                     last_lightning_time=?,
                                     last_lightning_distance=?,
                                     last_lightning_energy=?
-                                WHERE ID = ?
+                                WHERE station = ?
                                 """
 
             rowdata = (
@@ -143,50 +268,28 @@ class SQLFunctions:
                 json_data["last_lightning_time"],
                 json_data["last_lightning_distance"],
                 json_data["last_lightning_energy"],
-                STORAGE_ID,
+                station,
             )
 
             cursor.execute(sql_statement, rowdata)
-            self.connection.commit()
+            self._write_done()
 
         except SQLError as e:
             _LOGGER.error("Could not update storage data. Error: %s", e)
 
-    def readPressureTrend(self, new_pressure, translations):
-        """Return Pressure Trend."""
-        if new_pressure is None:
-            return "Steady", 0
-
+    def readPressureHistory(self, since, station=LEGACY_STATION):
+        """Return the (timestamp, pressure) samples stored after `since`."""
         try:
-            time_point = time.time() - PRESSURE_TREND_TIMER
             cursor = self.connection.cursor()
             cursor.execute(
-                f"SELECT pressure FROM pressure WHERE timestamp < {time_point} ORDER BY timestamp DESC LIMIT 1;"
+                "SELECT timestamp, pressure FROM pressure WHERE station = ? AND timestamp >= ? ORDER BY timestamp;",
+                (station, since),
             )
-            old_pressure = cursor.fetchone()
-            if old_pressure is None:
-                old_pressure = new_pressure
-            else:
-                old_pressure = float(old_pressure[0])
-            pressure_delta = new_pressure - old_pressure
-
-            min_value = -1
-            max_value = 1
-            if self._unit_system == UNITS_IMPERIAL:
-                min_value = -0.0295
-                max_value = 0.0295
-
-            if pressure_delta > min_value and pressure_delta < max_value:
-                return translations["trend"]["steady"], 0
-            if pressure_delta <= min_value:
-                return translations["trend"]["falling"], round(pressure_delta, 2)
-            if pressure_delta >= max_value:
-                return translations["trend"]["rising"], round(pressure_delta, 2)
+            return [(row[0], float(row[1])) for row in cursor.fetchall()]
 
         except SQLError as e:
             _LOGGER.error("Could not read pressure data. Error: %s", e)
-        except Exception as e:
-            _LOGGER.error("Could not calculate pressure trend. Error message: %s", e)
+            return []
 
     def readPressureData(self):
         """Return formatted pressure data - USED FOR TESTING ONLY."""
@@ -202,44 +305,89 @@ class SQLFunctions:
         except SQLError as e:
             _LOGGER.error("Could not access storage data. Error: %s", e)
 
-    def writePressure(self, pressure):
-        """Add entry to the Pressure Table."""
+    def writePressureSamples(self, samples, station=LEGACY_STATION):
+        """Add (timestamp, pressure) entries to the Pressure Table."""
+        if not samples:
+            return True
         try:
             cur = self.connection.cursor()
-            cur.execute(
-                f"INSERT INTO pressure(timestamp, pressure) VALUES({time.time()}, {pressure});"
+            cur.executemany(
+                "INSERT OR REPLACE INTO pressure(station, timestamp, pressure) VALUES(?, ?, ?);",
+                ((station, timestamp, pressure) for timestamp, pressure in samples),
             )
-            self.connection.commit()
+            self._write_done(len(samples))
             return True
         except SQLError as e:
             _LOGGER.error("Could not Insert data in table Pressure. Error: %s", e)
             return False
-        except Exception as e:
-            _LOGGER.error("Could write to Pressure Table. Error message: %s", e)
+
+    def writeObservations(self, rows):
+        """Add rows of raw observation values to the Observations Table.
+
+        The rows are added to the rollups as well, so only the rows which are
+        not stored yet are written. Rows older than the pruned observations
+        of their device are in the rollups already, and are skipped.
+        """
+        if not rows:
+            return True
+        try:
+            cur = self.connection.cursor()
+            new_rows = {(row[0], row[1]): row for row in rows}
+            ranges = {}
+            for device, epoch in new_rows:
+                first, last = ranges.get(device, (epoch, epoch))
+                ranges[device] = (min(first, epoch), max(last, epoch))
+            for device, (first, last) in ranges.items():
+                cur.execute(
+                    "SELECT pruned_before FROM pruned WHERE device = ?;", (device,)
+                )
+                if (pruned := cur.fetchone()) is not None and first < pruned[0]:
+                    for key in [key for key in new_rows if key[0] == device]:
+                        if key[1] < pruned[0]:
+                            del new_rows[key]
+                cur.execute(
+                    """SELECT epoch FROM observations
+                        WHERE device = ? AND epoch BETWEEN ? AND ?;""",
+                    (device, first, last),
+                )
+                for (epoch,) in cur.fetchall():
+                    new_rows.pop((device, epoch), None)
+            if not new_rows:
+                return True
+
+            cur.executemany(INSERT_OBSERVATION, new_rows.values())
+            rollups = rollup_rows(new_rows.values())
+            cur.executemany(UPSERT_ROLLUP, rollups)
+            self._write_done(len(new_rows) + len(rollups))
+            return True
+        except SQLError as e:
+            _LOGGER.error("Could not Insert data in table Observations. Error: %s", e)
             return False
 
-    def readLightningCount(self, hours: int):
-        """Return number of Lightning Strikes in the last x hours."""
+    def readLightningHistory(self, since, station=LEGACY_STATION):
+        """Return the times of the Lightning Strikes stored after `since`."""
         try:
-            time_point = time.time() - hours * 60 * 60
             cursor = self.connection.cursor()
             cursor.execute(
-                f"SELECT COUNT(*) FROM lightning WHERE timestamp > {time_point};"
+                "SELECT timestamp FROM lightning WHERE station = ? AND timestamp > ? ORDER BY timestamp;",
+                (station, since),
             )
-            data = cursor.fetchone()[0]
-
-            return data
+            return [row[0] for row in cursor.fetchall()]
 
         except SQLError as e:
-            _LOGGER.error("Could not access storage data. Error: %s", e)
+            _LOGGER.error("Could not access lightning data. Error: %s", e)
+            return []
 
-    def writeLightning(self):
+    def writeLightning(self, station=LEGACY_STATION, timestamp=None):
         """Adds an entry to the Lightning Table."""
 
         try:
             cur = self.connection.cursor()
-            cur.execute(f"INSERT INTO lightning(timestamp) VALUES({time.time()});")
-            self.connection.commit()
+            cur.execute(
+                "INSERT INTO lightning(station, timestamp) VALUES(?, ?);",
+                (station, timestamp or time.time()),
+            )
+            self._write_done()
             return True
         except SQLError as e:
             _LOGGER.error("Could not Insert data in table Lightning. Error: %s", e)
@@ -248,6 +396,42 @@ class SQLFunctions:
             _LOGGER.error("Could write to Lightning Table. Error message: %s", e)
             return False
 
+    def readDiscoveryHashes(self):
+        """Return the hashes of the published discovery payloads by topic."""
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT topic, hash FROM discovery;")
+            return dict(cursor.fetchall())
+
+        except SQLError as e:
+            _LOGGER.error("Could not read the discovery hashes. Error: %s", e)
+            return {}
+
+    def writeDiscoveryHashes(self, hashes):
+        """Store the hashes of published discovery payloads by topic."""
+        if not hashes:
+            return
+        try:
+            cursor = self.connection.cursor()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO discovery(topic, hash) VALUES(?, ?);",
+                hashes.items(),
+            )
+            self._write_done(len(hashes))
+
+        except SQLError as e:
+            _LOGGER.error("Could not store the discovery hashes. Error: %s", e)
+
+    def clearDiscoveryHashes(self):
+        """Forget the published discovery payloads."""
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("DELETE FROM discovery;")
+            self._write_done()
+
+        except SQLError as e:
+            _LOGGER.error("Could not clear the discovery hashes. Error: %s", e)
+
     def writeDailyLog(self, sensor_data):
         """Add entry to the Daily Log Table."""
         try:
@@ -261,7 +445,7 @@ class SQLFunctions:
                 f"INSERT INTO daily_log(timestamp, temperature, pressure, windspeed) VALUES({time.time()}, ?, ?, ?)",
                 (temp, pres, wspeed),
             )
-            self.connection.commit()
+            self._write_done()
 
         except SQLError as e:
             _LOGGER.error("Could not Insert data in table daily_log. Error: %s", e)
@@ -312,134 +496,56 @@ class SQLFunctions:
                     solrad,
                 ),
             )
-            self.connection.commit()
+            self._write_done()
 
         except SQLError as e:
             _LOGGER.error("Could not Insert data in table day_data. Error: %s", e)
         except Exception as e:
             _LOGGER.error("Could not write to day_data Table. Error message: %s", e)
 
-    def updateHighLow(self, sensor_data):
-        """Update High and Low Values."""
+    def readHighLowTable(self, station=LEGACY_STATION):
+        """Return the rows of the high_low table of a station by sensor id."""
         try:
-            self.connection.row_factory = sqlite3.Row
+            # Only this cursor returns rows by name, the connection keeps tuples
             cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM high_low;")
-            table_data = cursor.fetchall()
-
-            data = dict(sensor_data)
-
-            for row in table_data:
-                max_sql = None
-                min_sql = None
-                sensor_value = None
-                do_update = False
-                # Get Value of Sensor if available
-                if data.get(row["sensorid"]) is not None:
-                    sensor_value = data[row["sensorid"]]
-
-                # If we have a value, check if min/max changes
-                if sensor_value is not None:
-                    if sensor_value > row["max_day"]:
-                        max_sql = (
-                            f" max_day = {sensor_value}, max_day_time = {time.time()} "
-                        )
-                        do_update = True
-                    if sensor_value < row["min_day"]:
-                        min_sql = (
-                            f" min_day = {sensor_value}, min_day_time = {time.time()} "
-                        )
-                        do_update = True
-
-                # If min/max changes, update the record
-                sql = "UPDATE high_low SET"
-                if do_update:
-                    if max_sql:
-                        sql = f"{sql} {max_sql}"
-                    if max_sql and min_sql:
-                        sql = f"{sql},"
-                    if min_sql:
-                        sql = f"{sql} {min_sql}"
-                    sql = f"{sql}, latest = {sensor_value} WHERE sensorid = '{row['sensorid']}'"
-                    if self._debug:
-                        _LOGGER.debug("Min/Max SQL: %s", sql)
-                    cursor.execute(sql)
-                    self.connection.commit()
-                else:
-                    if sensor_value is not None:
-                        sql = f"{sql} latest = {sensor_value} WHERE sensorid = '{row['sensorid']}'"
-                        if self._debug:
-                            _LOGGER.debug("Latest SQL: %s", sql)
-                        cursor.execute(sql)
-                        self.connection.commit()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                "SELECT * FROM high_low WHERE station = ? ORDER BY rowid", (station,)
+            )
+            data = cursor.fetchall()
+
+            records = {}
+            for row in data:
+                record = dict(row)
+                del record["station"]
+                records[record.pop("sensorid")] = record
+            return records
 
         except SQLError as e:
-            _LOGGER.error("Could not update High and Low data. Error: %s", e)
-            return False
-        except Exception as e:
-            _LOGGER.error("Could not write to High and Low Table. Error message: %s", e)
-            return False
+            _LOGGER.error("Could not access high_low data. Error: %s", e)
+            return {}
 
-    def readHighLow(self):
-        """Return data from the high_low table as JSON."""
+    def writeHighLow(self, records, station=LEGACY_STATION):
+        """Store the high and low values of all sensors of a station."""
+        if not records:
+            return
         try:
-            self.connection.row_factory = sqlite3.Row
+            columns = list(next(iter(records.values())))
+            sql = "UPDATE high_low SET {} WHERE station = ? AND sensorid = ?".format(
+                ", ".join(f"{column} = ?" for column in columns)
+            )
             cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM high_low")
-            data = cursor.fetchall()
-
-            sensor_json = {}
-            for row in data:
-                sensor_json[row["sensorid"]] = {
-                    "max_day": row["max_day"],
-                    "max_day_time": None
-                    if not row["max_day_time"]
-                    else datetime.datetime.utcfromtimestamp(round(row["max_day_time"]))
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                    "max_month": row["max_month"],
-                    "max_month_time": None
-                    if not row["max_month_time"]
-                    else datetime.datetime.utcfromtimestamp(
-                        round(row["max_month_time"])
-                    )
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                    "max_all": row["max_all"],
-                    "max_all_time": None
-                    if not row["max_all_time"]
-                    else datetime.datetime.utcfromtimestamp(round(row["max_all_time"]))
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                    "min_day": row["min_day"],
-                    "min_day_time": None
-                    if not row["min_day_time"]
-                    else datetime.datetime.utcfromtimestamp(round(row["min_day_time"]))
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                    "min_month": row["min_month"],
-                    "min_month_time": None
-                    if not row["min_month_time"]
-                    else datetime.datetime.utcfromtimestamp(
-                        round(row["min_month_time"])
-                    )
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                    "min_all": row["min_all"],
-                    "min_all_time": None
-                    if not row["min_all_time"]
-                    else datetime.datetime.utcfromtimestamp(round(row["min_all_time"]))
-                    .replace(tzinfo=UTC)
-                    .isoformat(),
-                }
-            return sensor_json
+            cursor.executemany(
+                sql,
+                (
+                    [record[column] for column in columns] + [station, sensor_id]
+                    for sensor_id, record in records.items()
+                ),
+            )
+            self._write_done(len(records))
 
         except SQLError as e:
-            _LOGGER.error("Could not access high_low data. Error: %s", e)
-            return None
-        except Exception as e:
-            _LOGGER.error("Could not get all High Low values. Error message: %s", e)
-            return sensor_json
+            _LOGGER.error("Could not update High and Low data. Error: %s", e)
 
     def migrateStorageFile(self):
         """Migrate old .storage.json file to the database."""
@@ -479,12 +585,17 @@ class SQLFunctions:
             with self.connection:
                 # Create Empty Tables
                 self.create_table(TABLE_STORAGE)
+                self.create_table(INDEX_STORAGE_STATION)
                 self.create_table(TABLE_LIGHTNING)
                 self.create_table(TABLE_PRESSURE)
                 self.create_table(TABLE_HIGH_LOW)
+                self.create_table(TABLE_DISCOVERY)
+                self.create_table(TABLE_OBSERVATIONS)
+                self.create_table(TABLE_ROLLUPS)
+                self.create_table(TABLE_PRUNED)
 
                 # Store Initial Data
-                storage = (STORAGE_ID, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+                storage = (STORAGE_ID, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, LEGACY_STATION)
                 self.create_storage_row(storage)
                 self.initializeHighLow()
 
@@ -514,26 +625,76 @@ class SQLFunctions:
                 # Add Initial data to High Low
                 self.initializeHighLow()
 
-            if db_version < DATABASE_VERSION:
+            if db_version < 2:
                 _LOGGER.info("Upgrading the database to version 2")
                 cursor.execute("ALTER TABLE high_low ADD max_yday REAL")
                 cursor.execute("ALTER TABLE high_low ADD max_yday_time REAL")
                 cursor.execute("ALTER TABLE high_low ADD min_yday REAL")
                 cursor.execute("ALTER TABLE high_low ADD min_yday_time REAL")
 
-                self.connection.commit()
+            if db_version < 3:
+                _LOGGER.info("Upgrading the database to version 3")
+                self.create_table(TABLE_DISCOVERY)
 
-                # if db_version < 2:
-                #     _LOGGER.info("Upgrading the database to version 2")
-                #     cursor.execute("ALTER TABLE high_low ADD max_yday REAL")
-                #     cursor.execute("ALTER TABLE high_low ADD max_yday_time REAL")
-                #     cursor.execute("ALTER TABLE high_low ADD min_yday REAL")
-                #     cursor.execute("ALTER TABLE high_low ADD min_yday_time REAL")
+            if db_version < 4:
+                _LOGGER.info("Upgrading the database to version 4")
+                cursor.execute(
+                    "ALTER TABLE storage ADD station TEXT NOT NULL DEFAULT '';"
+                )
+                self.create_table(INDEX_STORAGE_STATION)
+                # The primary keys change, so the other tables are copied
+                for table, create_table_sql in (
+                    ("pressure", TABLE_PRESSURE),
+                    ("lightning", TABLE_LIGHTNING),
+                    ("high_low", TABLE_HIGH_LOW),
+                ):
+                    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_old;")
+                    cursor.execute(f"PRAGMA table_info({table}_old);")
+                    columns = ", ".join(row[1] for row in cursor.fetchall())
+                    self.create_table(create_table_sql)
+                    cursor.execute(
+                        f"INSERT INTO {table}({columns}) SELECT {columns} FROM {table}_old;"
+                    )
+                    cursor.execute(f"DROP TABLE {table}_old;")
+
+            if db_version < 5:
+                _LOGGER.info("Upgrading the database to version 5")
+                self.create_table(TABLE_OBSERVATIONS)
+
+            if db_version < 6:
+                _LOGGER.info("Upgrading the database to version 6")
+                self.create_table(TABLE_ROLLUPS)
+                # Add the observations archived before there were rollups
+                cursor.execute("SELECT * FROM observations;")
+                while rows := cursor.fetchmany(DATABASE_PRUNE_BATCH_SIZE):
+                    self.connection.executemany(UPSERT_ROLLUP, rollup_rows(rows))
+
+            if db_version < 7:
+                _LOGGER.info("Upgrading the database to version 7")
+                self.create_table(TABLE_PRUNED)
+                # Rows were pruned if the rollups start before the oldest one kept
+                resolution = ROLLUP_RESOLUTIONS[0]
+                cursor.execute(
+                    """SELECT device, min(bucket), max(bucket) FROM rollups
+                        WHERE resolution = ? GROUP BY device;""",
+                    (resolution,),
+                )
+                for device, first_bucket, last_bucket in cursor.fetchall():
+                    cursor.execute(
+                        "SELECT min(epoch) FROM observations WHERE device = ?;",
+                        (device,),
+                    )
+                    oldest = cursor.fetchone()[0]
+                    if oldest is None:
+                        oldest = last_bucket + resolution
+                    if first_bucket + resolution <= oldest:
+                        cursor.execute(
+                            "INSERT INTO pruned(device, pruned_before) VALUES(?, ?);",
+                            (device, oldest),
+                        )
 
-                # if db_version < DATABASE_VERSION:
-                #     _LOGGER.info("Upgrading the database to version %s...", DATABASE_VERSION)
-                #     self.create_table(TABLE_DAY_DATA)
-                #     self.connection.commit()
+            if db_version < DATABASE_VERSION:
+                self.connection.commit()
 
                 # Finally update the version number
                 cursor.execute(f"PRAGMA main.user_version = {DATABASE_VERSION};")
@@ -542,51 +703,16 @@ class SQLFunctions:
         except Exception as e:
             _LOGGER.error("An undefined error occured. Error message: %s", e)
 
-    def initializeHighLow(self):
+    def initializeHighLow(self, station=LEGACY_STATION):
         """Write Initial Data to the High Low Tabble."""
         try:
             cursor = self.connection.cursor()
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_DEWPOINT}', -9999, 9999);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_HUMIDITY}', -9999, 9999);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_ILLUMINANCE}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_PRESSURE}', -9999, 9999);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_RAINDURATION}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_RAINRATE}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_SOLARRAD}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_STRIKECOUNT}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_STRIKEENERGY}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_TEMPERATURE}', -9999, 9999);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_UV}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_WINDGUST}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_WINDLULL}', 0, 0);"
-            )
-            cursor.execute(
-                f"INSERT INTO high_low(sensorid, max_day, min_day) VALUES('{COL_WINDSPEED}', 0, 0);"
+            cursor.executemany(
+                "INSERT INTO high_low(station, sensorid, max_day, min_day) VALUES(?, ?, ?, ?);",
+                (
+                    (station, sensor_id, max_day, min_day)
+                    for sensor_id, (max_day, min_day) in HIGH_LOW_INITIAL.items()
+                ),
             )
             self.connection.commit()
 
@@ -595,89 +721,62 @@ class SQLFunctions:
         except Exception as e:
             _LOGGER.error("Could write to high_low Table. Error message: %s", e)
 
-    def dailyHousekeeping(self):
-        """Clean up old data, daily."""
+    def markPruned(self):
+        """Return the epoch the archived observations are pruned before.
+
+        The archived observations are kept for `archive_days` whole days, 0
+        keeps them all and returns None. The epoch is recorded for the devices
+        with older rows, before `pruneHistory` removes them, so they are not
+        rolled up again if they are written once more.
+        """
+        if not self._archive_days:
+            return None
+        before = day_start(time.time() - self._archive_days * 24 * 60 * 60)
         try:
-            # Cleanup the Pressure Table
-            pres_time_point = time.time() - PRESSURE_TREND_TIMER - 60
             cursor = self.connection.cursor()
-            cursor.execute(f"DELETE FROM pressure WHERE timestamp < {pres_time_point};")
-
-            # Cleanup the Lightning Table
-            strike_time_point = time.time() - STRIKE_COUNT_TIMER - 60
-            cursor.execute(
-                f"DELETE FROM lightning WHERE timestamp < {strike_time_point};"
-            )
-
-            # Update All Time Values values
-            cursor.execute(
-                f"UPDATE high_low SET max_all = max_day, max_all_time = max_day_time WHERE max_day > max_all or max_all IS NULL"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET min_all = min_day, min_all_time = min_day_time WHERE (min_day < min_all or min_all IS NULL) and min_day_time IS NOT NULL"
-            )
-
-            # Update or Reset Year Values
-            cursor.execute(
-                f"UPDATE high_low SET max_year = max_day, max_year_time = max_day_time WHERE (max_day > max_year or max_year IS NULL) AND strftime('%Y', 'now') = strftime('%Y', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET min_year = min_day, min_year_time = min_day_time WHERE ((min_day < min_year or min_year IS NULL) AND min_day_time IS NOT NULL) AND strftime('%Y', 'now') = strftime('%Y', datetime(min_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_year = latest, max_year_time = {time.time()}, min_year = latest, min_year_time = {time.time()} WHERE min_day <> 0 AND strftime('%Y', 'now') <> strftime('%Y', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_year = 0, max_year_time = {time.time()} WHERE min_day = 0 AND strftime('%Y', 'now') <> strftime('%Y', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-
-            # Update or Reset Month Values
-            cursor.execute(
-                f"UPDATE high_low SET max_month = max_day, max_month_time = max_day_time WHERE (max_day > max_month or max_month IS NULL) AND strftime('%m', 'now') = strftime('%m', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET min_month = min_day, min_month_time = min_day_time WHERE ((min_day < min_month or min_month IS NULL) AND min_day_time IS NOT NULL) AND strftime('%m', 'now') = strftime('%m', datetime(min_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_month = latest, max_month_time = {time.time()}, min_month = latest, min_month_time = {time.time()} WHERE min_day <> 0 AND strftime('%m', 'now') <> strftime('%m', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_month = 0, max_month_time = {time.time()} WHERE min_day = 0 AND strftime('%m', 'now') <> strftime('%m', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-
-            # Update or Reset Week Values
-            cursor.execute(
-                f"UPDATE high_low SET max_week = max_day, max_week_time = max_day_time WHERE (max_day > max_week or max_week IS NULL) AND strftime('%W', 'now') = strftime('%W', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET min_week = min_day, min_week_time = min_day_time WHERE ((min_day < min_week or min_week IS NULL) AND min_day_time IS NOT NULL) AND strftime('%W', 'now') = strftime('%W', datetime(min_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_week = latest, max_week_time = {time.time()}, min_week = latest, min_week_time = {time.time()} WHERE min_day <> 0 AND strftime('%W', 'now') <> strftime('%W', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_week = 0, max_week_time = {time.time()} WHERE min_day = 0 AND strftime('%W', 'now') <> strftime('%W', datetime(max_day_time, 'unixepoch', 'localtime'))"
-            )
+            cursor.execute(UPSERT_PRUNED, (before, before))
+            self._write_done(cursor.rowcount)
+        except SQLError as e:
+            _LOGGER.error("Could not record the pruned history. Error: %s", e)
+            return None
+        return before
 
-            # Update Yesterday Values
-            cursor.execute(
-                f"UPDATE high_low SET max_yday = max_day, max_yday_time = max_day_time, min_yday = min_day, min_yday_time = min_day_time"
-            )
+    def pruneHistory(self, archive_before=None, batch_size=DATABASE_PRUNE_BATCH_SIZE):
+        """Delete a batch of the old samples, and return the number deleted.
 
-            # Reset Day High and Low values
-            cursor.execute(
-                f"UPDATE high_low SET max_day = latest, max_day_time = {time.time()}, min_day = latest, min_day_time = {time.time()} WHERE min_day <> 0"
-            )
-            cursor.execute(
-                f"UPDATE high_low SET max_day = 0, max_day_time = {time.time()} WHERE min_day = 0"
-            )
-            self.connection.commit()
-
-            return True
+        Called repeatedly until it returns 0, so the old rows are removed in
+        small steps instead of one long delete. The archived observations
+        before `archive_before`, returned by `markPruned`, are removed too.
+        They are in the rollups from the start.
+        """
+        deleted = 0
+        try:
+            cursor = self.connection.cursor()
+            now = time.time()
+            for table, before in (
+                ("pressure", now - PRESSURE_TREND_TIMER - PRESSURE_HISTORY_MARGIN),
+                ("lightning", now - STRIKE_COUNT_TIMER - 60),
+            ):
+                cursor.execute(
+                    f"""DELETE FROM {table} WHERE rowid IN
+                        (SELECT rowid FROM {table} WHERE timestamp < ? LIMIT ?);""",
+                    (before, batch_size - deleted),
+                )
+                deleted += cursor.rowcount
+                if deleted >= batch_size:
+                    break
+            else:
+                if archive_before is not None:
+                    cursor.execute(
+                        """DELETE FROM observations WHERE (device, epoch) IN
+                            (SELECT device, epoch FROM observations
+                            WHERE epoch < ? LIMIT ?);""",
+                        (archive_before, batch_size - deleted),
+                    )
+                    deleted += cursor.rowcount
+            self._write_done(deleted)
 
         except SQLError as e:
-            _LOGGER.error("Could not perform daily housekeeping. Error: %s", e)
-            return False
-        except Exception as e:
-            _LOGGER.error("Could not perform daily housekeeping. Error message: %s", e)
-            return False
+            _LOGGER.error("Could not remove the old history. Error: %s", e)
+            return 0
+        return deleted
@@ -0,0 +1,95 @@
+"""Select the sensor states to publish."""
+from __future__ import annotations
+
+from typing import Any
+
+from .const import DEADBAND_MAX_AGE, FULL_STATE_INTERVAL
+from .sensor_description import BaseSensorDescription
+
+# Margin for float errors when comparing a change with the deadband
+DEADBAND_MARGIN = 1e-9
+
+
+class StateFilter:
+    """Remember the last published state of every topic.
+
+    A state is published when it differs from the last published one, unless
+    its minimum interval did not pass yet. A change within the deadband of the
+    sensor is held until the minimum interval passed, or DEADBAND_MAX_AGE
+    seconds without one, so a slow drift is published eventually. When only
+    publishing changes, the states of all sensors of a device are published
+    every `full_state_interval` seconds, so subscribers that missed a change
+    catch up.
+    """
+
+    def __init__(self, full_state_interval: float = FULL_STATE_INTERVAL * 60) -> None:
+        """Initialize the filter."""
+        self.full_state_interval = full_state_interval
+        self._published: dict[str, tuple[Any, Any, float]] = {}
+        self._next_full_state: dict[str, float] = {}
+
+    def full_state_due(self, device_serial: str, now: float) -> bool:
+        """Return `True` if all states of the device must be published now."""
+        if now < self._next_full_state.get(device_serial, 0):
+            return False
+        self._next_full_state[device_serial] = now + self.full_state_interval
+        return True
+
+    def request_full_state(self) -> None:
+        """Publish all states of every device with the next observation."""
+        self._next_full_state.clear()
+
+    def due(self, topic: str, now: float, min_interval: float) -> bool:
+        """Return `True` if the minimum interval of the topic passed."""
+        return (
+            published := self._published.get(topic)
+        ) is None or now - published[2] >= min_interval
+
+    def last_state(self, topic: str) -> Any:
+        """Return the last published state of the topic."""
+        if (published := self._published.get(topic)) is None:
+            return None
+        return published[0]
+
+    def publish(
+        self,
+        topic: str,
+        state: Any,
+        now: float,
+        value: Any = None,
+        sensor: BaseSensorDescription | None = None,
+        force: bool = False,
+    ) -> bool:
+        """Return `True` if the state must be published, and remember it if so.
+
+        `value` is compared with the deadband of the `sensor`, `state` is the
+        complete payload of the topic.
+        """
+        if not force and (published := self._published.get(topic)) is not None:
+            last_state, last_value, last_time = published
+            if state == last_state:
+                return False
+            if sensor is not None:
+                age = now - last_time
+                if age < sensor.min_interval:
+                    return False
+                if age < (
+                    sensor.min_interval or DEADBAND_MAX_AGE
+                ) and self._within_deadband(sensor, value, last_value):
+                    return False
+        self._published[topic] = (state, value, now)
+        return True
+
+    @staticmethod
+    def _within_deadband(
+        sensor: BaseSensorDescription, value: Any, last_value: Any
+    ) -> bool:
+        """Return `True` if the change of a numeric value is within the deadband."""
+        if not sensor.deadband or not isinstance(value, (int, float)):
+            return False
+        if not isinstance(last_value, (int, float)) or isinstance(value, bool):
+            return False
+        deadband = sensor.deadband
+        if sensor.relative_deadband:
+            deadband *= abs(last_value)
+        return abs(value - last_value) + DEADBAND_MARGIN < deadband
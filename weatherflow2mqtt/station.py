@@ -0,0 +1,131 @@
+"""Derived state of a weather station."""
+from __future__ import annotations
+
+import time
+from typing import Any, Iterable
+
+from .const import PRESSURE_HISTORY_MARGIN, PRESSURE_TREND_TIMER, STRIKE_COUNT_TIMER
+from .high_low import HighLowTracker
+from .history import LightningCounter, PressureHistory
+from .persistence import Persistence
+
+
+class Station:
+    """The state derived from the observations of the devices of one hub.
+
+    Every station has its own storage row, pressure history, lightning strikes
+    and high and low values in the database, so several hubs can share one
+    database without mixing up their rain totals or trends.
+
+    The rows are read once, by `load`, and the writes are queued for the
+    database writer with a copy of the state. The state is only marked as
+    stored once its write is queued.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        db: Persistence,
+        unit_system: str,
+        storage: dict[str, Any],
+        high_low: dict[str, dict[str, Any]],
+        pressure_samples: Iterable[tuple[float, float]],
+        strikes: Iterable[float],
+        archive_pressure: bool = True,
+    ) -> None:
+        """Initialize the station from the state read from the database."""
+        self.key = key
+        self.db = db
+
+        self.storage = storage
+        self.high_low = HighLowTracker(high_low)
+        self.pressure_history = PressureHistory(unit_system, archive=archive_pressure)
+        self.pressure_history.seed(pressure_samples)
+        self.lightning_counter = LightningCounter()
+        self.lightning_counter.seed(strikes)
+
+        # Last values of all devices, so a device can use the values of another
+        self.values: dict[str, Any] = {}
+        # Latest rapid wind speed, used by the derived sensors
+        self.wind_speed = None
+
+        self.high_low_last_run = 1621229580.583215  # A time in the past
+
+    @classmethod
+    async def load(
+        cls,
+        key: str,
+        db: Persistence,
+        unit_system: str,
+        archive_pressure: bool = True,
+    ) -> Station:
+        """Create the rows of a new station, and return the station."""
+        sql = db.sql
+        db.write(sql.createStation, key)
+        now = time.time()
+        return cls(
+            key,
+            db,
+            unit_system,
+            storage=await db.read(sql.readStorage, key),
+            high_low=await db.read(sql.readHighLowTable, key),
+            pressure_samples=await db.read(
+                sql.readPressureHistory,
+                now - PRESSURE_TREND_TIMER - PRESSURE_HISTORY_MARGIN,
+                key,
+            ),
+            strikes=await db.read(
+                sql.readLightningHistory, now - STRIKE_COUNT_TIMER, key
+            ),
+            archive_pressure=archive_pressure,
+        )
+
+    def add_rain(self, minutes: int, amount: float) -> None:
+        """Add the rain of the last minutes to the daily totals."""
+        self.storage["rain_today"] += amount
+        self.storage["rain_duration_today"] += minutes
+        self.write_storage()
+
+    def new_day(self) -> None:
+        """Start the daily totals and the high and low values over."""
+        self.storage["rain_yesterday"] = self.storage["rain_today"]
+        self.storage["rain_duration_yesterday"] = self.storage["rain_duration_today"]
+        self.storage["rain_today"] = 0
+        self.storage["rain_duration_today"] = 0
+        self.storage["lightning_count_today"] = 0
+        self.write_storage()
+        self.high_low.roll_over()
+        self.write_high_low()
+
+    def add_strike(self, timestamp: float) -> None:
+        """Add a lightning strike."""
+        self.lightning_counter.add(timestamp)
+        self.db.write(self.db.sql.writeLightning, self.key, timestamp)
+
+    def write_storage(self) -> None:
+        """Store the daily totals and the last lightning strike."""
+        self.db.write(
+            self.db.sql.writeStorage,
+            dict(self.storage),
+            self.key,
+            key=("storage", self.key),
+        )
+
+    def write_history(self) -> None:
+        """Archive the new pressure samples."""
+        if (samples := self.pressure_history.unsaved()) and self.db.write(
+            self.db.sql.writePressureSamples, samples, self.key
+        ):
+            self.pressure_history.saved()
+
+    def write_high_low(self) -> None:
+        """Store the high and low values, if they changed."""
+        if self.high_low.changed:
+            records = {
+                sensor_id: dict(record)
+                for sensor_id, record in self.high_low.records.items()
+            }
+            if self.db.write(
+                self.db.sql.writeHighLow, records, self.key, key=("high_low", self.key)
+            ):
+                self.high_low.changed = False
@@ -5,18 +5,28 @@ from a WeatherFlow Weather Station and publishing sensor data to MQTT.
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import inspect
 import json
 import logging
 import os
+import signal
 import sys
-from dataclasses import dataclass
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from functools import partial
 from datetime import datetime
-from math import ceil
+from math import ceil, isfinite
 from typing import Any, Callable, OrderedDict
 
 from paho.mqtt.client import Client as MqttClient
-from pint import Quantity
-from pyweatherflowudp.client import EVENT_DEVICE_DISCOVERED, WeatherFlowListener
+from paho.mqtt.client import MQTTMessage
+from pyweatherflowudp.client import (
+    DATA_SERIAL_NUMBER,
+    EVENT_DEVICE_DISCOVERED,
+    WeatherFlowListener,
+)
 from pyweatherflowudp.const import UNIT_METERS
 from pyweatherflowudp.device import (
     EVENT_LOAD_COMPLETE,
@@ -40,18 +50,34 @@ from pyweatherflowudp.event import (
 )
 
 from .__version__ import VERSION
+from .archive import ObservationArchive
 from .const import (
+    ARCHIVE_RAW_DAYS,
+    ARCHIVE_WRITE_INTERVAL,
     ATTR_ATTRIBUTION,
     ATTRIBUTION,
     DATABASE,
-    DEVICE_CLASS_TIMESTAMP,
+    DATABASE_FLUSH_INTERVAL,
+    DATABASE_QUEUE_SIZE,
+    DATABASE_SYNCHRONOUS,
     DOMAIN,
     EVENT_HIGH_LOW,
     EXTERNAL_DIRECTORY,
+    FORECAST_CACHE_FILE,
     FORECAST_ENTITY,
+    FULL_STATE_INTERVAL,
+    HA_STATUS_TOPIC,
     HIGH_LOW_TIMER,
+    HISTORY_API_PORT,
+    HISTORY_WRITE_INTERVAL,
     LANGUAGE_ENGLISH,
+    METRICS_PORT,
+    PROFILE_COMMAND_TOPIC,
+    PROFILE_DUMP_INTERVAL,
+    PROFILE_FILES,
+    PROFILE_WINDOW,
     MANUFACTURER,
+    MQTT_MAX_INFLIGHT,
     TEMP_CELSIUS,
     UNITS_IMPERIAL,
     UNITS_METRIC,
@@ -59,24 +85,53 @@ from .const import (
     ZAMBRETTI_MIN_PRESSURE,
 )
 from .forecast import Forecast, ForecastConfig
-from .helpers import ConversionFunctions, read_config, truebool
+from .history_api import HistoryApi, HistoryApiConfig
+from .helpers import (
+    ConversionFunctions,
+    read_config,
+    read_publish_limits,
+    truebool,
+)
+from .metrics import Metrics, MetricsConfig
+from .profiler import ProfilerConfig, SamplingProfiler
+from .mqtt_publisher import MqttPublisher
+from .persistence import Persistence
 from .sensor_description import (
     DEVICE_SENSORS,
     FORECAST_SENSORS,
     HUB_SENSORS,
     OBSOLETE_SENSORS,
     BaseSensorDescription,
-    SensorDescription,
-    SqlSensorDescription,
-    StorageSensorDescription,
 )
-from .sqlite import SQLFunctions
+from .sensor_graph import SensorGraph, output_keys, required_sensors
+from .sqlite import DatabaseConfig, SQLFunctions
+from .state_filter import StateFilter
+from .station import Station
 
 _LOGGER = logging.getLogger(__name__)
 
 MQTT_TOPIC_FORMAT = "homeassistant/sensor/{}/{}/{}"
 DEVICE_SERIAL_FORMAT = f"{DOMAIN}_{{}}"
 
+# Event handlers timed and counted by device in the metrics
+HANDLER_EVENTS = {
+    "_handle_observation_event": "observation",
+    "_handle_rain_start_event": "rain_start",
+    "_handle_status_update_event": "status",
+    "_handle_strike_event": "strike",
+    "_handle_wind_event": "rapid_wind",
+}
+# Steps of the handlers timed as a stage in the metrics
+METRIC_STAGES = {
+    "_publish_changed_states": "publish",
+    "_hold_limited_states": "publish",
+    "_encode_state": "json",
+    "_add_to_queue": "enqueue",
+}
+STAGE_HELP = "Time spent in the stages of the event handlers"
+# Held events and datagrams of a new device handled between other work
+HELD_BATCH_SIZE = 20
+
 
 @dataclass
 class HostPortConfig:
@@ -95,6 +150,10 @@ class MqttConfig(HostPortConfig):
     username: str | None = None
     password: str | None = None
     debug: bool = False
+    max_rate: float = 0
+    max_inflight: int = MQTT_MAX_INFLIGHT
+    changes_only: bool = False
+    full_state_interval: int = FULL_STATE_INTERVAL
 
 
 @dataclass
@@ -105,6 +164,38 @@ class WeatherFlowUdpConfig(HostPortConfig):
     port: int = 50222
 
 
+class HoldingListener(WeatherFlowListener):
+    """UDP listener holding the datagrams of the devices being set up.
+
+    `held` maps the serial numbers of the held devices to the calls waiting
+    for them. This overrides `_process_message` of the pyweatherflowudp
+    version pinned in requirements.txt, so check it when upgrading.
+    """
+
+    def __init__(
+        self, host: str, port: int, held: dict[str, deque[Callable[[], None]]]
+    ) -> None:
+        """Initialize the listener."""
+        super().__init__(host, port)
+        # The callbacks are a class attribute, so every listener would call the
+        # callbacks of all listeners
+        self._listeners = {}
+        self._held = held
+
+    def _process_message(self, data: bytes) -> None:
+        """Process a UDP message, unless its device is held."""
+        # The datagram is only decoded here while a new device is held
+        if self._held:
+            try:
+                serial_number = json.loads(data).get(DATA_SERIAL_NUMBER)
+            except (ValueError, AttributeError):
+                serial_number = None
+            if (held := self._held.get(serial_number)) is not None:
+                held.append(partial(super()._process_message, data))
+                return
+        super()._process_message(data)
+
+
 class WeatherFlowMqtt:
     """Class to handle WeatherFlow to MQTT communication."""
 
@@ -117,27 +208,51 @@ class WeatherFlowMqtt:
         rapid_wind_interval: int = 0,
         language: str = LANGUAGE_ENGLISH,
         mqtt_config: MqttConfig = MqttConfig(),
-        udp_config: WeatherFlowUdpConfig = WeatherFlowUdpConfig(),
+        udp_config: WeatherFlowUdpConfig
+        | list[WeatherFlowUdpConfig] = WeatherFlowUdpConfig(),
         forecast_config: ForecastConfig = None,
         database_file: str = None,
+        database_config: DatabaseConfig = DatabaseConfig(),
+        history_api_config: HistoryApiConfig | None = None,
+        metrics_config: MetricsConfig | None = None,
+        profiler_config: ProfilerConfig = ProfilerConfig(),
         filter_sensors: list[str] | None = None,
         invert_filter: bool = False,
+        archive_pressure: bool = True,
+        archive_observations: bool = True,
+        force_discovery: bool = False,
+        publish_limits: dict[str, dict[str, Any]] | None = None,
         zambretti_min_pressure = ZAMBRETTI_MIN_PRESSURE,
         zambretti_max_pressure = ZAMBRETTI_MAX_PRESSURE
     ) -> None:
-        """Initialize a WeatherFlow MQTT."""
+        """Initialize a WeatherFlow MQTT.
+
+        With a list of `udp_config`, a listener is started for each of them. The
+        stations heard on all listeners share the MQTT client and the database.
+        """
         self.elevation = elevation
         self.latitude = latitude
         self.longitude = longitude
         self.unit_system = unit_system
-        self.rapid_wind_interval = rapid_wind_interval
+        self._publish_limits = publish_limits or {}
+        self.rapid_wind_interval = max(
+            [rapid_wind_interval]
+            + [
+                self._with_publish_limits(sensor).min_interval
+                for sensor in DEVICE_SENSORS
+                if sensor.event == EVENT_RAPID_WIND
+            ]
+        )
         self.sealevel_pressure_all_high = zambretti_max_pressure
         self.sealevel_pressure_all_low = zambretti_min_pressure
 
         self.cnv = ConversionFunctions(unit_system, language)
+        self.archive_pressure = archive_pressure
+        self.archive = ObservationArchive() if archive_observations else None
 
         self.mqtt_config = mqtt_config
-        self.udp_config = udp_config
+        self.udp_configs = udp_config if isinstance(udp_config, list) else [udp_config]
+        self.state_filter = StateFilter(mqtt_config.full_state_interval * 60)
 
         self.forecast = (
             Forecast.from_config(config=forecast_config, conversions=self.cnv)
@@ -146,43 +261,127 @@ class WeatherFlowMqtt:
         )
 
         self.mqtt_client: MqttClient = None
-        self.listener: WeatherFlowListener | None = None
+        self.listeners: list[WeatherFlowListener] = []
         self._queue: asyncio.Queue | None = None
         self._queue_task: asyncio.Task | None = None
-        self._init_sql_db(database_file=database_file)
+        self.publisher: MqttPublisher | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._init_sql_db(database_file=database_file, database_config=database_config)
+        self.history_api = (
+            HistoryApi(
+                database_file,
+                history_api_config,
+                settle_time=ARCHIVE_WRITE_INTERVAL + database_config.flush_interval,
+            )
+            if history_api_config is not None
+            else None
+        )
+        self._database_file = database_file
+        self._metrics_config = metrics_config
+        self.metrics = Metrics() if metrics_config is not None else None
+        self._profile = profiler_config.enabled
+        self.profiler = SamplingProfiler(profiler_config)
+
+        # Hashes of the retained discovery payloads the MQTT server already has,
+        # read before the database writer starts
+        if force_discovery:
+            self.sql.clearDiscoveryHashes()
+        self._discovery_hashes: dict[str, str] = self.sql.readDiscoveryHashes()
+        self._new_discovery_hashes: dict[str, str] = {}
+        self._devices: dict[str, WeatherFlowDevice] = {}
 
         self._filter_sensors = filter_sensors
         self._invert_filter = invert_filter
+        self._sensor_graphs: dict[str, SensorGraph] = {}
+        self._limited_sensors: dict[str, list[BaseSensorDescription]] = {}
+
+        # Stations by hub serial number, and by the serial numbers of their devices
+        self._stations: dict[str, Station] = {}
+        self._device_stations: dict[str, Station] = {}
+        # Stations being read from the database by hub serial number, and the
+        # events and datagrams of their new devices held until then
+        self._station_loads: dict[str, asyncio.Task] = {}
+        self._held: dict[str, deque[Callable[[], None]]] = {}
+        self._held_events: set[str] = set()
+        self._device_setups: set[asyncio.Task] = set()
 
         # Set timer variables
         self._forecast_next_run: float = 0
-        self.rapid_last_run = 1621229580.583215  # A time in the past
-        self.high_low_last_run = 1621229580.583215  # A time in the past
+        self._forecast_task: asyncio.Task | None = None
+        self._prune_task: asyncio.Task | None = None
+        self._published_forecast: tuple[str, ...] | None = None
+        self.history_last_write = time.monotonic()
         self.current_day = datetime.today().weekday()
         self.last_midnight = self.cnv.utc_last_midnight()
 
-        # Read stored Values and set variable values
-        self.fog_probability = None
-        self.wind_speed = None
-        self.snow_probability = None
-        self.solar_radiation = None
-        self.solar_elevation = None
-        self.solar_insolation = None
-
+        if self.metrics is not None:
+            self._init_metrics()
 
-        # Zambretti Forecast Vars
-        self.wind_bearing_avg = None
-        self.sealevel_pressure = None
-        self.pressure_trend = None
-        self.zambretti_number = None
+        # From here on the database is only used by its writer thread
+        self.db.start()
 
     @property
     def is_imperial(self) -> bool:
         """Return `True` if the unit system is imperial, else `False`."""
         return self.unit_system == UNITS_IMPERIAL
 
+    @property
+    def is_listening(self) -> bool:
+        """Return `True` if one of the UDP listeners is listening."""
+        return any(listener.is_listening for listener in self.listeners)
+
     async def connect(self) -> None:
         """Connect to MQTT and UDP."""
+        self.connect_mqtt()
+
+        for udp_config in self.udp_configs:
+            listener = self.create_listener(udp_config)
+            try:
+                await listener.start_listening()
+                _LOGGER.info(
+                    "The UDP server is listening on %s:%s",
+                    udp_config.host,
+                    udp_config.port,
+                )
+            except Exception as e:
+                _LOGGER.error(
+                    "Could not start listening to the UDP Socket on %s:%s. Error is: %s",
+                    udp_config.host,
+                    udp_config.port,
+                    e,
+                )
+                sys.exit(1)
+            self.listeners.append(listener)
+
+        if self.forecast is not None:
+            await self.forecast.open()
+
+        if self.history_api is not None:
+            try:
+                await self.history_api.start()
+            except OSError as e:
+                _LOGGER.error("Could not start the History API. Error is: %s", e)
+                self.history_api = None
+
+        if self.metrics is not None:
+            try:
+                await self.metrics.start(self._metrics_config)
+            except OSError as e:
+                _LOGGER.error("Could not serve the metrics. Error is: %s", e)
+
+        if self._profile:
+            self.profiler.start()
+
+        self.start_publisher()
+
+        if self.forecast is not None:
+            # Publish the forecast of the last run until it is refreshed
+            self._publish_forecast(self.forecast.current_forecast())
+            self._forecast_task = asyncio.ensure_future(self._update_forecast())
+
+    def connect_mqtt(self) -> None:
+        """Connect to the MQTT server."""
+        self._loop = asyncio.get_running_loop()
         if self.mqtt_client is None:
             self._setup_mqtt_client()
 
@@ -200,79 +399,296 @@ class WeatherFlowMqtt:
             _LOGGER.error("Could not connect to MQTT Server. Error is: %s", e)
             sys.exit(1)
 
-        self.listener = WeatherFlowListener(self.udp_config.host, self.udp_config.port)
-        self.listener.on(
+    def create_listener(
+        self, udp_config: WeatherFlowUdpConfig | None = None
+    ) -> WeatherFlowListener:
+        """Return a UDP listener handing the discovered devices to this instance."""
+        udp_config = udp_config or self.udp_configs[0]
+        listener = HoldingListener(udp_config.host, udp_config.port, self._held)
+        listener.on(
             EVENT_DEVICE_DISCOVERED, lambda device: self._device_discovered(device)
         )
-        try:
-            await self.listener.start_listening()
-            _LOGGER.info("The UDP server is listening on port %s", self.udp_config.port)
-        except Exception as e:
-            _LOGGER.error(
-                "Could not start listening to the UDP Socket. Error is: %s", e
+        if self.metrics is not None:
+            self.metrics.wrap(
+                listener,
+                "_process_message",
+                "udp_callback_seconds",
+                "Time spent handling a received datagram",
             )
-            sys.exit(1)
+        return listener
 
+    def start_publisher(self) -> None:
+        """Start publishing the queued messages with the MQTT client."""
         self._queue = asyncio.Queue()
-        self._queue_task = asyncio.ensure_future(self._mqtt_queue_processor())
+        self.publisher = MqttPublisher(
+            self.mqtt_client,
+            self._queue,
+            max_rate=self.mqtt_config.max_rate,
+            max_inflight=self.mqtt_config.max_inflight,
+        )
+        self._queue_task = asyncio.ensure_future(self.publisher.run())
+        if self.metrics is not None:
+            self.metrics.wrap(
+                self.publisher,
+                "_publish",
+                "mqtt_publish_seconds",
+                "Time spent handing a message to the MQTT client",
+            )
+
+    async def close(self) -> None:
+        """Stop listening, and write all pending data before exiting."""
+        for listener in self.listeners:
+            await listener.stop_listening()
+        # Handle the held events of the devices still being set up
+        if self._device_setups:
+            await asyncio.wait(self._device_setups)
+        if self._forecast_task is not None:
+            self._forecast_task.cancel()
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+        if self.forecast is not None:
+            await self.forecast.close()
+        if self.history_api is not None:
+            await self.history_api.stop()
+        if self.metrics is not None:
+            await self.metrics.stop()
+        self.profiler.stop()
+        await asyncio.get_running_loop().run_in_executor(None, self.profiler.join)
+
+        for station in self._stations.values():
+            station.write_high_low()
+        self._write_history()
+        self._write_archive()
+        self._write_discovery_hashes()
+        await self.db.close()
+
+        if self._queue_task is not None:
+            self._queue_task.cancel()
+        if self.mqtt_client is not None:
+            self.mqtt_client.loop_stop()
+            self.mqtt_client.disconnect()
 
     async def run_time_based_updates(self) -> None:
         """Run some time based updates."""
         # Run New day function if Midnight
         if self.current_day != datetime.today().weekday():
-            self.storage["rain_yesterday"] = self.storage["rain_today"]
-            self.storage["rain_duration_yesterday"] = self.storage[
-                "rain_duration_today"
-            ]
-            self.storage["rain_today"] = 0
-            self.storage["rain_duration_today"] = 0
-            self.storage["lightning_count_today"] = 0
             self.last_midnight = self.cnv.utc_last_midnight()
-            self.sql.writeStorage(self.storage)
-            self.sql.dailyHousekeeping()
+            for station in self._stations.values():
+                station.new_day()
+            if self._prune_task is None or self._prune_task.done():
+                self._prune_task = asyncio.ensure_future(self._prune_history())
             self.current_day = datetime.today().weekday()
 
-        if self.forecast is not None:
+        if time.monotonic() - self.history_last_write >= HISTORY_WRITE_INTERVAL:
+            self._write_history()
+        if self.archive is not None and self.archive.due():
+            self._write_archive()
+
+        # Unless the forecast is still being fetched at startup
+        if self.forecast is not None and (
+            self._forecast_task is None or self._forecast_task.done()
+        ):
             await self._update_forecast()
 
+        if self.publisher is not None:
+            _LOGGER.debug("MQTT publisher: %s", self.publisher.stats())
+        _LOGGER.debug("Database: %s", self.db.stats())
+
+    def _encode_state(self, state: dict[str, Any]) -> str:
+        """Return the JSON payload of an observation state."""
+        return json.dumps(state)
+
     def _add_to_queue(
-        self, topic: str, payload: str | None = None, qos: int = 0, retain: bool = False
+        self,
+        topic: str,
+        payload: str | None = None,
+        qos: int = 0,
+        retain: bool = False,
+        on_ack: Callable[[], None] | None = None,
     ) -> None:
         """Add an item to the queue."""
-        self._queue.put_nowait((topic, payload, qos, retain))
+        self._queue.put_nowait(
+            (topic, payload, qos, retain, time.monotonic(), on_ack)
+        )
+
+    def _add_discovery_to_queue(
+        self,
+        topic: str,
+        payload: str | None = None,
+        qos: int = 1,
+        retain: bool = True,
+        force: bool = False,
+    ) -> None:
+        """Add a discovery item to the queue, unless it was published before.
+
+        The hash is stored once the MQTT server acknowledged the payload, so
+        a payload that was lost is published again after a restart.
+        """
+        digest = hashlib.sha1((payload or "").encode()).hexdigest()
+        if not force and self._discovery_hashes.get(topic) == digest:
+            return
+        self._discovery_hashes[topic] = digest
+        self._add_to_queue(
+            topic,
+            payload,
+            qos=qos,
+            retain=retain,
+            on_ack=partial(self._discovery_acknowledged, topic, digest),
+        )
+
+    def _discovery_acknowledged(self, topic: str, digest: str) -> None:
+        """Store the hash of an acknowledged discovery payload."""
+        if not self._new_discovery_hashes:
+            # Store the hashes acknowledged meanwhile at once
+            asyncio.get_running_loop().call_soon(self._write_discovery_hashes)
+        self._new_discovery_hashes[topic] = digest
+
+    def _write_discovery_hashes(self) -> None:
+        """Store the hashes of the acknowledged discovery payloads."""
+        if self._new_discovery_hashes and not self.db.closed:
+            self.db.write(self.sql.writeDiscoveryHashes, self._new_discovery_hashes)
+        self._new_discovery_hashes = {}
+
+    async def _get_station(self, device: WeatherFlowSensorDevice) -> Station:
+        """Return the station of the hub the device reports to."""
+        if (station := self._device_stations.get(device.serial_number)) is None:
+            if (station := self._stations.get(device.hub_sn)) is None:
+                # The devices of a hub found at once share one read
+                if (load := self._station_loads.get(device.hub_sn)) is None:
+                    load = self._station_loads[device.hub_sn] = asyncio.ensure_future(
+                        Station.load(
+                            device.hub_sn,
+                            self.db,
+                            self.unit_system,
+                            archive_pressure=self.archive_pressure,
+                        )
+                    )
+                station = await load
+                self._stations[device.hub_sn] = station
+                self._station_loads.pop(device.hub_sn, None)
+            self._device_stations[device.serial_number] = station
+        return station
+
+    def _create_sensor_graph(self, device: WeatherFlowSensorDevice) -> SensorGraph:
+        """Create the sensor graph evaluating the observations of a device.
+
+        This is done once per device, so the observation handler only calculates
+        the sensors the device actually reports and that are enabled (or needed
+        as an input to an enabled sensor).
+        """
+        sensors = [
+            self._with_publish_limits(sensor)
+            for sensor in DEVICE_SENSORS
+            if sensor.event not in (EVENT_RAPID_WIND, EVENT_STATUS_UPDATE)
+            and hasattr(device, sensor.device_attr)
+            and not (
+                sensor.id == "battery_mode" and not isinstance(device, TempestDevice)
+            )
+        ]
+        required = required_sensors(
+            sensors,
+            (sensor.id for sensor in sensors if self._is_sensor_enabled(sensor.id)),
+        )
+
+        station = self._device_stations[device.serial_number]
+        altitude = self.elevation * UNIT_METERS
+        is_tempest = isinstance(device, TempestDevice)
+        context: dict[str, Callable[[], Any]] = {
+            "altitude": lambda: altitude,
+            "elevation": lambda: self.elevation,
+            "is_tempest": lambda: is_tempest,
+            "latitude": lambda: self.latitude,
+            "lightning_counter": lambda: station.lightning_counter,
+            "longitude": lambda: self.longitude,
+            "pressure_history": lambda: station.pressure_history,
+            "sealevel_pressure_all_high": lambda: self.sealevel_pressure_all_high,
+            "sealevel_pressure_all_low": lambda: self.sealevel_pressure_all_low,
+            "translations": lambda: self.cnv.translations,
+            "wind_speed": lambda: station.wind_speed,
+        }
+
+        return SensorGraph(
+            sensors=(sensor for sensor in sensors if sensor.id in required),
+            device=device,
+            cnv=self.cnv,
+            storage=station.storage,
+            is_imperial=self.is_imperial,
+            context=context,
+            station_values=station.values,
+        )
 
     def _device_discovered(self, device: WeatherFlowDevice) -> None:
         """Handle a discovered device."""
 
         def _load_complete():
             _LOGGER.debug("Found device: %s", device)
-            self._setup_sensors(device)
-            device.on(
-                EVENT_STATUS_UPDATE,
-                lambda event: self._handle_status_update_event(device, event),
+            if isinstance(device, WeatherFlowSensorDevice):
+                # Hold the events until the station is read from the database
+                self._held[device.serial_number] = deque()
+                self._held_events.add(device.serial_number)
+                task = asyncio.ensure_future(self._setup_sensor_device(device))
+                self._device_setups.add(task)
+                task.add_done_callback(self._device_setups.discard)
+            else:
+                self._setup_sensors(device)
+            self._on_event(
+                device, EVENT_STATUS_UPDATE, self._handle_status_update_event
             )
             if isinstance(device, WeatherFlowSensorDevice):
-                device.on(
-                    EVENT_OBSERVATION,
-                    lambda event: self._handle_observation_event(device, event),
+                self._on_event(
+                    device, EVENT_OBSERVATION, self._handle_observation_event
                 )
                 if isinstance(device, AirSensorType):
-                    device.on(
-                        EVENT_STRIKE,
-                        lambda event: self._handle_strike_event(device, event),
-                    )
+                    self._on_event(device, EVENT_STRIKE, self._handle_strike_event)
                 if isinstance(device, SkySensorType):
-                    device.on(
-                        EVENT_RAPID_WIND,
-                        lambda event: self._handle_wind_event(device, event),
-                    )
-                    device.on(
-                        EVENT_RAIN_START,
-                        lambda event: self._handle_rain_start_event(device, event),
+                    self._on_event(device, EVENT_RAPID_WIND, self._handle_wind_event)
+                    self._on_event(
+                        device, EVENT_RAIN_START, self._handle_rain_start_event
                     )
 
         device.on(EVENT_LOAD_COMPLETE, lambda _: _load_complete())
 
+    def _on_event(
+        self,
+        device: WeatherFlowDevice,
+        event_name: str,
+        handler: Callable[[Any, CustomEvent], None],
+    ) -> None:
+        """Pass the events of a device to the handler, unless they are held."""
+        serial_number = device.serial_number
+
+        def dispatch(event: CustomEvent) -> None:
+            if serial_number in self._held_events:
+                self._held[serial_number].append(partial(handler, device, event))
+            else:
+                handler(device, event)
+
+        device.on(event_name, dispatch)
+
+    async def _setup_sensor_device(self, device: WeatherFlowSensorDevice) -> None:
+        """Set up a device once its station is read, then handle its events.
+
+        The datagrams of the device received meanwhile are parsed after its held
+        events, so the handlers see the values of their event. They are handled
+        in batches, and the device is held until all of them are done.
+        """
+        try:
+            await self._get_station(device)
+            self._setup_sensors(device)
+            # The events of the held datagrams are handled as they are parsed
+            self._held_events.discard(device.serial_number)
+            held = self._held[device.serial_number]
+            handled = 0
+            while held:
+                held.popleft()()
+                if (handled := handled + 1) % HELD_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+        except Exception as e:
+            _LOGGER.error("Could not set up %s. Error: %s", device.serial_number, e)
+        finally:
+            self._held_events.discard(device.serial_number)
+            self._held.pop(device.serial_number, None)
+
     def _get_sensor_payload(
         self,
         sensor: BaseSensorDescription,
@@ -318,164 +734,105 @@ class WeatherFlowMqtt:
     ) -> None:
         """Handle an observation event."""
         _LOGGER.debug("Observation event from: %s", device)
+        station = self._device_stations[device.serial_number]
 
-        # Set some class level variables to help with sensors that may not have all data points available
-        if (val := getattr(device, "solar_radiation", None)) is not None:
-            self.solar_radiation = val.m
         if (
             val := getattr(device, "rain_accumulation_previous_minute", None)
         ) is not None:
             if val.m > 0:
-                self.storage["rain_today"] += val.m
-                self.storage["rain_duration_today"] += 1
-                self.sql.writeStorage(self.storage)
-
-        event_data: dict[str, OrderedDict] = {}
-
-        for sensor in DEVICE_SENSORS:
-            # Skip if this device is missing the attribute
-            if (
-                sensor.event in (EVENT_RAPID_WIND, EVENT_STATUS_UPDATE)
-                or not hasattr(device, sensor.device_attr)
-                or (
-                    sensor.id == "battery_mode"
-                    and not isinstance(device, TempestDevice)
-                )
-            ):
-                continue
+                station.add_rain(1, val.m)
 
-            attr = getattr(device, sensor.device_attr)
+        event_data = self._sensor_graphs[device.serial_number].evaluate()
+        data = event_data[EVENT_OBSERVATION]
 
-            if sensor.event not in event_data:
-                event_data[sensor.event] = OrderedDict()
+        if data.get("sealevel_pressure") is not None:
+            station.pressure_history.add(data["sealevel_pressure"])
 
-            try:
-                if isinstance(sensor, SensorDescription):
-                    # TODO: Handle unique data points more elegantly...
-                    if sensor.id == "pressure_trend":
-                        continue
-
-                    if isinstance(attr, Callable):
-                        inputs = {}
-                        if "altitude" in sensor.inputs:
-                            inputs["altitude"] = self.elevation * UNIT_METERS
-                        attr = attr(**inputs)
-
-                    # Check for a custom function
-                    _data = event_data[EVENT_OBSERVATION]
-
-                    if (fn := sensor.custom_fn) is not None:
-                        # TODO: Handle unique data points more elegantly
-                        if sensor.id == "feelslike":
-                            attr = fn(self.cnv, device, self.wind_speed)
-                        elif sensor.id in ("visibility"):
-                            attr = fn(self.cnv, device, self.elevation)
-                        elif sensor.id == "wbgt":
-                            attr = fn(self.cnv, device, self.solar_radiation)
-                        elif sensor.id == "solar_elevation":
-                            self.solar_elevation = fn(self.cnv, self.latitude, self.longitude)
-                            attr = self.solar_elevation
-                        elif sensor.id == "solar_insolation":
-                            self.solar_insolation = fn(self.cnv, self.elevation, self.latitude, self.longitude)
-                            attr = self.solar_insolation
-                        elif sensor.id == "zambretti_number":
-                            self.zambretti_number = fn(self.cnv, self.latitude, _data.get("wind_bearing_avg"), self.sealevel_pressure_all_high, self.sealevel_pressure_all_low, self.pressure_trend, self.sealevel_pressure)
-                            attr = self.zambretti_number
-                        elif sensor.id == "zambretti_text":
-                            attr = fn(self.cnv, self.zambretti_number)
-                        elif sensor.id == "fog_probability":
-                            self.fog_probability = fn(self.cnv, self.solar_elevation, self.wind_speed, _data.get("relative_humidity"), _data.get("dewpoint"), _data.get("air_temperature"))
-                            attr = self.fog_probability
-                        elif sensor.id == "snow_probability":
-                            self.snow_probability = fn(self.cnv, device, _data.get("freezing_level"), _data.get("cloud_base"), self.elevation)
-                            attr = self.snow_probability
-                        elif sensor.id == "current_conditions":
-                            attr = fn(self.cnv, _data.get("lightning_strike_count_1hr"), _data.get("precipitation_type"), _data.get("rain_rate"),  self.wind_speed, self.solar_elevation, self.solar_radiation, self.solar_insolation, self.snow_probability, self.fog_probability)
-                        else:
-                            attr = fn(self.cnv, device)
-
-                        # Check if a description is included
-                        if sensor.has_description and isinstance(attr, tuple):
-                            (
-                                attr,
-                                event_data[sensor.event][f"{sensor.id}_description"],
-                            ) = attr
-
-                    # Check if the attr is a Quantity object
-                    elif isinstance(attr, Quantity):
-                        # See if conversion is needed
-                        if (
-                            unit := sensor.imperial_unit
-                            if self.is_imperial
-                            else sensor.metric_unit
-                        ) is not None:
-                            attr = attr.to(unit)
-
-                        # Set the attribute to the Quantity's magnitude
-                        attr = attr.m
-
-                    # Check if rounding is needed
-                    if (
-                        attr is not None
-                        and (decimals := sensor.decimals[1 if self.is_imperial else 0])
-                        is not None
-                    ):
-                        attr = round(attr, decimals)
-
-                elif isinstance(sensor, SqlSensorDescription):
-                    attr = sensor.sql_fn(self.sql)
-
-                elif isinstance(sensor, StorageSensorDescription):
-                    attr = sensor.value(self.storage)
-
-                    if (fn := sensor.cnv_fn) is not None:
-                        attr = fn(self.cnv, attr)
-
-                # Handle timestamp None value
-                if sensor.device_class == DEVICE_CLASS_TIMESTAMP and attr is None:
-                    continue
-
-                # Set the attribute in the payload
-                event_data[sensor.event][sensor.id] = attr
-                _LOGGER.debug("Setting payload: %s = %s", sensor.id, attr)
-            except Exception as ex:
-                _LOGGER.error("Error setting sensor data for %s: %s", sensor.id, ex)
+        # Keep the values, so other devices of the station can use them as inputs
+        for values in event_data.values():
+            station.values.update(values)
 
-        data = event_data[EVENT_OBSERVATION]
+        if self.mqtt_config.changes_only:
+            self._publish_changed_states(device, event_data)
+        else:
+            data["last_reset_midnight"] = self.last_midnight
+
+            published = self._hold_limited_states(device, event_data)
+            for (evt, data) in published.items():
+                if data:
+                    state_topic = MQTT_TOPIC_FORMAT.format(
+                        DEVICE_SERIAL_FORMAT.format(device.serial_number),
+                        evt,
+                        "state",
+                    )
+                    self._add_to_queue(state_topic, self._encode_state(data))
 
-        # TODO: Handle unique data points more elegantly...
-        if data.get("sealevel_pressure") is not None:
-            (
-                data["pressure_trend"],
-                data["pressure_trend_value"],
-            ) = self.sql.readPressureTrend(
-                data["sealevel_pressure"], self.cnv.translations
-            )
-            self.pressure_trend = data["pressure_trend_value"]
-            self.sealevel_pressure = data["sealevel_pressure"]
-            self.sql.writePressure(data["sealevel_pressure"])
+        station.high_low.update(event_data[EVENT_OBSERVATION])
 
-        data["last_reset_midnight"] = self.last_midnight
+        if self.archive is not None:
+            self.archive.add(device)
+            if self.archive.due():
+                self._write_archive()
 
-        for (evt, data) in event_data.items():
-            if data:
-                state_topic = MQTT_TOPIC_FORMAT.format(
-                    DEVICE_SERIAL_FORMAT.format(device.serial_number), evt, "state"
-                )
-                self._add_to_queue(state_topic, json.dumps(data))
+        self._send_high_low_update(device=device, station=station)
 
-        self.sql.updateHighLow(event_data[EVENT_OBSERVATION])
-        # self.sql.updateDayData(event_data[EVENT_OBSERVATION])
+    def _publish_changed_states(
+        self, device: WeatherFlowSensorDevice, event_data: dict[str, OrderedDict]
+    ) -> None:
+        """Publish the sensor states that changed, each to its own topic."""
+        domain_serial = DEVICE_SERIAL_FORMAT.format(device.serial_number)
+        now = time.monotonic()
+        full_state = self.state_filter.full_state_due(device.serial_number, now)
+
+        for sensor in self._sensor_graphs[device.serial_number].sensors:
+            if not self._is_sensor_enabled(sensor.id):
+                continue
+            data = event_data[sensor.event]
+            state = {key: data[key] for key in output_keys(sensor) if key in data}
+            if not state:
+                continue
+            state_topic = MQTT_TOPIC_FORMAT.format(domain_serial, sensor.id, "state")
+            if self.state_filter.publish(
+                state_topic, state, now, state.get(sensor.id), sensor, force=full_state
+            ):
+                self._add_to_queue(state_topic, self._encode_state(state))
+
+    def _hold_limited_states(
+        self, device: WeatherFlowSensorDevice, event_data: dict[str, OrderedDict]
+    ) -> dict[str, OrderedDict]:
+        """Return the event data, holding the values within the publish limits.
+
+        Sensors with a new value before their minimum interval passed, or
+        within their deadband until then, keep the last published value.
+        """
+        domain_serial = DEVICE_SERIAL_FORMAT.format(device.serial_number)
+        now = time.monotonic()
+        held: dict[str, OrderedDict] | None = None
+
+        for sensor in self._limited_sensors[device.serial_number]:
+            data = event_data[sensor.event]
+            state = {key: data[key] for key in output_keys(sensor) if key in data}
+            if not state:
+                continue
+            state_topic = MQTT_TOPIC_FORMAT.format(domain_serial, sensor.id, "state")
+            if self.state_filter.publish(
+                state_topic, state, now, state.get(sensor.id), sensor
+            ):
+                continue
+            if held is None:
+                held = {evt: OrderedDict(data) for evt, data in event_data.items()}
+            held[sensor.event].update(self.state_filter.last_state(state_topic))
 
-        self._send_high_low_update(device=device)
+        return held or event_data
 
     def _handle_rain_start_event(
         self, device: SkySensorType, event: RainStartEvent
     ) -> None:
         """Handle a rain start event."""
         _LOGGER.debug("Rain start event from: %s", device)
-        self.storage["rain_start"] = event.epoch
-        self.sql.writeStorage(self.storage)
+        station = self._device_stations[device.serial_number]
+        station.storage["rain_start"] = event.epoch
+        station.write_storage()
 
     def _handle_status_update_event(
         self, device: HubDevice | WeatherFlowSensorDevice, event: CustomEvent
@@ -500,6 +857,9 @@ class WeatherFlowMqtt:
 
         if isinstance(device, HubDevice):
             attr_data["reset_flags"] = device.reset_flags
+            if self.publisher is not None:
+                attr_data["mqtt_publisher"] = self.publisher.stats()
+            attr_data["database"] = self.db.stats()
             _LOGGER.debug("HUB Reset Flags: %s", device.reset_flags)
         else:
             attr_data["voltage"] = device._voltage
@@ -526,12 +886,14 @@ class WeatherFlowMqtt:
     ) -> None:
         """Handle a strike event."""
         _LOGGER.debug("Lightning strike event from: %s", device)
-        self.sql.writeLightning()
-        self.storage["lightning_count_today"] += 1
-        self.storage["last_lightning_distance"] = self.cnv.distance(event.distance.m)
-        self.storage["last_lightning_energy"] = event.energy
-        self.storage["last_lightning_time"] = event.epoch
-        self.sql.writeStorage(self.storage)
+        station = self._device_stations[device.serial_number]
+        station.add_strike(time.time())
+        storage = station.storage
+        storage["lightning_count_today"] += 1
+        storage["last_lightning_distance"] = self.cnv.distance(event.distance.m)
+        storage["last_lightning_energy"] = event.energy
+        storage["last_lightning_time"] = event.epoch
+        station.write_storage()
 
     def _handle_wind_event(self, device: SkySensorType, event: WindEvent) -> None:
         """Handle a wind event."""
@@ -540,41 +902,165 @@ class WeatherFlowMqtt:
         state_topic = MQTT_TOPIC_FORMAT.format(
             DEVICE_SERIAL_FORMAT.format(device.serial_number), EVENT_RAPID_WIND, "state"
         )
-        now = datetime.now().timestamp()
-        if (now - self.rapid_last_run) >= self.rapid_wind_interval:
+        now = time.monotonic()
+        if self.state_filter.due(state_topic, now, self.rapid_wind_interval):
             data["wind_speed"] = self.cnv.speed(event.speed.m)
             data["wind_bearing"] = event.direction.m
             data["wind_direction"] = self.cnv.direction(event.direction.m)
-            self.wind_speed = event.speed.m
+            self._device_stations[device.serial_number].wind_speed = event.speed.m
             self._add_to_queue(state_topic, json.dumps(data))
-            self.rapid_last_run = datetime.now().timestamp()
+            self.state_filter.publish(state_topic, data, now, force=True)
 
-    def _init_sql_db(self, database_file: str = None) -> None:
+    def _init_sql_db(
+        self,
+        database_file: str = None,
+        database_config: DatabaseConfig = DatabaseConfig(),
+    ) -> None:
         """Initialize the self.sqlite DB."""
-        self.sql = SQLFunctions(self.unit_system)
+        self.sql = SQLFunctions(
+            self.unit_system,
+            flush_interval=database_config.flush_interval,
+            synchronous=database_config.synchronous,
+            archive_days=database_config.archive_days,
+        )
         database_exist = os.path.isfile(database_file)
         self.sql.create_connection(database_file)
         if not database_exist:
             self.sql.createInitialDataset()
         # Upgrade Database if needed
         self.sql.upgradeDatabase()
+        self.db = Persistence(self.sql, max_queue=database_config.queue_size)
+
+    def _init_metrics(self) -> None:
+        """Time the stages of the pipeline, and add the gauges of the metrics."""
+        assert self.metrics
+        metrics = self.metrics
+        for method_name, event in HANDLER_EVENTS.items():
+            metrics.wrap(
+                self,
+                method_name,
+                "handler_seconds",
+                "Time spent handling the events of the devices",
+                count=(
+                    "packets_total",
+                    "Number of events received from the devices",
+                    lambda device, *args, event=event: (
+                        ("device", device.serial_number),
+                        ("event", event),
+                    ),
+                ),
+                event=event,
+            )
+        for method_name, stage in METRIC_STAGES.items():
+            metrics.wrap(self, method_name, "stage_seconds", STAGE_HELP, stage=stage)
+        metrics.wrap(self.db, "write", "stage_seconds", STAGE_HELP, stage="database")
+        if self.forecast is not None:
+            metrics.wrap(
+                self.forecast,
+                "update_forecast",
+                "forecast_update_seconds",
+                "Time spent updating the forecast",
+            )
+        for method_name, _ in inspect.getmembers(self.sql, inspect.ismethod):
+            if not method_name.startswith("_") and method_name != "batch":
+                metrics.wrap(
+                    self.sql,
+                    method_name,
+                    "sql_seconds",
+                    "Time spent in the database calls",
+                    method=method_name,
+                )
 
-        self.storage = self.sql.readStorage()
+        metrics.gauge(
+            "queue_depth",
+            lambda: {
+                (("queue", "mqtt"),): self.publisher.queue_depth
+                if self.publisher is not None
+                else 0,
+                (("queue", "database"),): self.db.queue_depth,
+            },
+            "Number of items waiting in the queues",
+        )
+        metrics.gauge(
+            "mqtt_published_total",
+            lambda: self.publisher.published if self.publisher is not None else 0,
+            "Number of messages acknowledged by the MQTT server",
+            kind="counter",
+        )
+        metrics.gauge(
+            "mqtt_publish_failures_total",
+            lambda: self.publisher.failed if self.publisher is not None else 0,
+            "Number of messages that could not be published",
+            kind="counter",
+        )
+        metrics.gauge(
+            "database_coalesced_writes_total",
+            lambda: self.db.coalesced,
+            "Number of database writes replaced by a later write of the same key",
+            kind="counter",
+        )
+        metrics.gauge(
+            "database_size_bytes",
+            lambda: sum(
+                os.path.getsize(file)
+                for file in (self._database_file, f"{self._database_file}-wal")
+                if os.path.isfile(file)
+            ),
+            "Size of the database file and its write-ahead log",
+        )
+
+    def _with_publish_limits(
+        self, sensor: BaseSensorDescription
+    ) -> BaseSensorDescription:
+        """Return the sensor with the deadband and min_interval of the config."""
+        if (limits := self._publish_limits.get(sensor.id)) is None:
+            return sensor
+        return replace(sensor, **limits)
+
+    def _is_sensor_enabled(self, sensor_id: str) -> bool:
+        """Return `True` if the sensor passes the sensor filter."""
+        return self._filter_sensors is None or (
+            (sensor_id in self._filter_sensors) is not self._invert_filter
+        )
 
-    def _send_high_low_update(self, device: WeatherFlowSensorDevice) -> None:
+    def _send_high_low_update(
+        self, device: WeatherFlowSensorDevice, station: Station
+    ) -> None:
         # Update High and Low values if it is time
         now = datetime.now().timestamp()
-        if (now - self.high_low_last_run) >= HIGH_LOW_TIMER:
+        if (now - station.high_low_last_run) >= HIGH_LOW_TIMER:
             highlow_topic = MQTT_TOPIC_FORMAT.format(
                 DEVICE_SERIAL_FORMAT.format(device.serial_number),
                 EVENT_HIGH_LOW,
                 "attributes",
             )
-            high_low_data = self.sql.readHighLow()
+            high_low_data = station.high_low.attributes()
             self._add_to_queue(
                 highlow_topic, json.dumps(high_low_data), qos=1, retain=True
             )
-            self.high_low_last_run = datetime.now().timestamp()
+            station.write_high_low()
+            station.high_low_last_run = datetime.now().timestamp()
+
+    async def _prune_history(self) -> None:
+        """Remove the old history in small batches, between the other work."""
+        total = 0
+        archive_before = await self.db.read(self.sql.markPruned)
+        while deleted := await self.db.read(self.sql.pruneHistory, archive_before):
+            total += deleted
+        self.db.write(self.sql.flush, key="flush")
+        _LOGGER.debug("Removed %s old history rows", total)
+
+    def _write_archive(self) -> None:
+        """Hand the collected raw observations to the database writer."""
+        if self.archive is not None and len(self.archive):
+            if self.db.write(self.sql.writeObservations, self.archive.rows()):
+                self.archive.clear()
+
+    def _write_history(self) -> None:
+        """Archive the new pressure samples of all stations."""
+        for station in self._stations.values():
+            station.write_history()
+        self.history_last_write = time.monotonic()
 
     def _setup_mqtt_client(self) -> MqttClient:
         """Initialize MQTT client."""
@@ -584,6 +1070,8 @@ class WeatherFlowMqtt:
             _LOGGER.debug("MQTT Credentials not needed")
 
         self.mqtt_client = client = MqttClient()
+        client.on_connect = self._on_mqtt_connect
+        client.on_message = self._on_mqtt_message
 
         if not anonymous:
             client.username_pw_set(
@@ -597,9 +1085,84 @@ class WeatherFlowMqtt:
                 self.mqtt_config.password,
             )
 
+    def _on_mqtt_connect(
+        self, client: MqttClient, userdata: Any, flags: dict, rc: int
+    ) -> None:
+        """Subscribe to the Home Assistant status when (re)connected."""
+        if rc == 0:
+            client.subscribe(HA_STATUS_TOPIC)
+            client.subscribe(PROFILE_COMMAND_TOPIC)
+
+    def _on_mqtt_message(
+        self, client: MqttClient, userdata: Any, message: MQTTMessage
+    ) -> None:
+        """Handle a message from the paho network thread."""
+        # A retained birth message is not a restart of Home Assistant
+        if (
+            message.topic == HA_STATUS_TOPIC
+            and message.payload == b"online"
+            and not message.retain
+            and self._loop is not None
+        ):
+            self._loop.call_soon_threadsafe(self._rediscover)
+        elif message.topic == PROFILE_COMMAND_TOPIC and self._loop is not None:
+            self._loop.call_soon_threadsafe(
+                self._profile_command, message.payload.decode(errors="replace")
+            )
+
+    def _profile_command(self, command: str) -> None:
+        """Start a profiling window, or stop profiling.
+
+        The command is `stop`, `start` for a window of PROFILE_WINDOW seconds,
+        or the number of seconds of the window.
+        """
+        command = command.strip().lower()
+        if command in ("stop", "off"):
+            self.profiler.stop()
+            return
+        try:
+            window = PROFILE_WINDOW if command in ("start", "on") else float(command)
+        except ValueError:
+            window = None
+        if window is None or not isfinite(window):
+            _LOGGER.warning("Unknown profile command: %s", command)
+            return
+        self.profiler.start(window)
+
+    def _rediscover(self) -> None:
+        """Publish the discovery of all devices again, as Home Assistant restarted."""
+        _LOGGER.info("Home Assistant started, sending the sensor configurations again")
+        for device in self._devices.values():
+            self._publish_discovery(device, force=True)
+        self.state_filter.request_full_state()
+
     def _setup_sensors(self, device: WeatherFlowDevice) -> None:
         """Create Sensors in Home Assistant."""
         serial_number = device.serial_number
+
+        if isinstance(device, WeatherFlowSensorDevice):
+            graph = self._sensor_graphs[serial_number] = self._create_sensor_graph(
+                device
+            )
+            if self.metrics is not None:
+                self.metrics.wrap(
+                    graph, "evaluate", "stage_seconds", STAGE_HELP, stage="sensors"
+                )
+            self._limited_sensors[serial_number] = [
+                sensor
+                for sensor in graph.sensors
+                if (sensor.deadband or sensor.min_interval)
+                and self._is_sensor_enabled(sensor.id)
+            ]
+
+        self._devices[serial_number] = device
+        self._publish_discovery(device)
+
+    def _publish_discovery(
+        self, device: WeatherFlowDevice, force: bool = False
+    ) -> None:
+        """Publish the discovery payloads that changed, or all if `force`."""
+        serial_number = device.serial_number
         domain_serial = DEVICE_SERIAL_FORMAT.format(serial_number)
 
         SENSORS = (
@@ -619,7 +1182,15 @@ class WeatherFlowMqtt:
                 # Don't add sensors for devices that don't report on that attribute
                 continue
 
-            state_topic = MQTT_TOPIC_FORMAT.format(domain_serial, sensor_event, "state")
+            state_topic = MQTT_TOPIC_FORMAT.format(
+                domain_serial,
+                sensor_id
+                if self.mqtt_config.changes_only
+                and serial_number in self._sensor_graphs
+                and sensor_event not in (EVENT_RAPID_WIND, EVENT_STATUS_UPDATE)
+                else sensor_event,
+                "state",
+            )
             attr_topic = MQTT_TOPIC_FORMAT.format(
                 domain_serial, sensor_id, "attributes"
             )
@@ -630,9 +1201,7 @@ class WeatherFlowMqtt:
             attribution = OrderedDict()
             payload: OrderedDict | None = None
 
-            if self._filter_sensors is None or (
-                (sensor_id in self._filter_sensors) is not self._invert_filter
-            ):
+            if self._is_sensor_enabled(sensor_id):
                 _LOGGER.info("Setting up %s sensor: %s", device.model, sensor.name)
 
                 # Payload
@@ -646,22 +1215,22 @@ class WeatherFlowMqtt:
                 # Attributes
                 attribution[ATTR_ATTRIBUTION] = ATTRIBUTION
 
-                # Add description if needed
-                if sensor.has_description:
+                # Add additional attributes to some sensors
+                if sensor_id == "pressure_trend":
                     payload["json_attributes_topic"] = state_topic
                     template = OrderedDict()
                     template = attribution
-                    template[
-                        "description"
-                    ] = f"{{{{ value_json.{sensor_id}_description }}}}"
+                    template["trend_value"] = "{{ value_json.pressure_trend_value }}"
                     payload["json_attributes_template"] = json.dumps(template)
 
-                # Add additional attributes to some sensors
-                if sensor_id == "pressure_trend":
+                # Add description if needed
+                elif sensor.has_description:
                     payload["json_attributes_topic"] = state_topic
                     template = OrderedDict()
                     template = attribution
-                    template["trend_value"] = "{{ value_json.pressure_trend_value }}"
+                    template[
+                        "description"
+                    ] = f"{{{{ value_json.{sensor.description_key} }}}}"
                     payload["json_attributes_template"] = json.dumps(template)
 
                 # Add extra attributes if needed
@@ -706,10 +1275,12 @@ class WeatherFlowMqtt:
                         ] = f"{{{{ value_json.{sensor_id}['min_all_time'] }}}}"
                     payload["json_attributes_template"] = json.dumps(template)
 
-            self._add_to_queue(
-                discovery_topic, json.dumps(payload or {}), qos=1, retain=True
+            self._add_discovery_to_queue(
+                discovery_topic, json.dumps(payload or {}), force=force
+            )
+            self._add_discovery_to_queue(
+                attr_topic, json.dumps(attribution), force=force
             )
-            self._add_to_queue(attr_topic, json.dumps(attribution), qos=1, retain=True)
 
         if isinstance(device, HubDevice):
             run_forecast = False
@@ -731,36 +1302,25 @@ class WeatherFlowMqtt:
                         state_topic=fcst_state_topic,
                         attr_topic=fcst_attr_topic,
                     )
-                self._add_to_queue(
-                    discovery_topic, json.dumps(payload or {}), qos=1, retain=True
+                self._add_discovery_to_queue(
+                    discovery_topic, json.dumps(payload or {}), force=force
                 )
 
-            if run_forecast:
-                asyncio.ensure_future(self._update_forecast())
+            # Unless the forecast is being fetched already, by connect
+            if run_forecast and (
+                self._forecast_task is None or self._forecast_task.done()
+            ):
+                self._forecast_task = asyncio.ensure_future(self._update_forecast())
 
         # cleanup obsolete sensors
         for sensor in OBSOLETE_SENSORS:
-            self._add_to_queue(
-                topic=MQTT_TOPIC_FORMAT.format(domain_serial, sensor, "config")
+            self._add_discovery_to_queue(
+                topic=MQTT_TOPIC_FORMAT.format(domain_serial, sensor, "config"),
+                qos=0,
+                retain=False,
+                force=force,
             )
 
-    async def _mqtt_queue_processor(self) -> None:
-        """MQTT queue processor."""
-        while True:
-            topic, payload, qos, retain = await self._queue.get()
-            await self._publish_mqtt(topic, payload, qos, retain)
-            self._queue.task_done()
-
-    async def _publish_mqtt(
-        self, topic: str, payload: str | None = None, qos: int = 0, retain: bool = False
-    ) -> None:
-        """Publish a MQTT topic with payload."""
-        try:
-            self.mqtt_client.publish(topic, payload, qos=qos, retain=retain)
-        except Exception as e:
-            _LOGGER.error("Could not connect to MQTT Server. Error is: %s", e)
-        await asyncio.sleep(0.01)
-
     async def _update_forecast(self) -> None:
         """Attempt to update the forecast."""
         # Update the Forecast if it is time and enabled
@@ -768,20 +1328,36 @@ class WeatherFlowMqtt:
         if (now := datetime.now().timestamp()) >= self._forecast_next_run:
             if any(forecast := await self.forecast.update_forecast()):
                 _LOGGER.debug("Sending updated forecast data to MQTT")
-                for topic, data in zip(("state", "attributes"), forecast):
-                    self._add_to_queue(
-                        MQTT_TOPIC_FORMAT.format(DOMAIN, FORECAST_ENTITY, topic),
-                        json.dumps(data),
-                        qos=1,
-                        retain=True,
-                    )
+                self._publish_forecast(forecast)
                 self._forecast_next_run = now + self.forecast.interval * 60
+                return
         else:
             _LOGGER.debug(
                 "Forecast update will run in ~%s minutes",
                 ceil((self._forecast_next_run - now) / 60),
             )
 
+        # Drop the hours that passed from the hourly forecast of the last update
+        self._publish_forecast(self.forecast.current_forecast())
+
+    def _publish_forecast(
+        self, forecast: tuple[OrderedDict | None, OrderedDict | None]
+    ) -> None:
+        """Publish the forecast state and attributes, if they changed."""
+        if not all(forecast):
+            return
+        payloads = tuple(json.dumps(data) for data in forecast)
+        if payloads == self._published_forecast:
+            return
+        for topic, payload in zip(("state", "attributes"), payloads):
+            self._add_to_queue(
+                MQTT_TOPIC_FORMAT.format(DOMAIN, FORECAST_ENTITY, topic),
+                payload,
+                qos=1,
+                retain=True,
+            )
+        self._published_forecast = payloads
+
 
 async def main():
     """Entry point for program."""
@@ -817,10 +1393,38 @@ async def main():
         username=config.get("MQTT_USERNAME"),
         password=config.get("MQTT_PASSWORD"),
         debug=truebool(config.get("MQTT_DEBUG")),
+        max_rate=float(config.get("MQTT_MAX_RATE", 0)),
+        max_inflight=int(config.get("MQTT_MAX_INFLIGHT", MQTT_MAX_INFLIGHT)),
+        changes_only=truebool(config.get("PUBLISH_CHANGES_ONLY")),
+        full_state_interval=int(
+            config.get("FULL_STATE_INTERVAL", FULL_STATE_INTERVAL)
+        ),
     )
 
-    udp_config = WeatherFlowUdpConfig(
-        host=config.get("WF_HOST", "0.0.0.0"), port=int(config.get("WF_PORT", 50222))
+    # Several hosts and/or ports start one listener each
+    udp_hosts = [
+        host.strip() for host in str(config.get("WF_HOST", "0.0.0.0")).split(",")
+    ]
+    udp_ports = [int(port) for port in str(config.get("WF_PORT", 50222)).split(",")]
+    if len(udp_hosts) == 1:
+        udp_hosts *= len(udp_ports)
+    elif len(udp_ports) == 1:
+        udp_ports *= len(udp_hosts)
+    if len(udp_hosts) != len(udp_ports):
+        _LOGGER.error("WF_HOST and WF_PORT must have the same number of values")
+        sys.exit(1)
+    udp_config = [
+        WeatherFlowUdpConfig(host=host, port=port)
+        for host, port in zip(udp_hosts, udp_ports)
+    ]
+
+    database_config = DatabaseConfig(
+        flush_interval=int(
+            config.get("DATABASE_FLUSH_INTERVAL", DATABASE_FLUSH_INTERVAL)
+        ),
+        synchronous=config.get("DATABASE_SYNCHRONOUS", DATABASE_SYNCHRONOUS),
+        queue_size=int(config.get("DATABASE_QUEUE_SIZE", DATABASE_QUEUE_SIZE)),
+        archive_days=int(config.get("ARCHIVE_RAW_DAYS", ARCHIVE_RAW_DAYS)),
     )
 
     forecast_config = (
@@ -828,6 +1432,7 @@ async def main():
             station_id=station_id,
             token=station_token,
             interval=int(config.get("FORECAST_INTERVAL", 30)),
+            cache_file=FORECAST_CACHE_FILE,
         )
         if (
             (station_id := config.get("STATION_ID"))
@@ -836,16 +1441,38 @@ async def main():
         else None
     )
 
+    history_api_config = (
+        HistoryApiConfig(port=history_api_port)
+        if (history_api_port := int(config.get("HISTORY_API_PORT", HISTORY_API_PORT)))
+        else None
+    )
+
+    metrics_config = (
+        MetricsConfig(port=metrics_port)
+        if (metrics_port := int(config.get("METRICS_PORT", METRICS_PORT)))
+        else None
+    )
+
+    profiler_config = ProfilerConfig(
+        enabled=truebool(config.get("PROFILE")),
+        dump_interval=int(config.get("PROFILE_DUMP_INTERVAL", PROFILE_DUMP_INTERVAL)),
+        files=int(config.get("PROFILE_FILES", PROFILE_FILES)),
+    )
+
     if truebool(config.get("DEBUG")):
         logging.getLogger().setLevel(logging.DEBUG)
 
     if isinstance(filter_sensors := config.get("FILTER_SENSORS"), str):
         filter_sensors = [sensor.strip() for sensor in filter_sensors.split(",")]
     invert_filter = truebool(config.get("INVERT_FILTER"))
+    archive_pressure = truebool(config.get("ARCHIVE_PRESSURE", True))
+    archive_observations = truebool(config.get("ARCHIVE_OBSERVATIONS", True))
+    force_discovery = truebool(config.get("FORCE_DISCOVERY"))
 
     # Read the sensor config
     if filter_sensors is None and not is_supervisor:
         filter_sensors = read_config()
+    publish_limits = None if is_supervisor else read_publish_limits()
 
     weatherflowmqtt = WeatherFlowMqtt(
         elevation=elevation,
@@ -858,17 +1485,36 @@ async def main():
         udp_config=udp_config,
         forecast_config=forecast_config,
         database_file=DATABASE,
+        database_config=database_config,
+        history_api_config=history_api_config,
+        metrics_config=metrics_config,
+        profiler_config=profiler_config,
         filter_sensors=filter_sensors,
         invert_filter=invert_filter,
+        archive_pressure=archive_pressure,
+        archive_observations=archive_observations,
+        force_discovery=force_discovery,
+        publish_limits=publish_limits,
         zambretti_min_pressure=zambretti_min_pressure,
         zambretti_max_pressure=zambretti_max_pressure,
     )
     await weatherflowmqtt.connect()
 
-    # Watch for message from the UDP socket
-    while weatherflowmqtt.listener.is_listening:
-        await asyncio.sleep(60)
-        await weatherflowmqtt.run_time_based_updates()
+    # Stop gracefully when the container is stopped
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, main_task.cancel)
+
+    try:
+        # Watch for message from the UDP socket
+        while weatherflowmqtt.is_listening:
+            await asyncio.sleep(60)
+            await weatherflowmqtt.run_time_based_updates()
+    except asyncio.CancelledError:
+        _LOGGER.info("Shutting down")
+    finally:
+        await weatherflowmqtt.close()
 
 
 async def get_supervisor_configuration() -> dict[str, Any]: